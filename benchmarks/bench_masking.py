@@ -0,0 +1,155 @@
+"""
+Row-loop vs vectorized masking benchmark.
+
+    python benchmarks/bench_masking.py --rows 10000 1000000 10000000
+
+The row loops below are the iterrows/df.at implementations the vectorized
+engine in utils/masking.py replaced. Above --legacy-max-rows the loop is
+timed on a sample of that size and extrapolated linearly (marked "est.").
+"""
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from utils.masking import mask_table
+
+ID_COLS = {"id", "scheduled_event_guid", "Patient__c", "facility_guid"}
+
+
+def legacy_apply_masking(df, fake_map, id_cols, sf_id_col='Patient__c'):
+    for idx, row in df.iterrows():
+        pid = row.get(sf_id_col)
+        if pid in fake_map:
+            fake_info = fake_map[pid]
+            for col in df.columns:
+                if col in id_cols:
+                    continue
+                if col in fake_info:
+                    df.at[idx, col] = fake_info[col]
+                else:
+                    df.at[idx, col] = "MASKED"
+    return df
+
+
+def legacy_apply_faker_to_sf(df, fake_map):
+    for idx, row in df.iterrows():
+        sf_id = row["Id"]
+        if sf_id in fake_map:
+            fake_info = fake_map[sf_id]
+            df.at[idx, "Patient_ID__c"] = fake_info.get("patient_id", "")
+            df.at[idx, "Patient_Record_Number__c"] = fake_info.get("patient_record_number", "")
+            df.at[idx, "First_Name__c"] = fake_info.get("first_name", "")
+            df.at[idx, "Last_Name__c"] = fake_info.get("last_name", "")
+            df.at[idx, "DOB__c"] = fake_info.get("dob", "")
+    return df
+
+
+def legacy_apply_faker_masking(df, fake_map):
+    for idx, row in df.iterrows():
+        mrn = row["Patient_ID__c"]
+        if mrn in fake_map:
+            fake_info = fake_map[mrn]
+            fake_id = fake_info.get("fake_id", None)
+            if not fake_id:
+                fake_id = fake_info["patient_id"].replace("-", "")[:15]
+            df.at[idx, "Id"] = fake_id
+            df.at[idx, "Patient__c"] = fake_id
+            df.at[idx, "Practice_GUID__c"] = fake_info.get("practice_guid", fake_info["patient_id"])
+            df.at[idx, "Patient_ID__c"] = fake_info["patient_id"]
+            df.at[idx, "Patient_Record_Number__c"] = fake_info["patient_record_number"]
+            df.at[idx, "First_Name__c"] = fake_info["first_name"]
+            df.at[idx, "Last_Name__c"] = fake_info["last_name"]
+            df.at[idx, "DOB__c"] = fake_info["dob"]
+            df.at[idx, "patient_name"] = f"{fake_info['first_name']} {fake_info['last_name']}"
+            df.at[idx, "provider_name"] = fake_info["provider_name"]
+            df.at[idx, "facility_guid"] = fake_info["facility_guid"]
+            df.at[idx, "facility_name"] = fake_info["facility_name"]
+            df.at[idx, "practitioner__c"] = fake_info["practitioner"]
+            df.at[idx, "appointment_type_name"] = fake_info["appointment_type"]
+    return df
+
+
+def synthetic_fake_map(n_patients):
+    """Cheap fake map with the field names used by mock_salesforcesql."""
+    return {
+        f"a0P{i:012d}": {
+            "patient_id": f"PID{i:07d}",
+            "patient_record_number": f"{i % 1000:03d}-{i % 10000:04d}",
+            "first_name": f"First{i % 5000}",
+            "last_name": f"Last{i % 20000}",
+            "dob": f"19{i % 90 + 10:02d}-01-01",
+            "patient_name": f"Patient {i}",
+            "provider_name": f"Dr. Provider {i % 300}",
+            "facility_name": f"Facility {i % 150} Medical Center",
+            "appointment_type_name": ("General Checkup", "Consultation", "Follow-up")[i % 3],
+        }
+        for i in range(n_patients)
+    }
+
+
+def synthetic_assessments(n_rows, keys, seed=0):
+    """Assessments-shaped table whose Patient__c values are drawn from `keys`."""
+    rng = np.random.default_rng(seed)
+    keys = np.asarray(keys, dtype=object)
+    pick = rng.integers(0, len(keys), n_rows)
+    return pd.DataFrame({
+        "id": np.arange(n_rows),
+        "scheduled_event_guid": np.char.add("evt-", np.arange(n_rows).astype(str)).astype(object),
+        "Patient__c": keys[pick],
+        "patient_name": "Real Name",
+        "provider_name": "Real Provider",
+        "facility_guid": "fac-guid",
+        "facility_name": "Real Facility",
+        "appointment_type_name": "Real Type",
+        "notes": "free text",
+    })
+
+
+def _time(fn, *args, **kwargs):
+    start = time.perf_counter()
+    fn(*args, **kwargs)
+    return time.perf_counter() - start
+
+
+def run(rows, legacy_max_rows):
+    results = []
+    for n_rows in rows:
+        n_patients = max(1, min(n_rows // 10, 100_000))
+        fake_map = synthetic_fake_map(n_patients)
+        df = synthetic_assessments(n_rows, list(fake_map))
+
+        vec_s = _time(mask_table, df.copy(), fake_map, ID_COLS)
+
+        legacy_rows = min(n_rows, legacy_max_rows)
+        sample = df.iloc[:legacy_rows].copy()
+        legacy_s = _time(legacy_apply_masking, sample, fake_map, ID_COLS) * (n_rows / legacy_rows)
+        estimated = legacy_rows < n_rows
+
+        results.append({
+            "rows": n_rows,
+            "legacy_s": legacy_s,
+            "legacy_estimated": estimated,
+            "vectorized_s": vec_s,
+            "speedup": legacy_s / vec_s if vec_s else float("inf"),
+        })
+        print(
+            f"{n_rows:>11,} rows | iterrows {legacy_s:10.2f}s{' (est.)' if estimated else '       '}"
+            f" | vectorized {vec_s:8.3f}s | speedup {results[-1]['speedup']:,.0f}x"
+        )
+        del df
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, nargs="+", default=[10_000, 1_000_000, 10_000_000])
+    parser.add_argument("--legacy-max-rows", type=int, default=20_000,
+                        help="largest sample the row loop is actually run on")
+    args = parser.parse_args()
+    run(args.rows, args.legacy_max_rows)
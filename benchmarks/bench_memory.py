@@ -0,0 +1,86 @@
+"""
+Memory of masked output and fake maps: object strings vs Arrow "str" vs compact.
+
+    python benchmarks/bench_memory.py --rows 10000000
+
+Masks an assessments-shaped table (benchmarks/bench_pipeline.py data, keys
+drawn from --rows / 100 patients) with the assessments plan and reports
+its in-memory size three ways: every text column as object-dtype Python
+strings (what pandas < 3 produced), as Arrow-backed "str", and as masking
+now returns it (repetitive fake columns categorical). Also compares the
+fake map as a dict of dicts with its lookup frame, and the raw table
+before and after downcast_frame (what connectors/sql.py applies on read).
+"""
+import argparse
+import os
+import sys
+import time
+import tracemalloc
+
+import pandas as pd
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from benchmarks.bench_pipeline import iter_synthetic_assessments, synthetic_patients
+from utils.compact import as_text, downcast_frame, frame_mb
+from utils.masking import build_lookup
+from utils.pools import as_fake_map, get_pools, pool_map
+from utils.rules import mask_with_rules
+
+
+def _as_object(col):
+    return as_text(col).astype(object) if not pd.api.types.is_numeric_dtype(col.dtype) else col
+
+
+def _object_mb(df):
+    """Size with text as object-dtype Python strings, one column at a time (10M rows of them need GBs)."""
+    return sum(_as_object(df[col]).memory_usage(deep=True, index=False) for col in df.columns) / 1e6
+
+
+def _traced_mb(fn):
+    tracemalloc.start()
+    try:
+        result = fn()
+        return result, tracemalloc.get_traced_memory()[0] / 1e6
+    finally:
+        tracemalloc.stop()
+
+
+def run(n_rows, n_patients=None, pool_dir=None):
+    n_patients = n_patients or max(1, n_rows // 100)
+    patients = synthetic_patients(n_patients)
+    df = next(iter_synthetic_assessments(n_rows, patients, chunk_rows=n_rows, match_rate=0.95))
+
+    fakes = pool_map(patients["Id"], get_pools(pool_dir=pool_dir))
+    lookup = build_lookup(fakes)
+    _, dict_mb = _traced_mb(lambda: as_fake_map(fakes))
+    maps = [("dict of dicts (traced)", dict_mb), ("lookup, str columns", frame_mb(fakes)),
+            ("lookup, compact", frame_mb(lookup))]
+
+    raw_mb = frame_mb(df)
+    start = time.perf_counter()
+    masked = mask_with_rules(df.copy(), lookup, "assessments", secret="bench-memory")
+    mask_s = time.perf_counter() - start
+    outputs = [("object strings", _object_mb(masked)), ("Arrow str", frame_mb(masked.apply(as_text))),
+               ("compact", frame_mb(masked))]
+    del masked
+    raw_object_mb = _object_mb(df)
+    reads = [("as read", raw_object_mb), ("downcast", frame_mb(downcast_frame(df.astype({"id": "int64"}))))]
+
+    print(f"{n_rows:,} rows, {n_patients:,} patients; masked in {mask_s:.1f}s (raw table {raw_mb:,.0f} MB)")
+    for title, rows in (("masked output", outputs), ("fake map", maps), ("raw read", reads)):
+        base = rows[0][1]
+        print(title)
+        for name, mb in rows:
+            print(f"  {name:<24}{mb:>10,.0f} MB{base / mb:>8.1f}x smaller" if mb < base else
+                  f"  {name:<24}{mb:>10,.0f} MB")
+    return {"outputs": dict(outputs), "maps": dict(maps), "reads": dict(reads)}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=10_000_000)
+    parser.add_argument("--patients", type=int, help="default: rows / 100")
+    parser.add_argument("--pool-dir", help="Faker pools cache (default: FAKER_POOL_DIR)")
+    args = parser.parse_args()
+    run(args.rows, args.patients, args.pool_dir)
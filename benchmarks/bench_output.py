@@ -0,0 +1,81 @@
+"""
+Output format benchmark: file size, write time and reload time per format.
+
+    python benchmarks/bench_output.py --rows 1000000 --chunk-rows 50000
+    python benchmarks/bench_output.py --formats csv parquet:zstd --partition-col Facility__c
+
+Writes go through utils.writers.FrameWriter in --chunk-rows chunks, the way
+stream_table writes masked tables.
+"""
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from benchmarks.bench_masking import synthetic_assessments, synthetic_fake_map
+from utils.writers import FrameWriter, output_path, read_frame
+
+FORMATS = ["csv", "csv.gz", "parquet", "parquet:zstd", "arrow", "arrow:zstd"]
+
+
+def synthetic_output(n_rows, n_facilities=50, seed=0):
+    """Masked-assessments-shaped table with a Facility__c column to partition on."""
+    fake_map = synthetic_fake_map(max(1, min(n_rows // 10, 100_000)))
+    df = synthetic_assessments(n_rows, list(fake_map), seed=seed)
+    rng = np.random.default_rng(seed)
+    df["Facility__c"] = np.char.add("a0F", rng.integers(0, n_facilities, n_rows).astype(str)).astype(object)
+    df["scheduled_date"] = np.datetime64("2024-01-01") + rng.integers(0, 365, n_rows).astype("timedelta64[D]")
+    return df
+
+
+def _size(path):
+    if os.path.isfile(path):
+        return os.path.getsize(path)
+    return sum(os.path.getsize(os.path.join(root, f)) for root, _, files in os.walk(path) for f in files)
+
+
+def run(rows, formats, chunk_rows, partition_col=None):
+    df = synthetic_output(rows)
+    workdir = tempfile.mkdtemp(prefix="bench_output_")
+    results = []
+    try:
+        for fmt in formats:
+            path = output_path(os.path.join(workdir, fmt.replace(":", "_")), fmt)
+            start = time.perf_counter()
+            with FrameWriter(path, fmt, partition_col) as writer:
+                for i in range(0, len(df), chunk_rows):
+                    writer.write(df.iloc[i:i + chunk_rows])
+            write_s = time.perf_counter() - start
+
+            start = time.perf_counter()
+            reloaded = read_frame(path, fmt)
+            read_s = time.perf_counter() - start
+            assert len(reloaded) == len(df)
+
+            results.append({"format": fmt, "bytes": _size(path), "write_s": write_s, "read_s": read_s})
+        base = results[0]
+        print(f"{rows:,} rows, {chunk_rows:,}-row chunks"
+              + (f", partitioned by {partition_col}" if partition_col else ""))
+        print(f"{'format':<14}{'size MB':>10}{'vs ' + base['format']:>12}{'write s':>10}{'reload s':>10}")
+        for r in results:
+            print(f"{r['format']:<14}{r['bytes'] / 1e6:>10.1f}{r['bytes'] / base['bytes']:>11.2f}x"
+                  f"{r['write_s']:>10.2f}{r['read_s']:>10.2f}")
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=1_000_000)
+    parser.add_argument("--chunk-rows", type=int, default=50_000)
+    parser.add_argument("--formats", nargs="+", default=FORMATS)
+    parser.add_argument("--partition-col", help="e.g. Facility__c")
+    args = parser.parse_args()
+    run(args.rows, args.formats, args.chunk_rows, args.partition_col)
@@ -0,0 +1,354 @@
+"""
+End-to-end masking pipeline benchmark on synthetic data, with a run history.
+
+    python benchmarks/bench_pipeline.py --rows 10000 1000000 --label baseline
+    python benchmarks/bench_pipeline.py --rows 50000000 --chunk-rows 500000 --format parquet
+    python benchmarks/bench_pipeline.py --compare --threshold 0.1
+
+Builds Patient__c-shaped Salesforce patients (--rows / 10, at most
+--max-patients) and streams --rows rows each of assessments- and
+superbill_report-shaped MySQL tables through the steps the mock scripts
+run, --chunk-rows at a time, so memory stays bounded at any scale:
+
+    fake_map   make_faker_map on the patients' MRNs, then build_lookup
+    normalize  superbill export headers -> standard names (utils.normalizer)
+    merge      assessments joined to patients (utils.join.stream_join)
+    mask       config/masking_rules.yaml plans (merged_patients, superbill_report)
+    write      utils.writers.FrameWriter into a temporary directory
+
+Per stage the time, rows/sec, process peak RSS when the stage last ran
+and net allocated Python blocks (sys.getallocatedblocks) are recorded;
+--trace-allocs also traces each stage's peak allocation with tracemalloc,
+which slows the run down, so traced runs are only compared with each
+other. Every run is appended to --history (JSON). --compare checks the
+latest run of each scale against the previous one (or the last run
+labelled --baseline) and exits 1 when a stage got slower, or the peak RSS
+grew, by more than --threshold.
+"""
+import argparse
+import datetime
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from contextlib import contextmanager
+from dataclasses import asdict, dataclass
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from utils.faker_map import make_faker_map
+from utils.join import stream_join
+from utils.masking import build_lookup
+from utils.normalizer import get_resolver
+from utils.rules import mask_with_rules
+from utils.streaming import peak_rss_mb
+from utils.writers import FrameWriter, output_path
+
+STAGES = ["fake_map", "normalize", "merge", "mask", "write"]
+DEFAULT_HISTORY = "bench_history.json"
+# stages faster than this are noise, not regressions
+MIN_SECONDS = 0.05
+# keyed hashes and date offsets, as in production runs (fakes still come from Faker / pools)
+MASKING_SECRET = "bench-pipeline"
+
+FIRST_NAMES = np.array(["Ana", "Ben", "Chloe", "Dev", "Eli", "Fay", "Gus", "Hana", "Ivan", "June"], dtype=object)
+LAST_NAMES = np.array(["Smith", "Jones", "Garcia", "Chen", "Patel", "Okafor", "Berg", "Silva"], dtype=object)
+APPOINTMENT_TYPES = np.array(["General Checkup", "Consultation", "Follow-up", "Urgent Care"], dtype=object)
+
+
+def _ids(prefix, numbers, width):
+    return np.char.add(prefix, np.char.zfill(numbers.astype(str), width)).astype(object)
+
+
+def _dates(rng, n, start="1935-01-01", days=365 * 70):
+    return (np.datetime64(start) + rng.integers(0, days, n).astype("timedelta64[D]")).astype(str).astype(object)
+
+
+def synthetic_patients(n_patients, n_facilities=50, seed=0):
+    """Patient__c-shaped frame, as extracted from Salesforce."""
+    rng = np.random.default_rng(seed)
+    numbers = np.arange(n_patients)
+    return pd.DataFrame({
+        "Id": _ids("a0P", numbers, 15),
+        "Practice_GUID__c": _ids("pg-", numbers % 500, 6),
+        "Patient_ID__c": _ids("", numbers, 7),
+        "Patient_Record_Number__c": _ids("PRN", numbers, 8),
+        "First_Name__c": FIRST_NAMES[rng.integers(0, len(FIRST_NAMES), n_patients)],
+        "Last_Name__c": LAST_NAMES[rng.integers(0, len(LAST_NAMES), n_patients)],
+        "DOB__c": _dates(rng, n_patients),
+        "Facility__c": _ids("a0F", rng.integers(0, n_facilities, n_patients), 4),
+    })
+
+
+def _pick(rng, patients, n_rows, match_rate):
+    """Patient row per generated row; about 1 - match_rate of them point at unknown patients (-1)."""
+    pick = rng.integers(0, len(patients), n_rows)
+    pick[rng.random(n_rows) >= match_rate] = -1
+    return pick
+
+
+def iter_synthetic_assessments(n_rows, patients, chunk_rows, match_rate=0.8, seed=1):
+    """assessments-shaped chunks (the columns mock_patients reads) for `patients`."""
+    rng = np.random.default_rng(seed)
+    ids, facilities = patients["Id"].to_numpy(), patients["Facility__c"].to_numpy()
+    for start in range(0, n_rows, chunk_rows):
+        n = min(chunk_rows, n_rows - start)
+        pick = _pick(rng, patients, n, match_rate)
+        yield pd.DataFrame({
+            "id": np.arange(start, start + n),
+            "patient_name": "Real Name",
+            "patient_date_of_birth_date_time": _dates(rng, n),
+            "provider_name": "Real Provider",
+            "facility_guid": _ids("fg-", rng.integers(0, 500, n), 6),
+            "facility_name": "Real Facility",
+            "practitioner__c": "Real Practitioner",
+            "appointment_type_name": APPOINTMENT_TYPES[rng.integers(0, len(APPOINTMENT_TYPES), n)],
+            "Patient__c": np.where(pick >= 0, ids[pick], "a0P-unknown"),
+            "Facility__c": facilities[pick],
+        })
+
+
+def iter_synthetic_superbills(n_rows, patients, chunk_rows, match_rate=0.8, seed=2):
+    """superbill_report-shaped chunks with export-style headers, keyed by MRN (patientIdDisplay)."""
+    rng = np.random.default_rng(seed)
+    mrns = patients["Patient_ID__c"].to_numpy()
+    for start in range(0, n_rows, chunk_rows):
+        n = min(chunk_rows, n_rows - start)
+        pick = _pick(rng, patients, n, match_rate)
+        yield pd.DataFrame({
+            "noteId": np.arange(start, start + n),
+            "patientIdDisplay": np.where(pick >= 0, mrns[pick], "unknown"),
+            "Given Name": FIRST_NAMES[rng.integers(0, len(FIRST_NAMES), n)],
+            "Surname": LAST_NAMES[rng.integers(0, len(LAST_NAMES), n)],
+            "Date of Birth": _dates(rng, n),
+            "cptCode": _ids("99", rng.integers(200, 500, n), 3),
+            "amount": rng.integers(50, 500, n).astype("float64"),
+        })
+
+
+@dataclass
+class StageStats:
+    seconds: float = 0.0
+    rows: int = 0
+    calls: int = 0
+    peak_rss_mb: float = None
+    alloc_blocks: int = 0
+    traced_peak_mb: float = None
+
+    @property
+    def rows_per_sec(self):
+        return self.rows / self.seconds if self.seconds else 0.0
+
+
+class StageTimer:
+    """Accumulates time, rows, RSS and allocations per named stage over many calls."""
+
+    def __init__(self, trace_allocs=False):
+        self.trace_allocs = trace_allocs
+        self.stages = {name: StageStats() for name in STAGES}
+
+    @contextmanager
+    def stage(self, name, rows=0):
+        stats = self.stages[name]
+        if self.trace_allocs:
+            tracemalloc.reset_peak()
+        blocks = sys.getallocatedblocks()
+        start = time.perf_counter()
+        yield
+        stats.seconds += time.perf_counter() - start
+        stats.alloc_blocks += sys.getallocatedblocks() - blocks
+        stats.rows += rows
+        stats.calls += 1
+        stats.peak_rss_mb = peak_rss_mb()
+        if self.trace_allocs:
+            peak = tracemalloc.get_traced_memory()[1] / 1e6
+            stats.traced_peak_mb = max(stats.traced_peak_mb or 0.0, peak)
+
+
+def run_pipeline(n_rows, chunk_rows=100_000, fmt="csv", max_patients=1_000_000, trace_allocs=False, workdir=None):
+    """One synthetic pipeline run. Returns a history record (dict)."""
+    timer = StageTimer(trace_allocs)
+    own_dir = workdir is None
+    workdir = workdir or tempfile.mkdtemp(prefix="bench_pipeline_")
+    if trace_allocs:
+        tracemalloc.start()
+    start = time.perf_counter()
+    try:
+        patients = synthetic_patients(max(1, min(n_rows // 10, max_patients)))
+        with timer.stage("fake_map", rows=len(patients)):
+            lookup = build_lookup(make_faker_map(patients["Patient_ID__c"].tolist()))
+
+        resolver = get_resolver()
+        merged_rows = 0
+        with FrameWriter(output_path(os.path.join(workdir, "joined_patient_assessment_masked"), fmt), fmt) as out:
+            for chunk in iter_synthetic_assessments(n_rows, patients, chunk_rows):
+                with timer.stage("merge", rows=len(chunk)):
+                    merged, _ = stream_join(patients, [chunk], left_on=["Id", "Facility__c"],
+                                            right_on=["Patient__c", "Facility__c"], suffixes=("_sf", "_mysql"))
+                merged_rows += len(merged)
+                with timer.stage("mask", rows=len(merged)):
+                    masked = mask_with_rules(merged, lookup, "merged_patients", secret=MASKING_SECRET)
+                with timer.stage("write", rows=len(masked)):
+                    out.write(masked)
+        with FrameWriter(output_path(os.path.join(workdir, "superbill_report_mock"), fmt), fmt) as out:
+            for chunk in iter_synthetic_superbills(n_rows, patients, chunk_rows):
+                with timer.stage("normalize", rows=len(chunk)):
+                    chunk = chunk.rename(columns=resolver.rename_map(chunk.columns))
+                with timer.stage("mask", rows=len(chunk)):
+                    masked = mask_with_rules(chunk, lookup, "superbill_report", secret=MASKING_SECRET)
+                with timer.stage("write", rows=len(masked)):
+                    out.write(masked)
+    finally:
+        if trace_allocs:
+            tracemalloc.stop()
+        if own_dir:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    return {
+        "label": None,
+        "timestamp": datetime.datetime.now().isoformat(timespec="seconds"),
+        "commit": _git_commit(),
+        "python": platform.python_version(),
+        "pandas": pd.__version__,
+        "rows": n_rows,
+        "patients": len(patients),
+        "merged_rows": merged_rows,
+        "chunk_rows": chunk_rows,
+        "format": fmt,
+        "traced": trace_allocs,
+        "total_s": time.perf_counter() - start,
+        "peak_rss_mb": peak_rss_mb(),
+        "stages": {name: {**asdict(s), "rows_per_sec": s.rows_per_sec} for name, s in timer.stages.items()},
+    }
+
+
+def _git_commit():
+    try:
+        out = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, timeout=5,
+                             cwd=os.path.dirname(os.path.abspath(__file__)))
+    except (OSError, subprocess.SubprocessError):
+        return None
+    return out.stdout.strip() or None
+
+
+def load_history(path):
+    if not os.path.exists(path):
+        return []
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def append_history(path, record):
+    history = load_history(path) + [record]
+    tmp = f"{path}.tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(history, f, indent=1)
+    os.replace(tmp, path)
+    return history
+
+
+def _same_setup(a, b):
+    return all(a.get(k) == b.get(k) for k in ("rows", "chunk_rows", "format", "traced"))
+
+
+def find_baseline(history, record, label=None):
+    """Latest earlier run with the same scale, chunking, format and tracing (and `label`, if given)."""
+    position = next(i for i in range(len(history) - 1, -1, -1) if history[i] is record)
+    for candidate in reversed(history[:position]):
+        if _same_setup(candidate, record) and (label is None or candidate.get("label") == label):
+            return candidate
+    return None
+
+
+def compare_runs(base, new, threshold=0.10, min_seconds=MIN_SECONDS):
+    """
+    Per-stage and peak-RSS changes from `base` to `new`: list of
+    (metric, base value, new value, ratio, regressed). Time is a regression
+    when it grew more than `threshold` and the stage takes at least
+    `min_seconds` in either run.
+    """
+    rows = []
+    for name in STAGES:
+        b, n = base["stages"][name]["seconds"], new["stages"][name]["seconds"]
+        ratio = n / b if b else float("inf") if n else 1.0
+        regressed = max(b, n) >= min_seconds and ratio > 1 + threshold
+        rows.append((f"{name} s", b, n, ratio, regressed))
+    if base.get("peak_rss_mb") and new.get("peak_rss_mb"):
+        ratio = new["peak_rss_mb"] / base["peak_rss_mb"]
+        rows.append(("peak RSS MB", base["peak_rss_mb"], new["peak_rss_mb"], ratio, ratio > 1 + threshold))
+    return rows
+
+
+def print_run(record):
+    label = f" [{record['label']}]" if record.get("label") else ""
+    print(f"{record['rows']:,} rows, {record['patients']:,} patients, {record['chunk_rows']:,}-row chunks, "
+          f"{record['format']}{label}: {record['total_s']:.1f}s, peak RSS {record['peak_rss_mb'] or 0:,.0f} MB")
+    print(f"{'stage':<11}{'seconds':>9}{'rows/s':>14}{'peak RSS MB':>13}{'blocks':>11}"
+          + (f"{'traced MB':>11}" if record["traced"] else ""))
+    for name in STAGES:
+        s = record["stages"][name]
+        print(f"{name:<11}{s['seconds']:>9.2f}{s['rows_per_sec']:>14,.0f}{s['peak_rss_mb'] or 0:>13,.0f}"
+              f"{s['alloc_blocks']:>11,}" + (f"{s['traced_peak_mb'] or 0:>11,.1f}" if record["traced"] else ""))
+
+
+def print_comparison(base, new, threshold):
+    """Print the comparison of two runs; returns True when something regressed."""
+    print(f"{new['rows']:,} rows: {base.get('label') or base['timestamp']} ({base.get('commit')}) -> "
+          f"{new.get('label') or new['timestamp']} ({new.get('commit')})")
+    regressed = False
+    for metric, b, n, ratio, bad in compare_runs(base, new, threshold):
+        regressed |= bad
+        print(f"  {metric:<13}{b:>10.2f}{n:>10.2f}{ratio:>8.2f}x{'  REGRESSION' if bad else ''}")
+    return regressed
+
+
+def compare_latest(history, threshold=0.10, baseline=None):
+    """Compare the latest run of every setup in `history` with its baseline; True when any regressed."""
+    latest = {}
+    for record in history:
+        latest[(record["rows"], record["chunk_rows"], record["format"], record.get("traced"))] = record
+    regressed = False
+    for record in latest.values():
+        base = find_baseline(history, record, baseline)
+        if base is None:
+            traced = ", traced" if record.get("traced") else ""
+            print(f"{record['rows']:,} rows ({record['format']}{traced}): no earlier run to compare with")
+            continue
+        regressed |= print_comparison(base, record, threshold)
+    return regressed
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, nargs="+", default=[10_000, 1_000_000],
+                        help="rows per MySQL-shaped table (10k to 50M)")
+    parser.add_argument("--chunk-rows", type=int, default=100_000)
+    parser.add_argument("--max-patients", type=int, default=1_000_000)
+    parser.add_argument("--format", default="csv", help="output format (see utils/writers.py)")
+    parser.add_argument("--trace-allocs", action="store_true", help="trace peak allocations per stage (slower)")
+    parser.add_argument("--history", default=DEFAULT_HISTORY, help="JSON file runs are appended to")
+    parser.add_argument("--label", help="name for this run, e.g. a branch or change")
+    parser.add_argument("--compare", action="store_true", help="compare the latest runs in --history, don't run")
+    parser.add_argument("--baseline", help="compare with the last run carrying this label")
+    parser.add_argument("--threshold", type=float, default=0.10, help="allowed slowdown, 0.10 = 10%%")
+    args = parser.parse_args()
+
+    if args.compare:
+        sys.exit(1 if compare_latest(load_history(args.history), args.threshold, args.baseline) else 0)
+    for n_rows in args.rows:
+        record = run_pipeline(n_rows, args.chunk_rows, args.format, args.max_patients, args.trace_allocs)
+        record["label"] = args.label
+        history = append_history(args.history, record)
+        print_run(record)
+        base = find_baseline(history, history[-1], args.baseline)
+        if base is not None:
+            print_comparison(base, record, args.threshold)
+        print()
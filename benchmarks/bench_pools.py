@@ -0,0 +1,85 @@
+"""
+Fake map generation benchmark: per-key Faker calls vs pre-generated pools.
+
+    python benchmarks/bench_pools.py --keys 1000000
+    python benchmarks/bench_pools.py --keys 200000 --faker-sample 40000
+
+The per-key Faker map (utils.faker_map.make_faker_map below POOL_MIN_KEYS)
+is timed on --faker-sample keys and extrapolated linearly to --keys; it does
+the same work per key at any size. Peak memory is measured with tracemalloc
+in a second, untimed run. Pools are built into a temporary directory first
+(a one-time cost, reported separately) unless --pool-dir points at existing
+ones.
+"""
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from utils.faker_map import make_faker_map
+from utils.pools import POOL_MIN_KEYS, POOL_SIZE, get_pools, pool_map
+
+# keys in the (traced, slow) Faker memory run; scaled up like the timing
+MEMORY_SAMPLE = 2_000
+
+
+def _timed(fn):
+    start = time.perf_counter()
+    result = fn()
+    return result, time.perf_counter() - start
+
+
+def _peak_bytes(fn):
+    """Peak traced allocation of fn() (a separate run: tracing slows Python code down several times)."""
+    tracemalloc.start()
+    try:
+        fn()
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def run(n_keys, faker_sample, pool_size=POOL_SIZE, pool_dir=None):
+    keys = [f"a0P{i:012d}" for i in range(n_keys)]
+    workdir = None if pool_dir else tempfile.mkdtemp(prefix="bench_pools_")
+    try:
+        start = time.perf_counter()
+        pools = get_pools(size=pool_size, pool_dir=pool_dir or workdir)
+        build_s = time.perf_counter() - start
+
+        # larger samples would switch make_faker_map to pools
+        sample = keys[:min(faker_sample, n_keys, POOL_MIN_KEYS - 1)]
+        _, faker_s = _timed(lambda: make_faker_map(sample))
+        scale = n_keys / len(sample)
+        memory_sample = sample[:MEMORY_SAMPLE]
+        faker_peak = _peak_bytes(lambda: make_faker_map(memory_sample)) * n_keys / len(memory_sample)
+        frame, pool_s = _timed(lambda: pool_map(keys, pools))
+        pool_peak = _peak_bytes(lambda: pool_map(keys, pools))
+        assert frame["patient_id"].is_unique and frame["patient_record_number"].is_unique
+
+        note = f" (extrapolated from {len(sample):,})" if scale > 1 else ""
+        print(f"{n_keys:,} keys, pools of {pool_size:,} values (build/load {build_s:.1f}s)")
+        print(f"{'method':<10}{'seconds':>10}{'keys/s':>14}{'peak MB':>10}")
+        print(f"{'faker':<10}{faker_s * scale:>10.2f}{len(sample) / faker_s:>14,.0f}"
+              f"{faker_peak / 1e6:>10.1f}{note}")
+        print(f"{'pools':<10}{pool_s:>10.2f}{n_keys / pool_s:>14,.0f}{pool_peak / 1e6:>10.1f}")
+        print(f"speedup: {faker_s * scale / pool_s:.1f}x")
+    finally:
+        if workdir:
+            shutil.rmtree(workdir, ignore_errors=True)
+    return {"faker_s": faker_s * scale, "pool_s": pool_s, "build_s": build_s}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--keys", type=int, default=1_000_000)
+    parser.add_argument("--faker-sample", type=int, default=20_000)
+    parser.add_argument("--pool-size", type=int, default=POOL_SIZE)
+    parser.add_argument("--pool-dir", help="reuse pools cached here (default: build into a temp dir)")
+    args = parser.parse_args()
+    run(args.keys, args.faker_sample, args.pool_size, args.pool_dir)
@@ -0,0 +1,167 @@
+"""
+patient-mocker: run masking jobs from a job config (utils/jobs.py).
+
+    patient-mocker validate [config/job.yaml]
+    patient-mocker plan [JOB]                 # row counts: SOQL COUNT() and COUNT(*) per table
+    patient-mocker run [JOB] --dry-run        # plan plus runtime / memory estimate, nothing masked
+    patient-mocker run [JOB] [--workers 8]    # plan, then mask
+    patient-mocker patients                   # mock_patients.py
+    patient-mocker secrets                    # main.py: fetch the Clark project secrets
+
+The job names the Salesforce extract, the MySQL tables and their patient
+id columns, the output format and directory, the chunk size and the
+worker counts; --workers, --fetch-workers, --chunk-size and --format
+override it. The dry-run estimate scales benchmarks/bench_pipeline.py
+history (and earlier --metrics reports passed with --history) to the
+planned rows.
+
+pandas, simple_salesforce, Faker and the database drivers are imported
+only by the command that needs them, so --help and validate return at
+once. Install the command with `pip install -e .`.
+"""
+import argparse
+import sys
+
+from utils.jobs import (JobError, check_format, count_sources, estimate_run, format_estimate, format_plan,
+                        load_history, load_job)
+
+# benchmarks/bench_pipeline.py's default --history
+BENCH_HISTORY = "bench_history.json"
+
+
+def _secrets():
+    from clark_secrets import ClarkSecretsConfig
+    from dotenv import load_dotenv
+
+    from utils.credentials import cached_project_secrets
+
+    load_dotenv(dotenv_path="env.clark")
+    return cached_project_secrets(ClarkSecretsConfig())
+
+
+def _count(job):
+    """Row counts per source: a SOQL COUNT() of the patients and COUNT(*) of each table."""
+    from connectors.salesforce import count_records, get_access_token
+    from connectors.sql import get_engine
+
+    secrets = _secrets()
+    access_token, instance_url = get_access_token(secrets["SF_URL"], secrets["SF_CLIENT_ID"],
+                                                  secrets["SF_CLIENT_SECRET"])
+    return count_sources(job, get_engine(),
+                         lambda sobject, where: count_records(instance_url, access_token, sobject, where))
+
+
+def _load(args):
+    job = load_job(args.job)
+    for name in ("workers", "fetch_workers", "chunk_size"):
+        value = getattr(args, name, None)
+        if value is not None:
+            if value < 1:
+                raise JobError(f"--{name.replace('_', '-')} must be positive")
+            setattr(job, name, value)
+    if getattr(args, "format", None):
+        job.format = check_format(args.format)
+    return job
+
+
+def cmd_validate(args):
+    job = _load(args)
+    print(f"[INFO] {job.path}: OK")
+    print(format_plan(job, {}))
+    return 0
+
+
+def _plan(args, job):
+    counts = {} if args.no_counts else _count(job)
+    print(format_plan(job, counts))
+    return counts
+
+
+def cmd_plan(args):
+    _plan(args, _load(args))
+    return 0
+
+
+def cmd_run(args):
+    job = _load(args)
+    if args.incremental and job.subset is not None:
+        raise JobError("--incremental can't be combined with a subset")
+    if args.incremental and (job.format.lower() != "csv" or job.partition):
+        raise JobError("--incremental merges into unpartitioned CSV outputs only")
+    counts = _plan(args, job)
+    if args.dry_run:
+        if not counts:
+            print("[WARN] the estimate needs row counts; run without --no-counts")
+            return 0
+        history = load_history(args.history or [BENCH_HISTORY] + ([job.metrics] if job.metrics else []))
+        print(format_estimate(estimate_run(job, counts, history)))
+        return 0
+
+    import mock_salesforcesql
+
+    mock_salesforcesql.main(workers=job.workers, incremental=args.incremental, output_format=job.format,
+                            partition=job.partition, metrics_path=job.metrics, subset=job.subset, job=job)
+    return 0
+
+
+def cmd_patients(args):
+    import mock_patients
+
+    mock_patients.main()
+    return 0
+
+
+def cmd_secrets(args):
+    from main import bootstrap_secrets
+
+    bootstrap_secrets()
+    print("✅ Clark secrets retrieved successfully.")
+    return 0
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog="patient-mocker", description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    def job_command(name, fn, help_text):
+        sub = commands.add_parser(name, help=help_text)
+        sub.add_argument("job", nargs="?", help="job config (default: config/job.yaml)")
+        sub.set_defaults(fn=fn)
+        return sub
+
+    job_command("validate", cmd_validate, "check a job config without connecting to anything")
+    plan = job_command("plan", cmd_plan, "print the job with row counts per source")
+    run = job_command("run", cmd_run, "print the plan, then mask (or only estimate with --dry-run)")
+    for sub in (plan, run):
+        sub.add_argument("--no-counts", action="store_true", help="skip the COUNT queries")
+    run.add_argument("--dry-run", action="store_true",
+                     help="estimate runtime and peak memory from benchmark history instead of running")
+    run.add_argument("--history", action="append",
+                     help=f"bench_pipeline history or --metrics JSON to estimate from (default: {BENCH_HISTORY} "
+                          "and the job's metrics report)")
+    run.add_argument("--incremental", action="store_true",
+                     help="only pull rows changed since the last run and merge them into the outputs")
+    run.add_argument("--workers", type=int, help="processes for masking (and threads for fetching) tables")
+    run.add_argument("--fetch-workers", type=int, help="concurrent IN-list batches per table")
+    run.add_argument("--chunk-size", type=int, help="rows per chunk for streamed tables")
+    run.add_argument("--format", help="output format: csv, csv.gz, parquet[:snappy|zstd], arrow[:lz4|zstd]")
+
+    commands.add_parser("patients", help="mask Salesforce patients joined to assessments (mock_patients.py)") \
+        .set_defaults(fn=cmd_patients)
+    commands.add_parser("secrets", help="fetch and cache the Clark project secrets (main.py)") \
+        .set_defaults(fn=cmd_secrets)
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    try:
+        return args.fn(args)
+    except JobError as e:
+        print(f"[ERROR] {e}", file=sys.stderr)
+        return 2
+
+
+if __name__ == "__main__":
+    sys.exit(main())
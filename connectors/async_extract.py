@@ -0,0 +1,204 @@
+"""
+asyncio extraction front end.
+
+The SOQL / Bulk API 2.0 pages (aiohttp) and the MySQL reads for each
+page's patients are overlapped instead of run one after another: as soon
+as Salesforce page N arrives, the blocking MySQL read for its Ids starts
+on a worker thread (the pooled SQLAlchemy engine has no asyncio driver
+here) while page N+1 is fetched. Results come back in page order. The
+OAuth token comes from the same credential cache as the synchronous
+connectors (connectors/salesforce.py), so concurrent jobs of either kind
+share one token request.
+
+    sf_frames, related = extract_with_related(
+        {"soql": soql, "mode": "bulk"},
+        lambda page: fetch_by_ids(engine, "assessments", "Patient__c", page["Id"].tolist()),
+    )
+"""
+import asyncio
+import io
+import os
+
+import aiohttp
+import pandas as pd
+
+from connectors.salesforce import API_VERSION, BULK_PAGE_SIZE, get_access_token, refresh_access_token
+
+MAX_PENDING_READS = 2
+
+
+def _auth(access_token):
+    return {"Authorization": f"Bearer {access_token}", "Accept": "application/json"}
+
+
+async def aiter_query_frames(session, instance_url, access_token, soql, api_version=API_VERSION, all_pages=True):
+    """
+    REST query pages as DataFrames (attributes dropped). `all_pages` follows
+    nextRecordsUrl like query_all_iter; otherwise only the first batch, like sf.query.
+    """
+    url, params = f"{instance_url}/services/data/{api_version}/query", {"q": soql}
+    while True:
+        async with session.get(url, params=params, headers=_auth(access_token)) as response:
+            response.raise_for_status()
+            page = await response.json()
+        yield pd.DataFrame(page["records"]).drop(columns=["attributes"], errors="ignore")
+        next_url = page.get("nextRecordsUrl")
+        if not all_pages or page.get("done", True) or not next_url:
+            return
+        url, params = f"{instance_url}{next_url}", None
+
+
+def _read_csv_bytes(body):
+    try:
+        return pd.read_csv(io.BytesIO(body), dtype=str)
+    except pd.errors.EmptyDataError:
+        return pd.DataFrame()
+
+
+async def aiter_bulk_query_frames(session, instance_url, access_token, soql, page_size=BULK_PAGE_SIZE,
+                                  poll_interval=2.0, api_version=API_VERSION):
+    """Bulk API 2.0 query job, yielding each CSV result page as a DataFrame of strings."""
+    headers = _auth(access_token)
+    jobs_url = f"{instance_url}/services/data/{api_version}/jobs/query"
+    job_spec = {"operation": "query", "query": soql, "contentType": "CSV", "columnDelimiter": "COMMA",
+                "lineEnding": "LF"}
+    async with session.post(jobs_url, json=job_spec, headers=headers) as response:
+        response.raise_for_status()
+        job_url = f"{jobs_url}/{(await response.json())['id']}"
+
+    while True:
+        async with session.get(job_url, headers=headers) as response:
+            response.raise_for_status()
+            job = await response.json()
+        if job["state"] == "JobComplete":
+            break
+        if job["state"] in ("Failed", "Aborted"):
+            raise RuntimeError(f"Bulk query job {job.get('id')} {job['state']}: {job.get('errorMessage', '')}")
+        await asyncio.sleep(poll_interval)
+
+    locator = None
+    while True:
+        params = {"maxRecords": page_size}
+        if locator:
+            params["locator"] = locator
+        async with session.get(f"{job_url}/results", params=params, headers=headers) as response:
+            response.raise_for_status()
+            body = await response.read()
+            locator = response.headers.get("Sforce-Locator")
+        yield await asyncio.to_thread(_read_csv_bytes, body)
+        if not locator or locator == "null":
+            return
+
+
+async def aiter_salesforce_frames(session, config, access_token, instance_url):
+    """Async counterpart of connectors.salesforce.iter_salesforce_frames (same config keys and modes)."""
+    mode = config.get("mode", "query")
+    api_version = config.get("api_version", API_VERSION)
+    if mode == "bulk":
+        try:
+            async for frame in aiter_bulk_query_frames(
+                session, instance_url, access_token, config["soql"],
+                page_size=config.get("page_size", BULK_PAGE_SIZE),
+                poll_interval=config.get("poll_interval", 2.0),
+                api_version=api_version,
+            ):
+                yield frame
+            return
+        except aiohttp.ClientResponseError as e:
+            if e.status != 400:
+                raise
+            print(f"[WARN] Bulk API rejected the query ({e.message}); using REST query paging")
+            mode = "query_all"
+    if mode not in ("query", "query_all"):
+        raise ValueError(f"Unknown Salesforce extraction mode: {mode}")
+    async for frame in aiter_query_frames(session, instance_url, access_token, config["soql"], api_version,
+                                          all_pages=mode == "query_all"):
+        yield frame
+
+
+async def aiter_with_related(frames, fetch_related, max_pending=MAX_PENDING_READS):
+    """
+    (frame, fetch_related(frame)) for every frame of the async iterator
+    `frames`, in order. Frames are pulled by a background task; each
+    blocking fetch_related call starts on a worker thread as soon as its
+    frame arrives, so it overlaps the fetch of the next frame. At most
+    `max_pending` reads are started and not yet consumed.
+    """
+    queue = asyncio.Queue()
+    slots = asyncio.Semaphore(max_pending)
+
+    async def produce():
+        try:
+            async for frame in frames:
+                await slots.acquire()
+                queue.put_nowait((frame, asyncio.create_task(asyncio.to_thread(fetch_related, frame))))
+            queue.put_nowait(None)
+        except Exception as e:
+            queue.put_nowait(e)
+
+    producer = asyncio.create_task(produce())
+    try:
+        while True:
+            item = await queue.get()
+            if item is None:
+                return
+            if isinstance(item, Exception):
+                raise item
+            frame, task = item
+            related = await task
+            slots.release()
+            yield frame, related
+    finally:
+        producer.cancel()
+
+
+async def _token(sf_url, client_id, client_secret, stale=None):
+    """
+    (access_token, instance_url) from the credential cache; `stale` is a
+    token that got a 401. The request runs on a thread under the cache's
+    file lock, so it is never duplicated by a concurrent job.
+    """
+    if stale is None:
+        return await asyncio.to_thread(get_access_token, sf_url, client_id, client_secret)
+    return await asyncio.to_thread(refresh_access_token, sf_url, client_id, client_secret, stale)
+
+
+async def _extract(config, fetch_related, sf_url, client_id, client_secret, access_token, instance_url,
+                   max_pending):
+    async with aiohttp.ClientSession() as session:
+        cached = access_token is None
+        if cached:
+            access_token, instance_url = await _token(sf_url, client_id, client_secret)
+        frames, related = [], []
+        try:
+            pages = aiter_salesforce_frames(session, config, access_token, instance_url)
+            async for frame, rows in aiter_with_related(pages, fetch_related, max_pending):
+                frames.append(frame)
+                related.append(rows)
+        except aiohttp.ClientResponseError as e:
+            # a cached token Salesforce no longer accepts: refresh it and start over
+            if e.status != 401 or not cached or frames:
+                raise
+            access_token, instance_url = await _token(sf_url, client_id, client_secret, stale=access_token)
+            pages = aiter_salesforce_frames(session, config, access_token, instance_url)
+            async for frame, rows in aiter_with_related(pages, fetch_related, max_pending):
+                frames.append(frame)
+                related.append(rows)
+        return frames, related
+
+
+def extract_with_related(config, fetch_related, sf_url=None, client_id=None, client_secret=None,
+                         access_token=None, instance_url=None, max_pending=MAX_PENDING_READS):
+    """
+    Run the Salesforce query in `config` (see iter_salesforce_frames) and
+    fetch_related(page) for every result page, overlapped. Credentials
+    default to SF_URL / SF_CLIENT_ID / SF_CLIENT_SECRET and their token comes
+    from the credential cache; an `access_token` skips both.
+    Returns ([Salesforce frames], [related results]).
+    """
+    if access_token is None:
+        sf_url = sf_url or os.environ["SF_URL"]
+        client_id = client_id or os.environ["SF_CLIENT_ID"]
+        client_secret = client_secret or os.environ["SF_CLIENT_SECRET"]
+    return asyncio.run(_extract(config, fetch_related, sf_url, client_id, client_secret, access_token,
+                                instance_url, max_pending))
@@ -1,24 +1,258 @@
 import os
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 import pandas as pd
 import requests
+from requests.adapters import HTTPAdapter
 from simple_salesforce import Salesforce
+from simple_salesforce.exceptions import SalesforceExpiredSession
 
-def get_salesforce_access_token():
-    """
-    Obtain an OAuth2 access token from Salesforce using client credentials.
-    Returns (access_token, instance_url)
-    """
-    token_url = os.environ["SF_URL"] + "/services/oauth2/token"
+from utils.credentials import TOKEN_TTL, cache_key, default_cache
+
+API_VERSION = "v59.0"
+BULK_PAGE_SIZE = 100_000
+BULK_WORKERS = 4
+
+def request_access_token(sf_url, client_id, client_secret):
+    """POST the OAuth2 client-credentials grant. Returns {"access_token", "instance_url"}."""
     payload = {
         'grant_type': 'client_credentials',
-        'client_id': os.environ["SF_CLIENT_ID"],
-        'client_secret': os.environ["SF_CLIENT_SECRET"]
+        'client_id': client_id,
+        'client_secret': client_secret
     }
-    response = requests.post(token_url, data=payload)
+    response = requests.post(sf_url + "/services/oauth2/token", data=payload)
     response.raise_for_status()
     token_data = response.json()
-    instance_url = token_data.get("instance_url", os.environ["SF_URL"])
-    return token_data["access_token"], instance_url
+    return {"access_token": token_data["access_token"], "instance_url": token_data.get("instance_url", sf_url)}
+
+def token_cache_key(sf_url, client_id):
+    return cache_key("sf_token", sf_url, client_id)
+
+def get_access_token(sf_url, client_id, client_secret, cache=None, ttl=TOKEN_TTL):
+    """
+    (access_token, instance_url) from the credential cache (utils/credentials.py),
+    requested once across concurrent processes when missing or expired.
+    """
+    cache = cache or default_cache()
+    token = cache.get_or_fetch(token_cache_key(sf_url, client_id),
+                               lambda: request_access_token(sf_url, client_id, client_secret), ttl)
+    return token["access_token"], token["instance_url"]
+
+def refresh_access_token(sf_url, client_id, client_secret, stale_token, cache=None):
+    """
+    New (access_token, instance_url) after `stale_token` got a 401. When
+    another process already replaced it in the cache, that token is used.
+    """
+    cache = cache or default_cache()
+    key = token_cache_key(sf_url, client_id)
+    current = cache.get(key)
+    if current is None or current["access_token"] == stale_token:
+        cache.invalidate(key, current)
+    return get_access_token(sf_url, client_id, client_secret, cache=cache)
+
+def token_refresher(sf_url, client_id, client_secret, cache=None):
+    """refresh(stale_token) -> (access_token, instance_url) for bulk_session / iter_salesforce_frames."""
+    return lambda stale_token: refresh_access_token(sf_url, client_id, client_secret, stale_token, cache)
+
+def get_salesforce_access_token():
+    """
+    Obtain an OAuth2 access token from Salesforce using client credentials
+    (SF_URL / SF_CLIENT_ID / SF_CLIENT_SECRET), cached between runs.
+    Returns (access_token, instance_url)
+    """
+    return get_access_token(os.environ["SF_URL"], os.environ["SF_CLIENT_ID"], os.environ["SF_CLIENT_SECRET"])
+
+def _env_token_refresher():
+    return token_refresher(os.environ["SF_URL"], os.environ["SF_CLIENT_ID"], os.environ["SF_CLIENT_SECRET"])
+
+def _refresh_on_401(session, refresh):
+    """Response hook: on a 401, get a new token, update the session and resend the request once."""
+    def hook(response, *args, **kwargs):
+        if response.status_code != 401 or getattr(response.request, "token_refreshed", False):
+            return response
+        stale = response.request.headers.get("Authorization", "").removeprefix("Bearer ")
+        token, _ = refresh(stale)
+        session.headers["Authorization"] = f"Bearer {token}"
+        request = response.request.copy()
+        request.headers["Authorization"] = f"Bearer {token}"
+        request.token_refreshed = True
+        response.close()
+        return session.send(request, **kwargs)
+    return hook
+
+def bulk_session(access_token, max_workers=BULK_WORKERS, refresh=None):
+    """
+    requests session for Bulk API 2.0 calls, with room for one connection per page download.
+    `refresh(stale_token)` -> (token, instance_url) makes a 401 refresh the token and retry.
+    """
+    session = requests.Session()
+    session.headers.update({
+        "Authorization": f"Bearer {access_token}",
+        "Accept": "application/json",
+    })
+    adapter = HTTPAdapter(pool_maxsize=max_workers + 1)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    if refresh is not None:
+        session.hooks["response"].append(_refresh_on_401(session, refresh))
+    return session
+
+def create_bulk_query_job(session, instance_url, soql, api_version=API_VERSION):
+    """Submit a Bulk API 2.0 query job and return its URL."""
+    jobs_url = f"{instance_url}/services/data/{api_version}/jobs/query"
+    response = session.post(jobs_url, json={
+        "operation": "query",
+        "query": soql,
+        "contentType": "CSV",
+        "columnDelimiter": "COMMA",
+        "lineEnding": "LF",
+    })
+    response.raise_for_status()
+    return f"{jobs_url}/{response.json()['id']}"
+
+def wait_for_bulk_job(session, job_url, poll_interval=2.0, timeout=None):
+    """Poll a query job until it completes; raise if it fails, is aborted or times out."""
+    deadline = time.monotonic() + timeout if timeout else None
+    while True:
+        response = session.get(job_url)
+        response.raise_for_status()
+        job = response.json()
+        state = job["state"]
+        if state == "JobComplete":
+            return job
+        if state in ("Failed", "Aborted"):
+            raise RuntimeError(f"Bulk query job {job.get('id')} {state}: {job.get('errorMessage', '')}")
+        if deadline and time.monotonic() > deadline:
+            raise TimeoutError(f"Bulk query job {job.get('id')} still {state} after {timeout}s")
+        time.sleep(poll_interval)
+
+def _read_csv_page(response):
+    """Parse one streamed CSV result page into a DataFrame of strings (empty cells -> NaN)."""
+    try:
+        response.raw.decode_content = True
+        return pd.read_csv(response.raw, dtype=str)
+    except pd.errors.EmptyDataError:
+        return pd.DataFrame()
+    finally:
+        response.close()
+
+def iter_bulk_query_frames(instance_url, access_token, soql, page_size=BULK_PAGE_SIZE,
+                           max_workers=BULK_WORKERS, poll_interval=2.0, api_version=API_VERSION,
+                           session=None, refresh=None):
+    """
+    Run `soql` as a Bulk API 2.0 query job and yield each CSV result page as a DataFrame.
+
+    Pages are chained by the Sforce-Locator response header, which arrives
+    before the body, so the next page is requested as soon as the current
+    one's headers are in while up to `max_workers` page bodies download and
+    parse concurrently. Frames are yielded in result order and at most
+    `max_workers` of them are held at once. `refresh` is passed to bulk_session.
+    """
+    session = session or bulk_session(access_token, max_workers, refresh)
+    job_url = create_bulk_query_job(session, instance_url, soql, api_version)
+    wait_for_bulk_job(session, job_url, poll_interval)
+
+    results_url = f"{job_url}/results"
+
+    def request_page(locator):
+        params = {"maxRecords": page_size}
+        if locator:
+            params["locator"] = locator
+        response = session.get(results_url, params=params, stream=True)
+        response.raise_for_status()
+        return response
+
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        pending = deque()
+        response = request_page(None)
+        while True:
+            locator = response.headers.get("Sforce-Locator")
+            pending.append(pool.submit(_read_csv_page, response))
+            if not locator or locator == "null":
+                break
+            while pending and (pending[0].done() or len(pending) >= max_workers):
+                yield pending.popleft().result()
+            response = request_page(locator)
+        while pending:
+            yield pending.popleft().result()
+
+def iter_query_all_frames(sf, soql, page_size=2000):
+    """
+    Fallback for queries Bulk API 2.0 rejects: page through query_all_iter
+    and yield DataFrames of `page_size` records without keeping them all.
+    """
+    batch = []
+    for record in sf.query_all_iter(soql):
+        record.pop("attributes", None)
+        batch.append(record)
+        if len(batch) >= page_size:
+            yield pd.DataFrame(batch)
+            batch = []
+    if batch:
+        yield pd.DataFrame(batch)
+
+def iter_salesforce_frames(config, access_token=None, instance_url=None, refresh=None):
+    """
+    Yield the records of config["soql"] as DataFrames.
+    config["mode"] picks the extraction path:
+      - "query": a single sf.query call (first batch only)
+      - "bulk": Bulk API 2.0 CSV pages, falling back to query_all_iter
+        when the query is not supported by Bulk API
+      - "query_all": query_all_iter pages
+    Optional keys: page_size, max_workers, api_version.
+    Without `access_token` the cached SF_* env token is used. `refresh`
+    (see token_refresher) replaces a token rejected with a 401: per request
+    for Bulk API calls, otherwise by restarting before the first frame.
+    """
+    if access_token is None:
+        access_token, instance_url = get_salesforce_access_token()
+        refresh = refresh or _env_token_refresher()
+    yielded = False
+    try:
+        for frame in _iter_frames(config, access_token, instance_url, refresh):
+            yielded = True
+            yield frame
+    except SalesforceExpiredSession:
+        if yielded or refresh is None:
+            raise
+        access_token, instance_url = refresh(access_token)
+        yield from _iter_frames(config, access_token, instance_url, refresh)
+
+def _iter_frames(config, access_token, instance_url, refresh):
+    mode = config.get("mode", "query")
+    api_version = config.get("api_version", API_VERSION)
+
+    if mode == "bulk":
+        try:
+            yield from iter_bulk_query_frames(
+                instance_url, access_token, config["soql"],
+                page_size=config.get("page_size", BULK_PAGE_SIZE),
+                max_workers=config.get("max_workers", BULK_WORKERS),
+                api_version=api_version,
+                refresh=refresh,
+            )
+            return
+        except requests.HTTPError as e:
+            if e.response is None or e.response.status_code != 400:
+                raise
+            print(f"[WARN] Bulk API rejected the query ({e.response.text.strip()}); using query_all_iter")
+            mode = "query_all"
+
+    sf = Salesforce(instance_url=instance_url, session_id=access_token, version=api_version.lstrip("v"))
+    if mode == "query_all":
+        yield from iter_query_all_frames(sf, config["soql"], config.get("page_size", 2000))
+    elif mode == "query":
+        result = sf.query(config["soql"])
+        yield pd.DataFrame(result["records"]).drop(columns=["attributes"], errors="ignore")
+    else:
+        raise ValueError(f"Unknown Salesforce extraction mode: {mode}")
+
+def count_records(instance_url, access_token, sobject, where=None, api_version=API_VERSION):
+    """Records of `sobject` (matching the SOQL `where`), from a SELECT COUNT() query."""
+    sf = Salesforce(instance_url=instance_url, session_id=access_token, version=api_version.lstrip("v"))
+    soql = f"SELECT COUNT() FROM {sobject}" + (f" WHERE {where}" if where else "")
+    return int(sf.query(soql)["totalSize"])
 
 def fetch_salesforce_patients(config):
     """
@@ -26,14 +260,9 @@ def fetch_salesforce_patients(config):
     `config` is a dict with keys:
       - soql: the SOQL query string
       - object: the Salesforce object name (unused here, but may be useful elsewhere)
+      - mode: optional extraction mode, see iter_salesforce_frames (default "query")
     """
-    access_token, instance_url = get_salesforce_access_token()
-    sf = Salesforce(
-        instance_url=instance_url,
-        session_id=access_token
-    )
-    result = sf.query(config["soql"])
-    records = result["records"]
-    df = pd.DataFrame(records)
-    df = df.drop(columns=["attributes"], errors="ignore")
-    return df
+    frames = list(iter_salesforce_frames(config))
+    if not frames:
+        return pd.DataFrame()
+    return pd.concat(frames, ignore_index=True)
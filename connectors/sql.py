@@ -1,16 +1,354 @@
 import os
+import threading
+import time
+import weakref
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from dataclasses import dataclass
 import pandas as pd
 import mysql.connector
+import sqlalchemy
+from sqlalchemy import bindparam, event, text
 
-def fetch_mysql_patients(config):
-    conn = mysql.connector.connect(
+from utils.compact import downcast_frame
+
+# IDs bound per IN (...) query; keeps statements well under max_allowed_packet
+IN_BATCH_SIZE = 1000
+IN_WORKERS = 4
+# Temporary ID table (per connection) and its column, named so they can't
+# clash with real tables/columns
+TEMP_ID_TABLE = "tmp_masker_ids"
+TEMP_KEY_COL = "_masker_key"
+
+# Pool settings for every registered engine: enough connections for the
+# table/batch thread pools, pre-ping to survive MySQL's wait_timeout and
+# recycle before server-side idle disconnects
+POOL_OPTIONS = {
+    "pool_size": 10,
+    "max_overflow": 20,
+    "pool_timeout": 30,
+    "pool_pre_ping": True,
+    "pool_recycle": 1800,
+}
+
+@dataclass
+class EngineStats:
+    checkouts: int = 0
+    checkout_s: float = 0.0
+    max_checkout_s: float = 0.0
+    queries: int = 0
+    query_s: float = 0.0
+    max_query_s: float = 0.0
+
+    def __str__(self):
+        avg_checkout = self.checkout_s / self.checkouts * 1000 if self.checkouts else 0.0
+        avg_query = self.query_s / self.queries * 1000 if self.queries else 0.0
+        return (
+            f"{self.checkouts} checkouts (avg {avg_checkout:.1f} ms, max {self.max_checkout_s * 1000:.1f} ms), "
+            f"{self.queries} queries (avg {avg_query:.1f} ms, max {self.max_query_s * 1000:.1f} ms)"
+        )
+
+_engines = {}
+_engine_stats = weakref.WeakKeyDictionary()
+_engine_names = weakref.WeakKeyDictionary()
+_hooks = {"checkout": [], "query": []}
+_registry_lock = threading.Lock()
+
+def mysql_url():
+    """SQLAlchemy URL for the DB_* env vars (credentials are escaped properly)."""
+    return sqlalchemy.engine.URL.create(
+        "mysql+mysqlconnector",
+        username=os.getenv("DB_USER"),
+        password=os.getenv("DB_PASSWORD"),
+        host=os.getenv("DB_HOST"),
+        port=int(os.getenv("DB_PORT", 3306)),
+        database=os.getenv("DB_NAME"),
+    )
+
+def add_hook(kind, fn):
+    """
+    Register a metrics callback:
+      "checkout": fn(engine_name, seconds) after a pooled connection is handed out
+      "query":    fn(engine_name, statement, seconds) after each statement
+    """
+    _hooks[kind].append(fn)
+
+def _instrument(engine, name):
+    stats = EngineStats()
+    _engine_stats[engine] = stats
+    _engine_names[engine] = name
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def _before(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("query_start", []).append(time.perf_counter())
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def _after(conn, cursor, statement, parameters, context, executemany):
+        elapsed = time.perf_counter() - conn.info["query_start"].pop()
+        stats.queries += 1
+        stats.query_s += elapsed
+        stats.max_query_s = max(stats.max_query_s, elapsed)
+        for hook in _hooks["query"]:
+            hook(name, statement, elapsed)
+
+def register_engine(name, url, **options):
+    """Create a pooled, instrumented engine under `name` (replacing any previous one)."""
+    engine = sqlalchemy.create_engine(url, **{**POOL_OPTIONS, **options})
+    _instrument(engine, name)
+    with _registry_lock:
+        old = _engines.get(name)
+        _engines[name] = engine
+    if old is not None:
+        old.dispose()
+    return engine
+
+def get_engine(name="mysql"):
+    """
+    The shared engine registered as `name`. The "mysql" engine is created
+    from the DB_* env vars on first use.
+    """
+    with _registry_lock:
+        engine = _engines.get(name)
+    if engine is None:
+        if name != "mysql":
+            raise KeyError(f"No engine registered as {name!r}")
+        engine = register_engine(name, mysql_url())
+    return engine
+
+def engine_stats(engine_or_name="mysql"):
+    engine = get_engine(engine_or_name) if isinstance(engine_or_name, str) else engine_or_name
+    return _engine_stats.get(engine)
+
+def dispose_engines():
+    with _registry_lock:
+        engines = list(_engines.values())
+        _engines.clear()
+    for engine in engines:
+        engine.dispose()
+
+def _dispose_in_child():
+    # Forked workers must not reuse the parent's pooled sockets
+    for engine in list(_engines.values()):
+        engine.dispose(close=False)
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_dispose_in_child)
+
+@contextmanager
+def connect(engine=None):
+    """
+    Check a connection out of `engine`'s pool (default: the shared "mysql"
+    engine), recording how long the checkout took.
+    """
+    engine = engine if engine is not None else get_engine()
+    start = time.perf_counter()
+    conn = engine.connect()
+    elapsed = time.perf_counter() - start
+    stats = _engine_stats.get(engine)
+    if stats is not None:
+        stats.checkouts += 1
+        stats.checkout_s += elapsed
+        stats.max_checkout_s = max(stats.max_checkout_s, elapsed)
+        for hook in _hooks["checkout"]:
+            hook(_engine_names[engine], elapsed)
+    try:
+        yield conn
+    finally:
+        conn.close()
+
+def mysql_connect():
+    """
+    Plain mysql.connector connection from DB_* env vars.
+    Cursors are unbuffered (the driver default), so rows stay on the server
+    until they are fetched. Only used for streaming; everything else goes
+    through the pooled engine from get_engine().
+    """
+    return mysql.connector.connect(
         host=os.getenv("DB_HOST"),
         port=int(os.getenv("DB_PORT", 3306)),
         user=os.getenv("DB_USER"),
         password=os.getenv("DB_PASSWORD"),
         database=os.getenv("DB_NAME"),
     )
-    query = f"SELECT * FROM {config['table']}"
-    df = pd.read_sql(query, conn)
-    conn.close()
-    return df
+
+def fetch_mysql_patients(config):
+    with connect() as conn:
+        return downcast_frame(pd.read_sql(text(f"SELECT * FROM `{config['table']}`"), conn))
+
+def iter_query_chunks(query, chunksize=50_000, params=None, conn=None):
+    """
+    Yield the result of `query` as DataFrames of at most `chunksize` rows.
+
+    Rows are pulled with cursor.fetchmany on a streaming (unbuffered) cursor,
+    so only one chunk is ever held in memory. SQLAlchemy's mysqlconnector
+    dialect always buffers the full result, which is why this goes through a
+    DBAPI connection. Integers are not downcast: every chunk of a table must
+    fit the types the writers fixed from the first one. `conn` defaults to a
+    new mysql_connect() connection, closed once the result is exhausted.
+    """
+    own_conn = conn is None
+    if own_conn:
+        conn = mysql_connect()
+    cursor = conn.cursor()
+    try:
+        cursor.execute(query, params or ())
+        columns = [d[0] for d in cursor.description]
+        while True:
+            rows = cursor.fetchmany(chunksize)
+            if not rows:
+                break
+            yield downcast_frame(pd.DataFrame.from_records(rows, columns=columns), integers=False)
+    finally:
+        cursor.close()
+        if own_conn:
+            conn.close()
+
+def count_rows(engine, table, where=None, params=None):
+    """SELECT COUNT(*) of `table` (rows matching `where`, with `params`)."""
+    sql = f"SELECT COUNT(*) FROM `{table}`" + (f" WHERE {where}" if where else "")
+    with connect(engine) as conn:
+        return int(conn.execute(text(sql), params or {}).scalar())
+
+def id_batches(ids, batch_size=IN_BATCH_SIZE):
+    """Split `ids` into de-duplicated lists of at most `batch_size`, preserving order."""
+    ids = list(dict.fromkeys(ids))
+    return [ids[i:i + batch_size] for i in range(0, len(ids), batch_size)]
+
+def _select_sql(table, select, where, alias=""):
+    prefix = f"{alias}." if alias and select == "*" else ""
+    sql = f"SELECT {prefix}{select} FROM `{table}`" + (f" AS {alias}" if alias else "")
+    return sql, (f" AND ({where})" if where else "")
+
+def fetch_by_ids_batched(engine, table, column, ids, select="*", where=None, params=None,
+                         batch_size=IN_BATCH_SIZE, workers=IN_WORKERS, expanding=(), limit=None):
+    """
+    Rows of `table` whose `column` is in `ids`, fetched as one bound-parameter
+    IN query per batch of `batch_size` ids. Batches run concurrently on the
+    engine's connection pool and are concatenated in batch order.
+    `where` is an extra SQL condition using `params`; names listed in
+    `expanding` are list parameters expanded like the id list. With `limit`,
+    each batch is LIMITed and no more batches are sent once `limit` rows
+    are in.
+    """
+    base, extra = _select_sql(table, select, where)
+    extra += f" LIMIT {int(limit)}" if limit else ""
+    stmt = text(f"{base} WHERE `{column}` IN :ids{extra}").bindparams(
+        *(bindparam(name, expanding=True) for name in ("ids", *expanding))
+    )
+
+    def run(batch):
+        with connect(engine) as conn:
+            return downcast_frame(pd.read_sql(stmt, conn, params={**(params or {}), "ids": batch}))
+
+    # an empty id list still runs once, so the result keeps its columns
+    batches = id_batches(ids, batch_size) or [[]]
+    # without a limit every batch goes out at once; with one, a wave per worker
+    wave = len(batches) if not limit else max(1, workers)
+
+    def run_waves(map_fn):
+        frames, rows = [], 0
+        for i in range(0, len(batches), wave):
+            done = list(map_fn(run, batches[i:i + wave]))
+            frames += done
+            rows += sum(len(f) for f in done)
+            if limit and rows >= limit:
+                break
+        return frames
+
+    if workers <= 1 or len(batches) == 1:
+        frames = run_waves(map)
+    else:
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            frames = run_waves(pool.map)
+    # empty batches would turn typed columns into object on concat
+    non_empty = [f for f in frames if not f.empty]
+    df = pd.concat(non_empty or frames[:1], ignore_index=True)
+    return df.head(limit) if limit else df
+
+def fetch_by_id_table(engine, table, column, ids, select="*", where=None, params=None,
+                      batch_size=IN_BATCH_SIZE, expanding=(), key_type="VARCHAR(64)", limit=None):
+    """
+    Same result as fetch_by_ids_batched, but the ids are bulk-inserted into a
+    session temporary table and joined against, so the server runs a single
+    query (LIMITed to `limit` rows when given) whatever the id count.
+    """
+    tmp = TEMP_ID_TABLE
+    base, extra = _select_sql(table, select, where, alias="t")
+    extra += f" LIMIT {int(limit)}" if limit else ""
+    stmt = text(f"{base} JOIN {tmp} AS k ON k.{TEMP_KEY_COL} = t.`{column}` WHERE 1=1{extra}")
+    if expanding:
+        stmt = stmt.bindparams(*(bindparam(name, expanding=True) for name in expanding))
+
+    with connect(engine) as conn:
+        conn.execute(text(f"CREATE TEMPORARY TABLE {tmp} ({TEMP_KEY_COL} {key_type} PRIMARY KEY)"))
+        try:
+            insert = text(f"INSERT INTO {tmp} ({TEMP_KEY_COL}) VALUES (:k)")
+            for batch in id_batches(ids, batch_size):
+                conn.execute(insert, [{"k": i} for i in batch])
+            return downcast_frame(pd.read_sql(stmt, conn, params=params or {}))
+        finally:
+            conn.execute(text(f"DROP TABLE {tmp}"))
+            conn.commit()
+
+ID_STRATEGIES = {
+    "batched": fetch_by_ids_batched,
+    "temp_table": fetch_by_id_table,
+}
+
+def fetch_by_ids(engine, table, column, ids, strategy="batched", **kwargs):
+    """
+    Fetch rows of `table` whose `column` is in `ids` with the given strategy;
+    "compare" runs every strategy (see compare_id_strategies) and returns
+    the rows of the fastest.
+    """
+    if strategy == "compare":
+        return _compare(engine, table, column, ids, **kwargs)[1]
+    fn = ID_STRATEGIES[strategy]
+    if strategy == "temp_table":
+        kwargs.pop("workers", None)
+    return fn(engine, table, column, ids, **kwargs)
+
+def compare_id_strategies(engine, table, column, ids, **kwargs):
+    """
+    Run every strategy for the same ids, print the timings and return
+    {"ids": n, "<strategy>_s": seconds, ..., "fastest": name}.
+    """
+    return _compare(engine, table, column, ids, **kwargs)[0]
+
+def _compare(engine, table, column, ids, **kwargs):
+    report, frames = {"ids": len(set(ids))}, {}
+    for strategy in ID_STRATEGIES:
+        start = time.perf_counter()
+        frames[strategy] = fetch_by_ids(engine, table, column, ids, strategy=strategy, **kwargs)
+        report[f"{strategy}_s"] = time.perf_counter() - start
+    report["fastest"] = min(ID_STRATEGIES, key=lambda s: report[f"{s}_s"])
+    timings = ", ".join(f"{s} {report[f'{s}_s']:.2f}s" for s in ID_STRATEGIES)
+    print(f"[INFO] {table}: {report['ids']:,} ids: {timings} -> {report['fastest']} is faster")
+    return report, frames[report["fastest"]]
+
+def iter_chunks_by_ids(table, column, ids, select="*", chunksize=50_000, batch_size=IN_BATCH_SIZE,
+                       limit=None, conn=None):
+    """
+    Streaming counterpart of fetch_by_ids_batched: one %s-placeholder IN query
+    per id batch on a DBAPI connection, yielding chunks via iter_query_chunks.
+    Stops after `limit` rows when given.
+    """
+    own_conn = conn is None
+    if own_conn:
+        conn = mysql_connect()
+    remaining = limit
+    try:
+        for batch in id_batches(ids, batch_size):
+            placeholders = ",".join(["%s"] * len(batch))
+            query = f"SELECT {select} FROM `{table}` WHERE `{column}` IN ({placeholders})"
+            if remaining is not None:
+                query += f" LIMIT {remaining}"
+            for chunk in iter_query_chunks(query, chunksize, tuple(batch), conn=conn):
+                yield chunk
+                if remaining is not None:
+                    remaining -= len(chunk)
+            if remaining is not None and remaining <= 0:
+                return
+    finally:
+        if own_conn:
+            conn.close()
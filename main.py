@@ -1,6 +1,7 @@
 from dotenv import load_dotenv
 import os
-from clark_secrets import retrieve_project_secrets, ClarkSecretsConfig, write_env_file
+from clark_secrets import ClarkSecretsConfig, write_env_file
+from utils.credentials import cached_project_secrets
 
 def bootstrap_secrets():
     load_dotenv(dotenv_path="env.clark")  
@@ -14,7 +15,8 @@ def bootstrap_secrets():
         email=os.getenv("CLARK_AUTH_EMAIL")
     )
 
-    secrets = retrieve_project_secrets(config)
+    # cached with a TTL and shared between processes (utils/credentials.py)
+    secrets = cached_project_secrets(config)
     return secrets
 
 if __name__ == "__main__":
@@ -1,34 +1,58 @@
 from dotenv import load_dotenv
 import os
 import pandas as pd
-from clark_secrets import retrieve_project_secrets, ClarkSecretsConfig
-from simple_salesforce import Salesforce
-import requests
-import sqlalchemy
+from clark_secrets import ClarkSecretsConfig
+from connectors.salesforce import get_access_token, iter_salesforce_frames, token_refresher
+from connectors.async_extract import extract_with_related
+from connectors.sql import dispose_engines, fetch_by_ids, get_engine, iter_chunks_by_ids
+from utils.credentials import cached_project_secrets
+from utils.join import stream_join
 from utils.normalizer import load_aliases, normalize_columns
-from utils.faker_map import make_faker_map
+from utils.faker_map import make_faker_map, real_patient_values
+from utils.vault import open_vault
+from utils.rules import mask_with_rules
+from utils.writers import output_path, write_frame
+from utils.metrics import RunMetrics
+from utils.subset import report_from_metrics, sample_patients, subset_from_env
+
+# Output format ("csv", "csv.gz", "parquet", "parquet:zstd", "arrow", ...)
+OUTPUT_FORMAT = os.getenv("OUTPUT_FORMAT", "csv")
+# Per-stage metrics report (.json, or .prom for Prometheus text) and masking profile
+METRICS_OUT = os.getenv("METRICS_OUT")
+METRICS_PROFILE = os.getenv("METRICS_PROFILE")
+# Assessment rows streamed per chunk, and joined rows kept (lowest Patient__c first)
+CHUNK_SIZE = 50_000
+ASSESSMENT_ROWS = 20
+# SUBSET_PATIENTS=500 or 1% (SUBSET_BY=Facility__c to stratify, SUBSET_IDS=<file>
+# for an explicit list, SUBSET_SEED): sample patients from every Patient__c record
+# and keep all of their assessments instead of the top rows
+SUBSET = subset_from_env()
+ASSESSMENT_COLUMNS = [
+    "patient_name",
+    "patient_date_of_birth_date_time",
+    "provider_name",
+    "facility_guid",
+    "facility_name",
+    "practitioner__c",
+    "appointment_type_name",
+    "Patient__c",
+    "Facility__c",
+]
 
 def main():
+    # Wall/CPU time, rows, bytes and peak RSS per stage (auth, query, fetch, mask, write)
+    metrics = RunMetrics("mock_patients", profile_path=METRICS_PROFILE)
+
     # Step 1: Load env variables and secrets
     load_dotenv(dotenv_path="env.clark")
     config = ClarkSecretsConfig()
-    secrets = retrieve_project_secrets(config)
-
-    # Step 2: Connect to Salesforce with OAuth client credentials
-    token_url = secrets["SF_URL"] + "/services/oauth2/token"
-    payload = {
-        'grant_type': 'client_credentials',
-        'client_id': secrets["SF_CLIENT_ID"],
-        'client_secret': secrets["SF_CLIENT_SECRET"]
-    }
-    response = requests.post(token_url, data=payload)
-    response.raise_for_status()
-    token_data = response.json()
-    access_token = token_data["access_token"]
-    instance_url = token_data.get("instance_url", secrets["SF_URL"])
-    sf = Salesforce(instance_url=instance_url, session_id=access_token)
-
-    # Step 3: Query top 10 patients from Salesforce with needed fields
+    with metrics.stage("auth"):
+        secrets = cached_project_secrets(config)
+
+    # Step 2: Query patients from Salesforce with needed fields
+    # SF_EXTRACT_MODE=bulk (Bulk API 2.0) or query_all pulls every Patient__c
+    # record page by page; the default "query" keeps the top-10 sample
+    extract_mode = os.getenv("SF_EXTRACT_MODE", "query")
     soql = """
     SELECT
         Id,
@@ -40,106 +64,115 @@ def main():
         DOB__c,
         Facility__c
     FROM Patient__c
-    ORDER BY Id
+    """
+    if extract_mode == "query" and SUBSET is None:
+        soql += """ORDER BY Id
     LIMIT 10
     """
-    sf_result = sf.query(soql)
-    sf_patients = pd.DataFrame(sf_result['records']).drop(columns='attributes', errors='ignore')
+
+    # Step 3: Connect to Salesforce with OAuth client credentials (token shared with
+    # other jobs through the credential cache) and pull the pages.
+    # SF_ASYNC=1 runs the token request and Salesforce pages on asyncio and reads each
+    # page's assessments from MySQL while the next page downloads (not with a
+    # subset, whose assessments are read once the sample is picked)
+    sf_credentials = (secrets["SF_URL"], secrets["SF_CLIENT_ID"], secrets["SF_CLIENT_SECRET"])
+    assessment_frames = None
+    if os.getenv("SF_ASYNC") == "1" and SUBSET is None:
+        engine = get_engine()
+
+        @metrics.timed("fetch", "assessments")
+        def fetch_assessments(page):
+            ids = page["Id"].dropna().tolist() if "Id" in page.columns else []
+            return fetch_by_ids(engine, "assessments", "Patient__c", ids, select=", ".join(ASSESSMENT_COLUMNS))
+
+        # token, pages and the overlapped assessment reads (also counted under fetch)
+        with metrics.stage("query", "Patient__c"):
+            sf_frames, assessment_frames = extract_with_related(
+                {"soql": soql, "mode": extract_mode},
+                fetch_assessments,
+                *sf_credentials,
+            )
+    else:
+        with metrics.stage("auth"):
+            access_token, instance_url = get_access_token(*sf_credentials)
+        with metrics.stage("query", "Patient__c"):
+            sf_frames = list(iter_salesforce_frames({"soql": soql, "mode": extract_mode}, access_token,
+                                                    instance_url, refresh=token_refresher(*sf_credentials)))
+    sf_patients = pd.concat(sf_frames, ignore_index=True)
+    metrics.get("query", "Patient__c").add(sf_patients)
+    population = len(sf_patients)
+    if SUBSET is not None:
+        sf_patients = sample_patients(sf_patients, **SUBSET)
+        print(f"[INFO] Subset: {len(sf_patients):,} of {population:,} patients")
 
     print("Salesforce raw columns:", sf_patients.columns.tolist())
     print("\n=== Salesforce Patient Data (Top 10 rows) ===")
     print(sf_patients.head(10))
 
-    # Extract Salesforce IDs and Facility IDs for filtering MySQL
-    sf_ids = sf_patients["Id"].tolist()
-    facility_ids = sf_patients["Facility__c"].dropna().unique().tolist()
-
-    # Step 4: Setup MySQL connection
-    engine_str = (
-        f"mysql+mysqlconnector://{os.getenv('DB_USER')}:{os.getenv('DB_PASSWORD')}"
-        f"@{os.getenv('DB_HOST')}:{os.getenv('DB_PORT', 3306)}/{os.getenv('DB_NAME')}"
-    )
-    engine = sqlalchemy.create_engine(engine_str)
-
-    # Safety: make sure lists aren't empty before creating SQL filters
-    sf_ids_sql = ",".join(f"'{i}'" for i in sf_ids) if sf_ids else "''"
-    facility_ids_sql = ",".join(f"'{f}'" for f in facility_ids) if facility_ids else "''"
-
-    # Step 5: Query matching assessments filtering on Patient__c and Facility__c
-    mysql_query = f"""
-    SELECT
-        patient_name,
-        patient_date_of_birth_date_time,
-        provider_name,
-        facility_guid,
-        facility_name,
-        practitioner__c,
-        appointment_type_name,
-        Patient__c,
-        Facility__c
-    FROM assessments
-    WHERE Patient__c IN ({sf_ids_sql})
-      AND Facility__c IN ({facility_ids_sql})
-    ORDER BY Patient__c
-    LIMIT 20
-    """
-    mysql_patients = pd.read_sql(mysql_query, engine)
-
-    print("MySQL raw columns:", mysql_patients.columns.tolist())
-    print("\n=== MySQL Assessment Data (Top 10 rows) ===")
-    print(mysql_patients.head(10))
-
-    # Step 6: Merge datasets on Patient__c = Id AND Facility__c matching
-    merged = pd.merge(
-        sf_patients,
-        mysql_patients,
-        left_on=["Id", "Facility__c"],
-        right_on=["Patient__c", "Facility__c"],
-        how="inner",
-        suffixes=('_sf', '_mysql')
-    )
+    if sf_patients.empty:
+        print("No patients from Salesforce; exiting.")
+        return
+
+    # Step 4: Stream assessments for the Salesforce IDs (pushed down as batched
+    # IN lists; already read per page with SF_ASYNC=1) and join them to the
+    # patients on Patient__c = Id AND matching Facility__c. Each chunk is filtered
+    # against a key index of sf_patients as it arrives, so assessments without a
+    # matching patient are never kept.
+    if assessment_frames is not None:
+        assessments = iter(assessment_frames)
+    else:
+        assessments = metrics.iter_stage("fetch", iter_chunks_by_ids(
+            "assessments",
+            "Patient__c",
+            sf_patients["Id"].dropna().tolist(),
+            select=", ".join(ASSESSMENT_COLUMNS),
+            chunksize=CHUNK_SIZE,
+        ), "assessments")
+
+    # Step 5: Merge datasets on Patient__c = Id AND Facility__c matching
+    # (the merge stage includes fetching the streamed chunks)
+    with metrics.stage("merge", "assessments") as stage:
+        merged, join_stats = stream_join(
+            sf_patients,
+            assessments,
+            left_on=["Id", "Facility__c"],
+            right_on=["Patient__c", "Facility__c"],
+            suffixes=('_sf', '_mysql'),
+            right_columns=ASSESSMENT_COLUMNS,
+        )
+        stage.add(merged)
+    print(join_stats)
+    merged = merged.sort_values("Patient__c", kind="stable")
+    if SUBSET is None:
+        merged = merged.head(ASSESSMENT_ROWS)
+    merged = merged.reset_index(drop=True)
+    if SUBSET is not None:
+        print(report_from_metrics(metrics, {"assessments": "Patient__c"}, sf_patients["Id"].dropna(), population))
 
     print(f"Merged data shape: {merged.shape}")
     print("\n=== Merged Data (Top 10 rows) ===")
     print(merged.head(10))
 
-    # Step 7: Create Faker mapping keyed on Patient_ID__c (MRN)
+    # Step 6: Create Faker mapping keyed on Patient_ID__c (MRN)
     mrn_keys = merged["Patient_ID__c"].unique()
-    fake_map = make_faker_map(mrn_keys)
-
-    # Step 8: Apply Faker masking to all requested columns consistently (except Id and Practice_GUID__c)
+    # PSEUDONYM_VAULT=<path> keeps fakes stable across runs
+    vault = open_vault("patients")
+    masking_secret = secrets.get("MASKING_SECRET") or os.getenv("MASKING_SECRET")
+    with metrics.stage("mask", "fake_map") as stage:
+        # keyed fakes permute the MRN (the key) and its real record number
+        record_numbers = real_patient_values(merged, key="Patient_ID__c", patient_id_col=None)
+        fake_map = make_faker_map(mrn_keys, secret=masking_secret, vault=vault, **record_numbers)
+        stage.add(rows=len(mrn_keys))
+
+    # Step 7: Apply Faker masking to all requested columns consistently (except Id and Practice_GUID__c);
+    # the per-column rules are the merged_patients table in config/masking_rules.yaml
     def apply_faker_masking(df, fake_map):
-        for idx, row in df.iterrows():
-            mrn = row["Patient_ID__c"]
-            if mrn in fake_map:
-                fake_info = fake_map[mrn]
-                # IDs NOT modified:
-                # df.at[idx, "Id"] = row["Id"]  # Leave as is
-                # df.at[idx, "Practice_GUID__c"] = row["Practice_GUID__c"]  # Leave as is
-
-                # Fake IDs - only Patient_ID__c and Patient_Record_Number__c masked
-                df.at[idx, "Patient_ID__c"] = fake_info.get("patient_id", fake_info["first_name"] + "_id")
-                df.at[idx, "Patient_Record_Number__c"] = fake_info.get("patient_record_number", fake_info["last_name"] + "_recnum")
-
-                # Fake names & DOB
-                df.at[idx, "First_Name__c"] = fake_info["first_name"]
-                df.at[idx, "Last_Name__c"] = fake_info["last_name"]
-                df.at[idx, "DOB__c"] = fake_info["dob"]
-
-                # Assessment patient name
-                df.at[idx, "patient_name"] = f"{fake_info['first_name']} {fake_info['last_name']}"
-
-                # Fake or mask additional fields if needed
-                df.at[idx, "provider_name"] = fake_info.get("provider_name", "Dr. " + fake_info["last_name"])
-                df.at[idx, "facility_guid"] = fake_info.get("facility_guid", "FAC-" + fake_info["last_name"][:3].upper())
-                df.at[idx, "facility_name"] = fake_info.get("facility_name", fake_info["last_name"] + " Medical Center")
-                df.at[idx, "practitioner__c"] = fake_info.get("practitioner", "Practitioner " + fake_info["first_name"])
-                df.at[idx, "appointment_type_name"] = fake_info.get("appointment_type", "General Checkup")
-        return df
-
-    merged_masked = apply_faker_masking(merged.copy(), fake_map)
-
-    # Step 9: Select and rename columns for final output, using masked data but original Id and GUID
+        return mask_with_rules(df, fake_map, "merged_patients", secret=masking_secret)
+
+    with metrics.stage("mask", "merged_patients") as stage:
+        merged_masked = stage.add(apply_faker_masking(merged.copy(), fake_map))
+
+    # Step 8: Select and rename columns for final output, using masked data but original Id and GUID
     final_df = pd.DataFrame()
     final_df["Id"] = merged["Id"]  # original Salesforce Id
     final_df["MRN"] = merged_masked["Patient_ID__c"]
@@ -150,17 +183,20 @@ def main():
     final_df["DOB"] = merged_masked["DOB__c"]
     final_df["Facility ID"] = merged["Facility__c"]  # original Facility Id
     final_df["Assessment Patient Name"] = merged_masked["patient_name"]
-    final_df["Assessment DOB"] = merged["patient_date_of_birth_date_time"]  # original assessment DOB
+    final_df["Assessment DOB"] = merged_masked["patient_date_of_birth_date_time"]  # date-shifted like DOB__c
     final_df["Provider Name"] = merged_masked["provider_name"]
     final_df["Facility GUID"] = merged_masked["facility_guid"]
     final_df["Assessment Facility Name"] = merged_masked["facility_name"]
     final_df["Practitioner"] = merged_masked["practitioner__c"]
     final_df["Appointment Type"] = merged_masked["appointment_type_name"]
 
-    # Step 10: Save output masked CSV
-    final_df.to_csv("joined_patient_assessment_masked_output.csv", index=False)
+    # Step 9: Save output masked data (CSV unless OUTPUT_FORMAT says otherwise)
+    masked_path = output_path("joined_patient_assessment_masked_output", OUTPUT_FORMAT)
+    with metrics.stage("write", "merged_patients") as stage:
+        write_frame(final_df, masked_path, OUTPUT_FORMAT)
+        stage.add(final_df)
 
-    # Step 11: Save both real merged data and masked data as CSV for debug/review,
+    # Step 10: Save both real merged data and masked data for debug/review,
     # with only the final columns and no raw IDs
     real_output = pd.DataFrame()
     real_output["Id"] = merged["Id"]
@@ -179,11 +215,22 @@ def main():
     real_output["Practitioner"] = merged["practitioner__c"]
     real_output["Appointment Type"] = merged["appointment_type_name"]
 
-    real_output.to_csv("merged_real_data.csv", index=False)
+    real_path = output_path("merged_real_data", OUTPUT_FORMAT)
+    with metrics.stage("write", "merged_patients") as stage:
+        write_frame(real_output, real_path, OUTPUT_FORMAT)
+        stage.add(real_output)
 
-    print("✅ Masked patient data saved to 'joined_patient_assessment_masked_output.csv'")
-    print("✅ Real merged data saved to 'merged_real_data.csv'")
+    print(f"✅ Masked patient data saved to '{masked_path}'")
+    print(f"✅ Real merged data saved to '{real_path}'")
     print(final_df.head())
+    print(metrics)
+    if METRICS_OUT:
+        print(f"Metrics written to {metrics.write(METRICS_OUT)}")
+    if metrics.dump_profile():
+        print(f"Masking profile written to {METRICS_PROFILE}")
+    dispose_engines()
+    if vault is not None:
+        vault.close()
 
 if __name__ == "__main__":
     main()
@@ -1,23 +1,74 @@
+import argparse
 import os
 from dotenv import load_dotenv
 import pandas as pd
-from clark_secrets import retrieve_project_secrets, ClarkSecretsConfig
-from simple_salesforce import Salesforce
-import requests
-import sqlalchemy
+from clark_secrets import ClarkSecretsConfig
+from connectors.salesforce import get_access_token, iter_salesforce_frames, token_refresher
 from faker import Faker
+from utils.masking import build_lookup, mask_sf_patients
+from utils.rules import load_plan, mask_with_rules
+from utils.pools import POOL_MIN_KEYS, as_fake_map, get_pools, pool_map
+from utils.pseudonym import KeyedPseudonymizer
+from utils.faker_map import real_patient_values
+from utils.vault import open_vault
+from utils.streaming import stream_table
+from utils.writers import output_path, parse_format, write_frame
+from utils.parallel import mask_tables, format_timings
+from connectors.sql import IN_WORKERS, get_engine, engine_stats, dispose_engines, fetch_by_ids, iter_chunks_by_ids
+from utils.credentials import cached_project_secrets
+from utils.jobs import Job, TableJob
+from utils.incremental import WatermarkStore, fetch_delta, soql_datetime, upsert_csv
+from utils.metrics import RunMetrics
+from utils.shards import ShardJob, shard_of
+from utils.scrub import attach_sources
+from utils.subset import parse_size, read_ids, report_from_metrics, sample_patients
 
 OUTPUT_DIR = "mocked_output"
 os.makedirs(OUTPUT_DIR, exist_ok=True)
 
-def save_df_csv(df: pd.DataFrame, filename: str):
-    path = os.path.join(OUTPUT_DIR, filename)
-    df.to_csv(path, index=False)
+# Tables read and masked chunk by chunk instead of loaded whole
+STREAM_TABLES = {"assessments", "superbill_report"}
+CHUNK_SIZE = 50_000
+# Rows kept per table (None for all; --subset keeps every row of the sampled
+# patients) and how patient IDs are sent to MySQL: "batched" bound IN lists,
+# a "temp_table" join, or "compare" to time both per table and keep the fastest
+ROW_LIMIT = 100
+ID_STRATEGY = os.getenv("ID_STRATEGY", "batched")
+# --incremental: high-water marks per source, kept next to the outputs
+WATERMARK_FILE = "watermarks.json"
+# Output format ("csv", "csv.gz", "parquet", "parquet:zstd", "arrow", ...)
+OUTPUT_FORMAT = os.getenv("OUTPUT_FORMAT", "csv")
+# Per-stage metrics report (.json, or .prom for Prometheus text) and masking profile
+METRICS_OUT = os.getenv("METRICS_OUT")
+METRICS_PROFILE = os.getenv("METRICS_PROFILE")
+# --shards: job state and per-shard outputs (put it on a filesystem every host shares)
+SHARD_JOB_DIR = os.getenv("SHARD_JOB_DIR", os.path.join(OUTPUT_DIR, "shard_job"))
+
+def save_df(df: pd.DataFrame, name: str, fmt=OUTPUT_FORMAT, partition_col=None, output_dir=OUTPUT_DIR):
+    path = output_path(os.path.join(output_dir, name), fmt)
+    write_frame(df, path, fmt, partition_col)
     print(f"Saved {len(df)} rows to {path}")
+    return path
 
-def make_faker_map(keys):
+def make_faker_map(keys, secret=None, seed=42, vault=None, patient_ids=None, record_numbers=None, attempt=0):
+    if vault is not None:
+        # reuse stored fakes, generate only for keys the vault hasn't seen; a
+        # retry after a clash changes the seed (Faker) or the attempt (keyed)
+        return vault.get_or_create(
+            keys,
+            lambda new_keys, attempt: as_fake_map(make_faker_map(new_keys, secret=secret, seed=seed + len(vault) + attempt,
+                                                                 patient_ids=patient_ids, record_numbers=record_numbers,
+                                                                 attempt=attempt)),
+        )
+    if secret is not None:
+        # keyed fakes permute the real MRN / record number ({Id: value}), keeping their format
+        return KeyedPseudonymizer(secret).make_faker_map(keys, patient_ids, record_numbers, attempt)
+    keys = list(keys)
+    if len(keys) >= POOL_MIN_KEYS:
+        # per-key Faker calls dominate at this size; pick from cached pools
+        return pool_map(keys, get_pools(), seed=seed)
     fake = Faker()
-    Faker.seed(42)
+    Faker.seed(seed)
     mapping = {}
     for k in keys:
         mapping[k] = {
@@ -40,134 +91,435 @@ def make_faker_map(keys):
         }
     return mapping
 
-def apply_masking(df, fake_map, id_cols, sf_id_col='Patient__c'):
-    for idx, row in df.iterrows():
-        pid = row.get(sf_id_col)
-        if pid in fake_map:
-            fake_info = fake_map[pid]
-            for col in df.columns:
-                if col in id_cols:
-                    continue  # keep IDs/GUIDs unchanged
-                if col in fake_info:
-                    df.at[idx, col] = fake_info[col]
-                else:
-                    df.at[idx, col] = "MASKED"
-    return df
+def apply_masking(df, fake_map, table, secret=None):
+    # per-column strategies from config/masking_rules.yaml
+    return mask_with_rules(df, fake_map, table, secret=secret)
 
 def apply_faker_to_sf(df, fake_map):
-    for idx, row in df.iterrows():
-        sf_id = row["Id"]
-        if sf_id in fake_map:
-            fake_info = fake_map[sf_id]
-            df.at[idx, "Patient_ID__c"] = fake_info.get("patient_id", "")
-            df.at[idx, "Patient_Record_Number__c"] = fake_info.get("patient_record_number", "")
-            df.at[idx, "First_Name__c"] = fake_info.get("first_name", "")
-            df.at[idx, "Last_Name__c"] = fake_info.get("last_name", "")
-            df.at[idx, "DOB__c"] = fake_info.get("dob", "")
-    return df
-
-def main():
+    return mask_sf_patients(df, fake_map)
+
+# Tables, their patient id / primary key / change-tracking / partition
+# columns and masking rules all come from config/masking_rules.yaml
+RULES = load_plan()
+TABLES = [name for name, plan in RULES.items() if plan.source == "mysql"]
+UPDATED_AT_COLS = {name: plan.updated_at for name, plan in RULES.items() if plan.updated_at}
+PRIMARY_KEYS = {name: plan.primary_key for name, plan in RULES.items() if plan.primary_key}
+PARTITION_COLS = {name: plan.partition_by for name, plan in RULES.items() if plan.partition_by}
+
+def patient_id_col_for(table):
+    return RULES[table].key
+
+def default_job(extract_mode=None):
+    """The Job (utils/jobs.py) this script's settings describe; the CLI reads one from YAML instead."""
+    return Job(
+        extract_mode=extract_mode or os.getenv("SF_EXTRACT_MODE", "query"),
+        tables={t: TableJob(t, patient_id_col_for(t), t in STREAM_TABLES) for t in TABLES},
+        output_dir=OUTPUT_DIR,
+        format=OUTPUT_FORMAT,
+        chunk_size=CHUNK_SIZE,
+        row_limit=ROW_LIMIT,
+        fetch_workers=IN_WORKERS,
+        id_strategy=ID_STRATEGY,
+    )
+
+def patients_soql(extract_mode, incremental=False, since=None, full=False):
+    # `full`: every patient, the population a --subset is sampled from
+    return default_job(extract_mode).soql(incremental, soql_datetime(since) if since else None, full)
+
+def take_subset(sf_patients, subset):
+    """The --subset sample of `sf_patients` (utils/subset.py) and the population size."""
+    population = len(sf_patients)
+    sample = sample_patients(sf_patients, **subset)
+    by = f" by {subset['by']}" if subset.get("by") else ""
+    print(f"[INFO] Subset: {len(sample):,} of {population:,} patients{by}")
+    return sample, population
+
+def print_subset_report(metrics, patient_ids, population, in_memory_tables, job):
+    """Per-table rows, queries and fetch time of the subset, with the full-run estimate."""
+    # streamed tables always go through batched IN lists
+    strategies = {t: job.id_strategy for t in in_memory_tables}
+    report = report_from_metrics(metrics, {t: job.id_column(t) for t in job.tables}, patient_ids, population,
+                                 strategies)
+    print(report)
+    print(f"Subset report written to {report.write(os.path.join(job.output_dir, 'subset_report.json'))}")
+
+def main(workers=1, incremental=False, output_format=OUTPUT_FORMAT, partition=False, metrics_path=METRICS_OUT,
+         profile_path=METRICS_PROFILE, subset=None, job=None):
+    # Sources, tables and their id columns, output directory and batch sizes:
+    # a utils.jobs.Job from the CLI, else this script's settings
+    job = job or default_job()
+    out_dir = job.output_dir
+    os.makedirs(out_dir, exist_ok=True)
+
+    # Wall/CPU time, rows, bytes and peak RSS per stage (auth, query, fetch, mask, write)
+    metrics = RunMetrics("mock_salesforcesql", profile_path=profile_path)
+
     # Load env and secrets
     load_dotenv(dotenv_path="env.clark")
     config = ClarkSecretsConfig()
-    secrets = retrieve_project_secrets(config)
-
-    # Salesforce OAuth token
-    token_url = secrets["SF_URL"] + "/services/oauth2/token"
-    payload = {
-        'grant_type': 'client_credentials',
-        'client_id': secrets["SF_CLIENT_ID"],
-        'client_secret': secrets["SF_CLIENT_SECRET"]
-    }
-    response = requests.post(token_url, data=payload)
-    response.raise_for_status()
-    token_data = response.json()
-    access_token = token_data["access_token"]
-    instance_url = token_data.get("instance_url", secrets["SF_URL"])
-    sf = Salesforce(instance_url=instance_url, session_id=access_token)
+    with metrics.stage("auth"):
+        secrets = cached_project_secrets(config)
+    masking_secret = secrets.get("MASKING_SECRET") or os.getenv("MASKING_SECRET")
+    fmt = parse_format(output_format)
+
+    def partition_col_for(name):
+        return PARTITION_COLS.get(name) if partition else None
+
+    # Incremental runs pull only rows changed since the last run's watermark
+    marks = WatermarkStore(os.path.join(out_dir, WATERMARK_FILE)) if incremental else None
+    if incremental and not (masking_secret or os.getenv("PSEUDONYM_VAULT")):
+        print("[WARN] --incremental without MASKING_SECRET or PSEUDONYM_VAULT: "
+              "fakes for merged rows will not match earlier runs")
+
+    # Salesforce OAuth token, shared with other jobs through the credential cache
+    # and refreshed if Salesforce answers 401
+    sf_credentials = (secrets["SF_URL"], secrets["SF_CLIENT_ID"], secrets["SF_CLIENT_SECRET"])
+    with metrics.stage("auth"):
+        access_token, instance_url = get_access_token(*sf_credentials)
 
     # Query Salesforce Patients
-    soql = """
-    SELECT
-        Id,
-        Practice_GUID__c,
-        Patient_ID__c,
-        Patient_Record_Number__c,
-        First_Name__c,
-        Last_Name__c,
-        DOB__c,
-        Facility__c
-    FROM Patient__c
-    ORDER BY Id
-    LIMIT 10
-    """
-    sf_result = sf.query(soql)
-    sf_patients = pd.DataFrame(sf_result['records']).drop(columns='attributes', errors='ignore')
-    save_df_csv(sf_patients, "salesforce_patients_real.csv")
+    # SF_EXTRACT_MODE=bulk (Bulk API 2.0) or query_all pulls every Patient__c
+    # record page by page; the default "query" keeps the top-10 sample.
+    # `subset` ({size, by, ids, seed}) samples patients from all of them and
+    # keeps every related row instead of the first ROW_LIMIT
+    extract_mode = job.extract_mode
+    since = marks.get("salesforce_patients") if incremental else None
+    soql = job.soql(incremental, soql_datetime(since) if since else None, full=subset is not None)
+    with metrics.stage("query", "salesforce_patients") as stage:
+        sf_frames = list(iter_salesforce_frames({"soql": soql, "mode": extract_mode}, access_token, instance_url,
+                                                refresh=token_refresher(*sf_credentials)))
+        sf_patients = stage.add(pd.concat(sf_frames, ignore_index=True))
+    if subset is not None:
+        sf_patients, population = take_subset(sf_patients, subset)
+    row_limit = None if subset is not None else job.row_limit
 
+    real_sf_path = os.path.join(out_dir, "salesforce_patients_real.csv")
     patient_ids = sf_patients["Id"].tolist()
+    real_values = real_patient_values(sf_patients)
+    known_ids = []
+    if incremental and os.path.exists(real_sf_path):
+        # unchanged patients can still have changed MySQL rows
+        known = pd.read_csv(real_sf_path, dtype=str,
+                            usecols=lambda c: c in ("Id", "Patient_ID__c", "Patient_Record_Number__c"))
+        known_ids = known["Id"].tolist()
+        patient_ids = list(dict.fromkeys(known_ids + patient_ids))
+        real_values = real_patient_values(pd.concat([known, sf_patients], ignore_index=True))
     if not patient_ids:
         print("No patient IDs from Salesforce; exiting.")
         return
-    patient_ids_sql = ",".join(f"'{pid}'" for pid in patient_ids)
 
     # Create Faker map keyed by Salesforce Id
-    fake_map = make_faker_map(patient_ids)
+    # PSEUDONYM_VAULT=<path> keeps fakes stable across runs
+    vault = open_vault("salesforcesql")
+    with metrics.stage("mask", "fake_map") as stage:
+        fake_map = make_faker_map(patient_ids, secret=masking_secret, vault=vault, **real_values)
+        stage.add(rows=len(patient_ids))
 
     # Create and save mocked Salesforce patients CSV
-    sf_patients_masked = apply_faker_to_sf(sf_patients.copy(), fake_map)
-    save_df_csv(sf_patients_masked, "salesforce_patients_mock.csv")
+    with metrics.stage("mask", "salesforce_patients") as stage:
+        sf_patients_masked = stage.add(apply_faker_to_sf(sf_patients.copy(), fake_map))
+    merge_counts = []
+    with metrics.stage("write", "salesforce_patients") as stage:
+        if incremental:
+            key = PRIMARY_KEYS["salesforce_patients"]
+            merge_counts.append(upsert_csv(real_sf_path, sf_patients, key, "salesforce_patients"))
+            upsert_csv(os.path.join(out_dir, "salesforce_patients_mock.csv"), sf_patients_masked, key)
+            marks.advance("salesforce_patients", sf_patients.get("SystemModstamp", []))
+        else:
+            partition_col = partition_col_for("salesforce_patients")
+            save_df(sf_patients, "salesforce_patients_real", fmt, partition_col, out_dir)
+            save_df(sf_patients_masked, "salesforce_patients_mock", fmt, partition_col, out_dir)
+        stage.add(sf_patients_masked)
 
-    # Setup MySQL
-    engine_str = (
-        f"mysql+mysqlconnector://{os.getenv('DB_USER')}:{os.getenv('DB_PASSWORD')}"
-        f"@{os.getenv('DB_HOST')}:{os.getenv('DB_PORT', 3306)}/{os.getenv('DB_NAME')}"
-    )
-    engine = sqlalchemy.create_engine(engine_str)
-
-    # Tables to query
-    tables = [
-        "PracticeFusionPatientDiagnosis",
-        "PracticeFusionPatientMedication",
-        "assessments",
-        "superbill_report"
-    ]
-
-    # Id/GUID columns to preserve (unmasked)
-    id_cols_map = {
-        "PracticeFusionPatientDiagnosis": {"id", "patient_salesforce_id", "patient_practice_guid"},
-        "PracticeFusionPatientMedication": {"id", "patient_salesforce_id", "practice_uuid"},
-        "assessments": {"id", "scheduled_event_guid", "patient_practice_guid", "Patient__c", "Facility__c", "provider_guid", "facility_guid"},
-        "superbill_report": {"noteId"}
-    }
-
-    for table in tables:
-        # Adjust patient id column per table
-        patient_id_col = "Patient__c"
-        if table == "PracticeFusionPatientDiagnosis" or table == "PracticeFusionPatientMedication":
-            patient_id_col = "patient_salesforce_id"
-        elif table == "superbill_report":
-            patient_id_col = "patientIdDisplay"
-
-        query = f"""
-        SELECT * FROM `{table}`
-        WHERE {patient_id_col} IN ({patient_ids_sql})
-        LIMIT 100
-        """
-        df = pd.read_sql(query, engine)
+    # Shared pooled MySQL engine
+    engine = get_engine()
+
+    def fetch(table):
+        with metrics.stage("fetch", table) as stage:
+            return stage.add(fetch_table(table))
+
+    def fetch_table(table):
+        if not incremental:
+            return fetch_by_ids(engine, table, job.id_column(table), patient_ids, strategy=job.id_strategy,
+                                workers=job.fetch_workers, limit=row_limit)
+        # no ROW_LIMIT here: a truncated delta would still advance the watermark;
+        # patients new since the last output get all their rows, not just the changed ones
+        return fetch_delta(engine, table, job.id_column(table), patient_ids, known_ids,
+                           UPDATED_AT_COLS.get(table), marks.get(table), strategy=job.id_strategy,
+                           workers=job.fetch_workers)
+
+    def write(table, df, masked_df):
+        with metrics.stage("write", table) as stage:
+            write_table(table, df, masked_df)
+            stage.add(masked_df)
+
+    def mask_inline(df, lookup, table, secret=None):
+        with metrics.stage("mask", table) as stage:
+            return stage.add(mask_with_rules(df, lookup, table, secret=secret))
+
+    def write_table(table, df, masked_df):
+        if incremental:
+            key = PRIMARY_KEYS[table]
+            merge_counts.append(upsert_csv(os.path.join(out_dir, f"{table}_real.csv"), df, key, table))
+            upsert_csv(os.path.join(out_dir, f"{table}_mock.csv"), masked_df, key)
+            if UPDATED_AT_COLS.get(table) in df.columns:
+                marks.advance(table, df[UPDATED_AT_COLS[table]])
+            return
         if df.empty:
             print(f"No data found for table {table}")
-            continue
+            return
+        save_df(df, f"{table}_real", fmt, partition_col_for(table), out_dir)
+        save_df(masked_df, f"{table}_mock", fmt, partition_col_for(table), out_dir)
 
-        save_df_csv(df, f"{table}_real.csv")
+    # Real names, ids, MRNs and DOBs for the `scrub` strategy on free-text columns
+    sources = pd.read_csv(real_sf_path, dtype=str) if incremental else sf_patients
+    lookup = attach_sources(build_lookup(fake_map), sources)
 
-        print(f"Masking data for table {table} with {len(df)} rows")
-        masked_df = apply_masking(df.copy(), fake_map, id_cols_map.get(table, set()), sf_id_col=patient_id_col)
+    # In-memory tables: fetched on threads, masked on `workers` processes.
+    # Deltas are small, so incremental runs mask every table this way.
+    in_memory_tables = [t for t in job.tables if incremental or t not in job.stream_tables]
+    print(f"Masking {len(in_memory_tables)} tables with {workers} worker(s)")
+    # worker processes can't report into `metrics`: their masking time comes from the timings
+    timings = mask_tables(
+        in_memory_tables,
+        fetch,
+        mask_inline if workers <= 1 else mask_with_rules,
+        lookup,
+        write,
+        mask_kwargs={t: {"table": t, "secret": masking_secret} for t in in_memory_tables},
+        workers=workers,
+    )
+    if workers > 1:
+        for timing in timings:
+            metrics.record("mask", timing.table, wall_s=timing.mask_s, rows=timing.rows)
 
-        save_df_csv(masked_df, f"{table}_mock.csv")
+    stream_stats = []
+    for table in job.tables:
+        if table in in_memory_tables:
+            continue
+        stats = stream_table(
+            table,
+            iter_chunks_by_ids(table, job.id_column(table), patient_ids, chunksize=job.chunk_size, limit=row_limit),
+            lambda chunk: apply_masking(chunk, lookup, table, secret=masking_secret),
+            output_path(os.path.join(out_dir, f"{table}_real"), fmt),
+            output_path(os.path.join(out_dir, f"{table}_mock"), fmt),
+            fmt=fmt,
+            partition_col=partition_col_for(table),
+            metrics=metrics,
+        )
+        if not stats.rows:
+            print(f"No data found for table {table}")
+        stream_stats.append(stats)
+
+    # Watermarks only move once every output is written
+    if incremental:
+        marks.save()
 
-    engine.dispose()
+    print(f"MySQL pool: {engine_stats(engine)}")
+    dispose_engines()
+    if vault is not None:
+        vault.close()
+    print(format_timings(timings))
+    for stats in stream_stats:
+        print(f"Streamed {stats}")
+    for counts in merge_counts:
+        print(f"Merged {counts}")
+    if subset is not None:
+        print_subset_report(metrics, patient_ids, population, in_memory_tables, job)
+    print(metrics)
+    if metrics_path:
+        print(f"Metrics written to {metrics.write(metrics_path)}")
+    if metrics.dump_profile():
+        print(f"Masking profile written to {profile_path}")
     print("✅ All data masked and saved.")
 
+
+def main_sharded(n_shards, job_dir=SHARD_JOB_DIR, workers=1, output_format=OUTPUT_FORMAT, partition=False,
+                 metrics_path=METRICS_OUT, profile_path=METRICS_PROFILE, subset=None):
+    """
+    Mask in `n_shards` shards of the patient ID set (utils/shards.py). The
+    Salesforce query and fake map run once per job and are kept in
+    `job_dir`; every shard then gets its own outputs under job_dir/output.
+    Re-running resumes at the first unfinished shard, and hosts running the
+    same command against a shared `job_dir` split the shards between them.
+    A `subset` is sampled once, when the job is prepared.
+    """
+    metrics = RunMetrics("mock_salesforcesql", profile_path=profile_path)
+
+    load_dotenv(dotenv_path="env.clark")
+    config = ClarkSecretsConfig()
+    with metrics.stage("auth"):
+        secrets = cached_project_secrets(config)
+    masking_secret = secrets.get("MASKING_SECRET") or os.getenv("MASKING_SECRET")
+    fmt = parse_format(output_format)
+
+    def partition_col_for(name):
+        return PARTITION_COLS.get(name) if partition else None
+
+    job = ShardJob(job_dir, n_shards)
+    patients_path = job.path("salesforce_patients_real.parquet")
+    fakes_path = job.path("fake_map.parquet")
+
+    def build():
+        # the job's only Salesforce query; restarts and other hosts read these files
+        sf_credentials = (secrets["SF_URL"], secrets["SF_CLIENT_ID"], secrets["SF_CLIENT_SECRET"])
+        with metrics.stage("auth"):
+            access_token, instance_url = get_access_token(*sf_credentials)
+        extract_mode = os.getenv("SF_EXTRACT_MODE", "query")
+        with metrics.stage("query", "salesforce_patients") as stage:
+            soql = patients_soql(extract_mode, full=subset is not None)
+            sf_frames = list(iter_salesforce_frames({"soql": soql, "mode": extract_mode},
+                                                    access_token, instance_url,
+                                                    refresh=token_refresher(*sf_credentials)))
+            sf_patients = stage.add(pd.concat(sf_frames, ignore_index=True))
+        if subset is not None:
+            sf_patients, _ = take_subset(sf_patients, subset)
+        # one fake map for the whole job keeps fakes unique across shards
+        vault = open_vault("salesforcesql")
+        with metrics.stage("mask", "fake_map") as stage:
+            fake_map = make_faker_map(sf_patients["Id"].tolist(), secret=masking_secret, vault=vault,
+                                      **real_patient_values(sf_patients))
+            stage.add(rows=len(sf_patients))
+        if vault is not None:
+            vault.close()
+        sf_patients.to_parquet(patients_path, index=False)
+        build_lookup(fake_map).to_parquet(fakes_path)
+
+    row_limit = None if subset is not None else ROW_LIMIT
+    subset_params = {k: v for k, v in (subset or {}).items() if k != "ids"}
+    job.prepare(build, params={"format": str(fmt), "partition": partition, "row_limit": row_limit,
+                               "tables": TABLES, "subset": subset_params or None})
+    sf_patients = pd.read_parquet(patients_path)
+    lookup = attach_sources(build_lookup(pd.read_parquet(fakes_path)), sf_patients)
+    shards = shard_of(sf_patients["Id"], job.n_shards)
+    in_memory_tables = [t for t in TABLES if t not in STREAM_TABLES]
+    engine = get_engine()
+
+    def mask_shard(shard):
+        out_dir = job.path("output", f"{shard:04d}")
+        os.makedirs(out_dir, exist_ok=True)
+        outputs, rows = [], {}
+        shard_patients = sf_patients[shards == shard].reset_index(drop=True)
+        patient_ids = shard_patients["Id"].tolist()
+
+        with metrics.stage("mask", "salesforce_patients") as stage:
+            masked = stage.add(apply_faker_to_sf(shard_patients.copy(), lookup))
+        with metrics.stage("write", "salesforce_patients"):
+            partition_col = partition_col_for("salesforce_patients")
+            outputs.append(save_df(shard_patients, "salesforce_patients_real", fmt, partition_col, out_dir))
+            outputs.append(save_df(masked, "salesforce_patients_mock", fmt, partition_col, out_dir))
+        rows["salesforce_patients"] = len(shard_patients)
+        if not patient_ids:
+            return {"outputs": outputs, "rows": rows}
+
+        def fetch(table):
+            with metrics.stage("fetch", table) as stage:
+                return stage.add(fetch_by_ids(engine, table, patient_id_col_for(table), patient_ids,
+                                              strategy=ID_STRATEGY, limit=row_limit))
+
+        def mask_inline(df, lookup, table, secret=None):
+            with metrics.stage("mask", table) as stage:
+                return stage.add(mask_with_rules(df, lookup, table, secret=secret))
+
+        def write(table, df, masked_df):
+            rows[table] = len(df)
+            if df.empty:
+                return
+            with metrics.stage("write", table):
+                outputs.append(save_df(df, f"{table}_real", fmt, partition_col_for(table), out_dir))
+                outputs.append(save_df(masked_df, f"{table}_mock", fmt, partition_col_for(table), out_dir))
+
+        timings = mask_tables(
+            in_memory_tables,
+            fetch,
+            mask_inline if workers <= 1 else mask_with_rules,
+            lookup,
+            write,
+            mask_kwargs={t: {"table": t, "secret": masking_secret} for t in in_memory_tables},
+            workers=workers,
+        )
+        if workers > 1:
+            for timing in timings:
+                metrics.record("mask", timing.table, wall_s=timing.mask_s, rows=timing.rows)
+
+        for table in TABLES:
+            if table in in_memory_tables:
+                continue
+            paths = [output_path(os.path.join(out_dir, f"{table}_{kind}"), fmt) for kind in ("real", "mock")]
+            stats = stream_table(
+                table,
+                iter_chunks_by_ids(table, patient_id_col_for(table), patient_ids, chunksize=CHUNK_SIZE,
+                                   limit=row_limit),
+                lambda chunk: apply_masking(chunk, lookup, table, secret=masking_secret),
+                *paths,
+                fmt=fmt,
+                partition_col=partition_col_for(table),
+                metrics=metrics,
+            )
+            rows[table] = stats.rows
+            outputs += [path for path in paths if os.path.exists(path)]
+            print(f"Streamed {stats}")
+        return {"outputs": outputs, "rows": rows}
+
+    ran = job.run(mask_shard)
+    print(f"MySQL pool: {engine_stats(engine)}")
+    dispose_engines()
+    print(metrics)
+    if metrics_path:
+        print(f"Metrics written to {metrics.write(metrics_path)}")
+    if metrics.dump_profile():
+        print(f"Masking profile written to {profile_path}")
+    print(f"[INFO] {job}")
+    if job.pending():
+        print(f"✅ Masked {len(ran)} shard(s); the rest are running elsewhere or failed (re-run to resume).")
+    else:
+        print(f"✅ All shards masked; manifest at {job.path('manifest.json')}")
+
 if __name__ == "__main__":
-    main()
+    parser = argparse.ArgumentParser(description="Mask Salesforce patients and related MySQL tables")
+    parser.add_argument("--workers", type=int, default=1,
+                        help="processes for masking (and threads for fetching) tables concurrently")
+    parser.add_argument("--incremental", action="store_true",
+                        help="only pull rows changed since the last run and merge them into the outputs")
+    parser.add_argument("--format", default=OUTPUT_FORMAT,
+                        help="output format: csv, csv.gz, parquet[:snappy|zstd], arrow[:lz4|zstd]")
+    parser.add_argument("--partition", action="store_true",
+                        help="partition outputs by Facility__c / practice GUID")
+    parser.add_argument("--metrics", default=METRICS_OUT,
+                        help="write per-stage metrics here: .json, or .prom for Prometheus text")
+    parser.add_argument("--profile-mask", default=METRICS_PROFILE,
+                        help="profile the masking stage into this file (.html with pyinstrument, else cProfile)")
+    parser.add_argument("--shards", type=int,
+                        help="mask in this many resumable shards of the patient IDs (see --job-dir)")
+    parser.add_argument("--job-dir", default=SHARD_JOB_DIR,
+                        help="shard job state and outputs; hosts sharing it split the shards")
+    parser.add_argument("--subset",
+                        help="mask this many patients (e.g. 500 or 1%%) with all their related rows, not the top rows")
+    parser.add_argument("--subset-by", metavar="COLUMN",
+                        help="stratify the --subset sample by this Patient__c column, e.g. Facility__c")
+    parser.add_argument("--subset-ids", metavar="FILE",
+                        help="mask exactly these patients (one Salesforce Id per line) with all their related rows")
+    parser.add_argument("--seed", type=int, default=0, help="random seed for --subset")
+    args = parser.parse_args()
+    subset = None
+    if args.subset or args.subset_ids:
+        if args.incremental:
+            parser.error("--subset/--subset-ids and --incremental cannot be combined")
+        if args.subset and args.subset_ids:
+            parser.error("use either --subset or --subset-ids")
+        try:
+            subset = {"size": parse_size(args.subset) if args.subset else None, "by": args.subset_by, "seed": args.seed,
+                      "ids": read_ids(args.subset_ids) if args.subset_ids else None}
+        except (OSError, ValueError) as e:
+            parser.error(str(e))
+    if args.incremental and (str(parse_format(args.format)) != "csv" or args.partition):
+        parser.error("--incremental merges into unpartitioned CSV outputs only")
+    if args.shards is not None:
+        if args.incremental:
+            parser.error("--shards and --incremental cannot be combined")
+        main_sharded(args.shards, job_dir=args.job_dir, workers=args.workers, output_format=args.format,
+                     partition=args.partition, metrics_path=args.metrics, profile_path=args.profile_mask,
+                     subset=subset)
+    else:
+        main(workers=args.workers, incremental=args.incremental, output_format=args.format,
+             partition=args.partition, metrics_path=args.metrics, profile_path=args.profile_mask, subset=subset)
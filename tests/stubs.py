@@ -0,0 +1,130 @@
+"""Local HTTP stubs standing in for Salesforce in tests."""
+import csv
+import io
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+
+class BulkApiStub:
+    """
+    Imitates the Bulk API 2.0 query job lifecycle: create job -> InProgress
+    for `polls_before_complete` polls -> JobComplete -> CSV result pages
+    chained with Sforce-Locator. Also serves the OAuth token endpoint and
+    REST query pages of `query_page_size` records chained by
+    nextRecordsUrl. Requests bearing a token in `expired_tokens` get a 401;
+    token requests take `token_delay` seconds. Use as a context manager; `url` is the instance URL.
+    """
+
+    def __init__(self, records, columns, polls_before_complete=1, reject_query=None,
+                 final_state="JobComplete", query_page_size=2000, expired_tokens=(), token_delay=0.0):
+        self.records = records
+        self.columns = columns
+        self.polls_before_complete = polls_before_complete
+        self.reject_query = reject_query
+        self.final_state = final_state
+        self.query_page_size = query_page_size
+        self.expired_tokens = set(expired_tokens)
+        self.token_delay = token_delay
+        self.jobs = {}
+        self.requests = []
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), self._handler())
+        self.url = f"http://127.0.0.1:{self._server.server_address[1]}"
+
+    def __enter__(self):
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+        return self
+
+    def __exit__(self, *exc):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def _page(self, offset, size):
+        out = io.StringIO()
+        writer = csv.writer(out, lineterminator="\n")
+        writer.writerow(self.columns)
+        for record in self.records[offset:offset + size]:
+            writer.writerow(["" if record.get(c) is None else record[c] for c in self.columns])
+        next_offset = offset + size
+        locator = str(next_offset) if next_offset < len(self.records) else "null"
+        return out.getvalue().encode(), locator
+
+    def _query_page(self, offset):
+        end = offset + self.query_page_size
+        page = {
+            "totalSize": len(self.records),
+            "done": end >= len(self.records),
+            "records": [{"attributes": {"type": "Patient__c"}, **r} for r in self.records[offset:end]],
+        }
+        if not page["done"]:
+            page["nextRecordsUrl"] = f"/services/data/v59.0/query/01g{end}"
+        return page
+
+    def _handler(self):
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+            def _send(self, status, body=b"", content_type="application/json", headers=None):
+                self.send_response(status)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(body)))
+                for k, v in (headers or {}).items():
+                    self.send_header(k, v)
+                self.end_headers()
+                self.wfile.write(body)
+
+            def _json(self, status, payload):
+                self._send(status, json.dumps(payload).encode())
+
+            def _expired(self):
+                token = self.headers.get("Authorization", "").removeprefix("Bearer ")
+                if token not in stub.expired_tokens:
+                    return False
+                self._json(401, [{"errorCode": "INVALID_SESSION_ID", "message": "Session expired or invalid"}])
+                return True
+
+            def do_POST(self):
+                stub.requests.append(("POST", self.path, dict(self.headers)))
+                if self.path == "/services/oauth2/token":
+                    form = parse_qs(self.rfile.read(int(self.headers["Content-Length"])).decode())
+                    if form.get("grant_type") != ["client_credentials"]:
+                        return self._json(400, {"error": "unsupported_grant_type"})
+                    time.sleep(stub.token_delay)
+                    return self._json(200, {"access_token": "token", "instance_url": stub.url})
+                if self._expired():
+                    return
+                body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+                if stub.reject_query and stub.reject_query in body["query"]:
+                    return self._json(400, [{"errorCode": "INVALIDJOB", "message": "not supported"}])
+                job_id = f"750{len(stub.jobs):015d}"
+                stub.jobs[job_id] = {"polls": 0}
+                self._json(200, {"id": job_id, "state": "UploadComplete"})
+
+            def do_GET(self):
+                stub.requests.append(("GET", self.path, dict(self.headers)))
+                if self._expired():
+                    return
+                url = urlparse(self.path)
+                parts = url.path.rstrip("/").split("/")
+                if parts[-2] == "query" and parts[-1].startswith("01g"):
+                    # nextRecordsUrl: /query/01g<offset>
+                    return self._json(200, stub._query_page(int(parts[-1][3:])))
+                if parts[-1] == "query":
+                    return self._json(200, stub._query_page(0))
+                if parts[-1] == "results":
+                    query = parse_qs(url.query)
+                    offset = int(query.get("locator", ["0"])[0])
+                    size = int(query.get("maxRecords", [len(stub.records)])[0])
+                    body, locator = stub._page(offset, size)
+                    return self._send(200, body, "text/csv", {"Sforce-Locator": locator})
+                job = stub.jobs[parts[-1]]
+                job["polls"] += 1
+                state = stub.final_state if job["polls"] > stub.polls_before_complete else "InProgress"
+                self._json(200, {"id": parts[-1], "state": state, "errorMessage": "stub failure"})
+
+        return Handler
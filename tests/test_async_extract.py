@@ -0,0 +1,81 @@
+import sys
+import os
+import threading
+import time
+import pandas as pd
+import sqlalchemy
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from connectors.async_extract import extract_with_related
+from connectors.salesforce import get_access_token
+from connectors.sql import fetch_by_ids
+from tests.stubs import BulkApiStub
+
+COLUMNS = ["Id", "Patient_ID__c", "Facility__c"]
+RECORDS = [{"Id": f"a0P{i:04d}", "Patient_ID__c": f"{i:07d}", "Facility__c": f"f{i % 3}"} for i in range(23)]
+
+
+def _engine(tmp_path):
+    engine = sqlalchemy.create_engine(f"sqlite:///{tmp_path / 'masker.db'}")
+    pd.DataFrame({
+        "id": range(100),
+        "Patient__c": [f"a0P{i % 40:04d}" for i in range(100)],
+    }).to_sql("assessments", engine, index=False)
+    return engine
+
+
+def test_bulk_pages_and_mysql_reads_overlap(tmp_path, monkeypatch):
+    monkeypatch.setenv("CREDENTIAL_CACHE", str(tmp_path / "credentials.json"))
+    engine = _engine(tmp_path)
+    lock = threading.Lock()
+    state = {"active": 0, "max_active": 0, "overlapped": 0}
+
+    with BulkApiStub(RECORDS, COLUMNS) as stub:
+        def fetch_assessments(page):
+            with lock:
+                state["active"] += 1
+                state["max_active"] = max(state["max_active"], state["active"])
+            seen = len(stub.requests)
+            time.sleep(0.2)
+            with lock:
+                state["active"] -= 1
+                # the next Salesforce page was requested while this read ran
+                state["overlapped"] += len(stub.requests) > seen
+            return fetch_by_ids(engine, "assessments", "Patient__c", page["Id"].tolist())
+
+        config = {"soql": "SELECT Id FROM Patient__c", "mode": "bulk", "page_size": 5, "poll_interval": 0}
+        frames, related = extract_with_related(config, fetch_assessments, sf_url=stub.url, client_id="id",
+                                               client_secret="secret")
+        token_posts = [r for r in stub.requests if r[1] == "/services/oauth2/token"]
+
+    assert [len(f) for f in frames] == [5, 5, 5, 5, 3]
+    assert pd.concat(frames)["Id"].tolist() == [r["Id"] for r in RECORDS]
+    assert [set(r["Patient__c"]) <= set(f["Id"]) for f, r in zip(frames, related)] == [True] * 5
+    assert sum(len(r) for r in related) == 66
+    assert len(token_posts) == 1
+    assert state["overlapped"] >= 3 and state["max_active"] == 2
+
+
+def test_rest_query_pages_and_bulk_fallback():
+    with BulkApiStub(RECORDS, COLUMNS, query_page_size=10, reject_query="GROUP BY") as stub:
+        first, _ = extract_with_related({"soql": "SELECT Id FROM Patient__c"}, len, access_token="token",
+                                        instance_url=stub.url)
+        config = {"soql": "SELECT Id FROM Patient__c GROUP BY Id", "mode": "bulk"}
+        frames, sizes = extract_with_related(config, len, access_token="token", instance_url=stub.url)
+    assert [len(f) for f in first] == [10]
+    assert sizes == [10, 10, 3] and "attributes" not in frames[0].columns
+
+
+def test_async_and_sync_jobs_share_one_token_request(tmp_path, monkeypatch):
+    monkeypatch.setenv("CREDENTIAL_CACHE", str(tmp_path / "credentials.json"))
+    with BulkApiStub(RECORDS, COLUMNS, token_delay=0.3) as stub:
+        # a synchronous job is mid-request when the async extraction starts
+        sync_job = threading.Thread(target=get_access_token, args=(stub.url, "id", "secret"))
+        sync_job.start()
+        time.sleep(0.1)
+        frames, _ = extract_with_related({"soql": "SELECT Id FROM Patient__c"}, len, sf_url=stub.url,
+                                         client_id="id", client_secret="secret")
+        sync_job.join()
+        token_posts = [r for r in stub.requests if r[1] == "/services/oauth2/token"]
+    assert len(token_posts) == 1 and sum(len(f) for f in frames) == len(RECORDS)
@@ -0,0 +1,32 @@
+import sys
+import os
+import copy
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from benchmarks.bench_pipeline import (STAGES, append_history, compare_latest, compare_runs, find_baseline,
+                                       run_pipeline)
+
+
+def test_pipeline_run_records_every_stage_and_flags_regressions(tmp_path):
+    record = run_pipeline(2_000, chunk_rows=700)
+    assert record["patients"] == 200 and 0 < record["merged_rows"] < 2_000
+    assert set(record["stages"]) == set(STAGES)
+    assert record["stages"]["normalize"]["rows"] == 2_000 and record["stages"]["merge"]["rows"] == 2_000
+    assert record["stages"]["mask"]["rows"] == 2_000 + record["merged_rows"]
+    assert all(s["calls"] and s["seconds"] > 0 for s in record["stages"].values())
+
+    slower = copy.deepcopy(record)
+    slower["stages"]["mask"]["seconds"] = record["stages"]["mask"]["seconds"] * 1.5 + 1
+    path = str(tmp_path / "history.json")
+    append_history(path, record)
+    other_scale = dict(record, rows=4_000)
+    history = append_history(path, other_scale)
+    history = append_history(path, slower)
+
+    assert find_baseline(history, history[-1]) == history[0]
+    assert find_baseline(history, history[1]) is None
+    flagged = [metric for metric, _, _, _, regressed in compare_runs(history[0], history[-1]) if regressed]
+    assert flagged == ["mask s"]
+    assert compare_latest(history) is True
+    assert compare_latest(history[:2]) is False
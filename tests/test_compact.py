@@ -0,0 +1,34 @@
+import sys
+import os
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from utils.compact import as_categorical, as_text, constant_column, downcast_frame, merge_where
+
+
+def test_merge_where_keeps_codes_and_both_sides_values():
+    old = pd.Series(["a", "b", None, "c"])
+    new = as_categorical(pd.Series(["X", "Y", "X", "Z"]))
+    merged = merge_where(old, new, np.array([True, False, True, False]))
+    assert isinstance(merged.dtype, pd.CategoricalDtype)
+    assert as_text(merged).tolist() == ["X", "b", "X", "c"]
+
+    assert merge_where(pd.Series([1, 2]), new.iloc[:2], np.array([True, False])) is None
+    assert merge_where(old, pd.Series(["x"] * 4), np.ones(4, dtype=bool)) is None
+
+
+def test_constant_column_is_one_category():
+    col = constant_column("MASKED", pd.RangeIndex(3))
+    assert list(col.cat.categories) == ["MASKED"] and col.tolist() == ["MASKED"] * 3
+    assert constant_column(None, pd.RangeIndex(2)).isna().all()
+
+
+def test_downcast_frame_shrinks_ints_and_object_text():
+    df = pd.DataFrame({"id": np.arange(1000, dtype="int64"), "delta": [-1, 5] * 500,
+                       "name": pd.Series(["a", None] * 500, dtype=object)})
+    out = downcast_frame(df.copy())
+    assert out["id"].dtype == "uint16" and out["delta"].dtype == "int8"
+    assert out["name"].dtype == "str" and out["name"].isna().sum() == 500
+    assert out["id"].tolist() == df["id"].tolist()
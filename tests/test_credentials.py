@@ -0,0 +1,127 @@
+import sys
+import os
+import json
+import multiprocessing
+import stat
+import pytest
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from connectors.async_extract import extract_with_related
+from connectors.salesforce import get_access_token, iter_salesforce_frames, token_cache_key, token_refresher
+from tests.stubs import BulkApiStub
+from utils import credentials
+from utils.credentials import CredentialCache, cached_project_secrets
+
+COLUMNS = ["Id", "Facility__c"]
+RECORDS = [{"Id": f"a0P{i:04d}", "Facility__c": f"f{i % 3}"} for i in range(12)]
+
+
+@pytest.fixture(autouse=True)
+def _fresh_memory():
+    credentials._memory.clear()
+    yield
+    credentials._memory.clear()
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+def _token_posts(stub):
+    return sum(1 for _, path, _ in stub.requests if path == "/services/oauth2/token")
+
+
+def test_values_expire_in_memory_and_on_disk(tmp_path):
+    clock = Clock()
+    path = str(tmp_path / "credentials.json")
+    cache = CredentialCache(path, clock=clock)
+    cache.put("k", {"v": 1}, ttl=60)
+    assert stat.S_IMODE(os.stat(path).st_mode) == 0o600
+
+    credentials._memory.clear()  # another process: only the file is shared
+    assert CredentialCache(path, clock=clock).get("k") == {"v": 1}
+    clock.now += 61
+    assert cache.get("k") is None
+    fetches = []
+    assert cache.get_or_fetch("k", lambda: fetches.append(1) or {"v": 2}, ttl=60) == {"v": 2}
+    assert cache.get_or_fetch("k", lambda: fetches.append(1) or {"v": 3}, ttl=60) == {"v": 2}
+    assert len(fetches) == 1
+
+
+def test_memory_only_cache_writes_no_file(tmp_path, monkeypatch):
+    monkeypatch.setenv("CREDENTIAL_CACHE", "off")
+    cache = credentials.default_cache()
+    cache.put("k", "v", ttl=60)
+    assert cache.path is None and cache.get("k") == "v"
+
+
+def test_secrets_are_fetched_once_and_keyed_by_identity(tmp_path):
+    calls = []
+
+    class Config:
+        project_id, client_id = "proj", "client"
+
+    def fetch(config):
+        calls.append(config)
+        return {"DB_PASSWORD": "pw"}
+
+    cache = CredentialCache(str(tmp_path / "credentials.json"))
+    assert cached_project_secrets(Config(), fetch, cache=cache) == {"DB_PASSWORD": "pw"}
+    credentials._memory.clear()
+    assert cached_project_secrets(Config(), fetch, cache=cache) == {"DB_PASSWORD": "pw"}
+    assert len(calls) == 1
+    # keys name the kind of value, not the identity behind it
+    assert [k.split(":")[0] for k in json.loads((tmp_path / "credentials.json").read_text())] == ["secrets"]
+    assert "proj" not in (tmp_path / "credentials.json").read_text()
+
+
+def _fetch_token(path, url, results):
+    results.put(get_access_token(url, "id", "secret", cache=CredentialCache(path)))
+
+
+def test_concurrent_processes_share_one_token_request(tmp_path):
+    path = str(tmp_path / "credentials.json")
+    ctx = multiprocessing.get_context("fork")
+    results = ctx.Queue()
+    with BulkApiStub(RECORDS, COLUMNS) as stub:
+        procs = [ctx.Process(target=_fetch_token, args=(path, stub.url, results)) for _ in range(6)]
+        for p in procs:
+            p.start()
+        for p in procs:
+            p.join(10)
+        tokens = [results.get(timeout=5) for _ in procs]
+        posts = _token_posts(stub)
+    assert tokens == [("token", stub.url)] * 6
+    assert posts == 1
+
+
+def test_stale_cached_token_is_refreshed_on_401(tmp_path):
+    cache = CredentialCache(str(tmp_path / "credentials.json"))
+    with BulkApiStub(RECORDS, COLUMNS, expired_tokens={"stale"}) as stub:
+        cache.put(token_cache_key(stub.url, "id"), {"access_token": "stale", "instance_url": stub.url}, ttl=60)
+        access_token, instance_url = get_access_token(stub.url, "id", "secret", cache=cache)
+        config = {"soql": "SELECT Id FROM Patient__c", "mode": "bulk", "page_size": 5, "poll_interval": 0}
+        frames = list(iter_salesforce_frames(config, access_token, instance_url,
+                                             refresh=token_refresher(stub.url, "id", "secret", cache)))
+        posts = _token_posts(stub)
+        statuses = [h.get("Authorization") for method, path, h in stub.requests if method == "POST"]
+    assert access_token == "stale" and [len(f) for f in frames] == [5, 5, 2]
+    # the rejected job POST is resent with the new token, which is cached for the next run
+    assert posts == 1 and statuses[0] == "Bearer stale" and statuses[-1] == "Bearer token"
+    assert cache.get(token_cache_key(stub.url, "id"))["access_token"] == "token"
+
+
+def test_async_extract_refreshes_a_stale_cached_token(tmp_path, monkeypatch):
+    monkeypatch.setenv("CREDENTIAL_CACHE", str(tmp_path / "credentials.json"))
+    with BulkApiStub(RECORDS, COLUMNS, expired_tokens={"stale"}, query_page_size=5) as stub:
+        credentials.default_cache().put(token_cache_key(stub.url, "id"),
+                                        {"access_token": "stale", "instance_url": stub.url}, ttl=60)
+        config = {"soql": "SELECT Id FROM Patient__c", "mode": "query_all"}
+        _, sizes = extract_with_related(config, len, stub.url, "id", "secret")
+        posts = _token_posts(stub)
+    assert sizes == [5, 5, 2] and posts == 1
@@ -0,0 +1,44 @@
+import sys
+import os
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from utils.dates import clamp_ages, day_offsets, shift_column, shift_dates
+
+KEY = "0123456789abcdef"
+
+
+def test_offsets_are_per_patient_keyed_and_never_zero():
+    keys = pd.Series([f"p{i % 500}" for i in range(5000)])
+    offsets = day_offsets(keys, KEY, max_days=30)
+    assert (offsets != 0).all() and (np.abs(offsets) <= 30).all()
+    assert (offsets[:500] == offsets[500:1000]).all()
+    assert not (offsets[:500] == day_offsets(keys[:500], "fedcba9876543210", max_days=30)).all()
+
+
+def test_shift_keeps_intervals_and_types():
+    df = pd.DataFrame({
+        "patient": ["a", "a", "b", "b"],
+        "visit": pd.to_datetime(["2024-01-01 09:00", "2024-02-15 17:30", "2024-01-01 00:00", None]),
+        "dob": ["1950-06-01", "1950-06-01", "1990-12-31", "1990-12-31"],
+    })
+    out = shift_dates(df.copy(), "patient", ["visit"], KEY, dob_cols=["dob"])
+    assert out["visit"].dtype == df["visit"].dtype
+    assert out["visit"][1] - out["visit"][0] == df["visit"][1] - df["visit"][0]
+    assert pd.isna(out.loc[3, "visit"])
+    # same patient, same offset across columns
+    visit_shift = out.loc[0, "visit"].normalize() - df.loc[0, "visit"].normalize()
+    assert pd.Timestamp(out.loc[0, "dob"]) - pd.Timestamp("1950-06-01") == visit_shift
+    assert out.loc[2, "dob"] != "1990-12-31" and len(out.loc[2, "dob"]) == 10
+
+
+def test_ages_over_89_are_clamped():
+    dobs = np.array(["1920-01-01", "1980-05-05", "NaT"], dtype="datetime64[ns]")
+    clamped = clamp_ages(dobs, reference="2026-10-18")
+    assert str(clamped[0])[:10] == "1936-10-19"
+    assert clamped[1] == dobs[1] and np.isnat(clamped[2])
+
+    shifted = shift_column(pd.Series(["1901-01-01"]), pd.Series(["a"]), KEY, max_age=89, reference="2026-10-18")
+    assert shifted[0] == "1936-10-19"
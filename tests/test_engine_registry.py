@@ -0,0 +1,45 @@
+import sys
+import os
+import pandas as pd
+import pytest
+from sqlalchemy import text
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from connectors.sql import (
+    add_hook, connect, dispose_engines, engine_stats, fetch_by_ids, get_engine, register_engine,
+)
+
+
+@pytest.fixture
+def engine(tmp_path):
+    engine = register_engine("test", f"sqlite:///{tmp_path / 'pool.db'}", pool_size=2, max_overflow=0)
+    pd.DataFrame({"id": range(10), "Patient__c": [f"p{i % 4}" for i in range(10)]}).to_sql(
+        "assessments", engine, index=False
+    )
+    yield engine
+    dispose_engines()
+
+
+def test_registry_returns_shared_engine(engine):
+    assert get_engine("test") is engine
+    with pytest.raises(KeyError):
+        get_engine("nope")
+
+
+def test_hooks_see_checkouts_and_queries(engine):
+    checkouts, queries = [], []
+    add_hook("checkout", lambda name, s: checkouts.append(name))
+    add_hook("query", lambda name, stmt, s: queries.append(stmt))
+
+    with connect(engine) as conn:
+        assert conn.execute(text("SELECT COUNT(*) FROM assessments")).scalar() == 10
+    df = fetch_by_ids(engine, "assessments", "Patient__c", ["p1", "p2"], batch_size=1, workers=2)
+    assert len(df) == 5
+
+    stats = engine_stats(engine)
+    assert stats.checkouts >= 3 and checkouts.count("test") == stats.checkouts
+    assert stats.queries >= 3 and any("COUNT(*)" in q for q in queries)
+    assert stats.max_query_s >= 0 and "checkouts" in str(stats)
+    # the pool is bounded by the configured options
+    assert engine.pool.size() == 2
@@ -0,0 +1,55 @@
+import sys
+import os
+import pandas as pd
+import sqlalchemy
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from utils.incremental import WatermarkStore, fetch_delta, merge_delta, soql_datetime, sql_datetime, upsert_csv
+
+
+def test_merge_counts_inserted_updated_unchanged():
+    existing = pd.DataFrame({"id": ["1", "2", "3"], "name": ["a", "b", "c"]})
+    delta = pd.DataFrame({"id": [2, 3, 4], "name": ["b", "C", "d"]})
+    merged, counts = merge_delta(existing, delta, ["id"], "t")
+    assert (counts.inserted, counts.updated, counts.unchanged) == (1, 1, 2)
+    assert dict(zip(merged["id"].astype(str), merged["name"])) == {"1": "a", "2": "b", "3": "C", "4": "d"}
+    assert str(counts) == "t: 1 inserted, 1 updated, 2 unchanged"
+
+
+def test_upsert_is_idempotent(tmp_path):
+    path = str(tmp_path / "t.csv")
+    delta = pd.DataFrame({"id": [1, 2], "note": ["x", None]})
+    first = upsert_csv(path, delta, ["id"])
+    again = upsert_csv(path, delta, ["id"])
+    assert first.inserted == 2
+    assert (again.inserted, again.updated, again.unchanged) == (0, 0, 2)
+    assert len(pd.read_csv(path)) == 2
+
+
+def test_watermark_only_moves_forward(tmp_path):
+    path = str(tmp_path / "marks.json")
+    marks = WatermarkStore(path)
+    marks.advance("sf", ["2024-05-01T10:00:00.000+0000", "2024-05-02T08:30:00.000+0000"])
+    marks.advance("sf", ["2024-04-01T00:00:00Z"])
+    marks.advance("sf", [])
+    marks.save()
+    reloaded = WatermarkStore(path)
+    assert soql_datetime(reloaded.get("sf")) == "2024-05-02T08:30:00Z"
+    assert sql_datetime(reloaded.get("sf")) == "2024-05-02 08:30:00"
+    assert reloaded.get("mysql") is None
+
+
+def test_new_patients_get_rows_older_than_the_mark(tmp_path):
+    engine = sqlalchemy.create_engine(f"sqlite:///{tmp_path / 'masker.db'}")
+    pd.DataFrame({
+        "id": [1, 2, 3, 4],
+        "Patient__c": ["old", "old", "new", "new"],
+        "updated_at": ["2024-01-01 00:00:00", "2024-06-01 00:00:00", "2024-01-01 00:00:00", "2024-02-01 00:00:00"],
+    }).to_sql("assessments", engine, index=False)
+    delta = fetch_delta(engine, "assessments", "Patient__c", ["old", "new"], known_ids=["old"],
+                        updated_at="updated_at", mark="2024-05-01T00:00:00+00:00")
+    assert sorted(delta["id"]) == [2, 3, 4]
+    unchanged = fetch_delta(engine, "assessments", "Patient__c", ["old"], known_ids=["old"],
+                            updated_at="updated_at", mark="2024-07-01T00:00:00+00:00")
+    assert unchanged.empty and "updated_at" in unchanged.columns
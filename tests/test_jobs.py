@@ -0,0 +1,84 @@
+import sys
+import os
+import subprocess
+import pandas as pd
+import pytest
+import sqlalchemy
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import cli
+from utils.jobs import JobError, count_sources, estimate_run, format_plan, load_job, parse_job, plan_rows
+
+RULES = {
+    "salesforce_patients": {"key": "Id"},
+    "assessments": {"key": "Patient__c", "source": "mysql"},
+    "superbill_report": {"key": "patientIdDisplay", "source": "mysql"},
+}
+
+
+def test_default_job_config_matches_the_script_defaults():
+    job = load_job()
+    assert list(job.tables) == ["PracticeFusionPatientDiagnosis", "PracticeFusionPatientMedication",
+                                "assessments", "superbill_report"]
+    assert job.stream_tables == ["assessments", "superbill_report"]
+    assert (job.row_limit, job.chunk_size, job.format, job.id_column("assessments")) == (100, 50_000, "csv",
+                                                                                         "Patient__c")
+    assert job.soql().endswith("FROM Patient__c ORDER BY Id LIMIT 10")
+    assert job.soql(incremental=True, since="2024-01-01T00:00:00Z") == (
+        "SELECT Id, Practice_GUID__c, Patient_ID__c, Patient_Record_Number__c, First_Name__c, Last_Name__c, "
+        "DOB__c, Facility__c, SystemModstamp FROM Patient__c WHERE SystemModstamp >= 2024-01-01T00:00:00Z")
+
+
+@pytest.mark.parametrize("spec, message", [
+    ({"chunk_sise": 10}, "unknown key"),
+    ({"tables": ["missing_table"]}, "no masking rules"),
+    ({"tables": {"assessments": {"id_column": "patient_id"}}}, "keyed by 'Patient__c'"),
+    ({"output": {"format": "xlsx"}}, "output format"),
+    ({"workers": 0}, "workers must be a positive integer"),
+    ({"subset": {"size": "150%"}}, "subset"),
+    ({"id_strategy": "fastest"}, "batched, temp_table, compare"),
+])
+def test_invalid_jobs_name_the_problem(spec, message):
+    with pytest.raises(JobError, match=message):
+        parse_job(spec, RULES)
+
+
+def test_plan_counts_and_estimate(tmp_path):
+    engine = sqlalchemy.create_engine(f"sqlite:///{tmp_path / 'masker.db'}")
+    pd.DataFrame({"id": range(5000), "Patient__c": "x"}).to_sql("assessments", engine, index=False)
+    pd.DataFrame({"noteId": range(800), "patientIdDisplay": "x"}).to_sql("superbill_report", engine, index=False)
+    job = parse_job({"salesforce": {"extract_mode": "bulk"}, "subset": {"size": "10%"},
+                     "tables": {"assessments": {"stream": True}, "superbill_report": None}}, RULES)
+
+    counts = count_sources(job, engine, lambda sobject, where: 1000)
+    assert counts == {"Patient__c": 1000, "assessments": 5000, "superbill_report": 800}
+    # a subset keeps every row of its patients: no row limit
+    assert plan_rows(job, counts) == [("Patient__c", 1000, 100), ("assessments", 5000, 500),
+                                      ("superbill_report", 800, 80)]
+    assert "10.00% patients" in format_plan(job, counts)
+
+    bench = {"rows": 1000, "patients": 100, "chunk_rows": 1000, "format": "csv", "peak_rss_mb": 220.0,
+             "stages": {"fake_map": {"rows_per_sec": 100.0}, "mask": {"rows_per_sec": 680.0},
+                        "write": {"rows_per_sec": 1360.0}}}
+    metrics = {"run": "mock_salesforcesql", "stages": [{"stage": "fetch", "table": "assessments", "rows": 500,
+                                                        "wall_s": 2.0}]}
+    estimate = estimate_run(job, counts, [bench, metrics])
+    assert [(name, rows, seconds) for name, rows, _, seconds in estimate.stages] == [
+        ("fetch", 580, 2.32), ("fake_map", 100, 1.0), ("mask", 680, 1.0), ("write", 1360, 1.0)]
+    # one in-memory table of 80 rows, one 50,000-row chunk and 100 patients at 0.2 MB/row
+    assert estimate.peak_rss_mb == pytest.approx(0.2 * (80 + 50_000 + 100))
+    assert estimate_run(job, counts, []) is None
+
+
+def test_cli_validates_without_heavy_imports(tmp_path, capsys):
+    bad = tmp_path / "job.yaml"
+    bad.write_text("workers: many\n")
+    assert cli.main(["validate"]) == 0
+    assert cli.main(["validate", str(bad)]) == 2
+    assert "workers must be a positive integer" in capsys.readouterr().err
+
+    code = "import sys, cli; cli.main(['validate']); print(sorted({'pandas', 'faker', 'simple_salesforce'} & set(sys.modules)))"
+    out = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True, check=True,
+                         cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    assert out.stdout.strip().endswith("[]")
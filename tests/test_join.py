@@ -0,0 +1,56 @@
+import sys
+import os
+import numpy as np
+import pandas as pd
+import pytest
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from utils.join import KeyIndex, stream_join
+
+ON = dict(left_on=["Id", "Facility__c"], right_on=["Patient__c", "Facility__c"])
+
+
+def _frames(n_left=200, n_right=5000, seed=0):
+    rng = np.random.default_rng(seed)
+    left = pd.DataFrame({
+        "Id": [f"a0P{i:04d}" for i in range(n_left)],
+        "Facility__c": rng.choice(["f1", "f2"], n_left),
+        "name": [f"n{i}" for i in range(n_left)],
+    })
+    right = pd.DataFrame({
+        "Patient__c": [f"a0P{i:04d}" for i in rng.integers(0, n_left * 5, n_right)],
+        "Facility__c": rng.choice(["f1", "f2"], n_right),
+        "name": [f"r{i}" for i in range(n_right)],
+    })
+    return left, right
+
+
+def test_stream_join_matches_pd_merge_and_reports_matches():
+    left, right = _frames()
+    expected = pd.merge(left, right, how="inner", suffixes=("_sf", "_mysql"), **ON)
+    chunks = (right.iloc[i:i + 700] for i in range(0, len(right), 700))
+    merged, stats = stream_join(left, chunks, suffixes=("_sf", "_mysql"), **ON)
+
+    pd.testing.assert_frame_equal(merged, expected)
+    assert stats.chunks == 8 and stats.right_rows == len(right)
+    assert stats.right_kept == len(expected) and stats.rows == len(expected)
+    assert 0 < stats.match_rate < 0.2 and stats.saved_mb > 0
+    assert stats.left_matched == expected["Id"].nunique()
+    assert "matched" in str(stats)
+
+
+def test_key_index_checks_the_whole_key():
+    left, _ = _frames(n_left=3)
+    index = KeyIndex(left, ["Id", "Facility__c"])
+    other = left.rename(columns={"Id": "Patient__c"})
+    other.loc[1, "Facility__c"] = "elsewhere"
+    assert index.contains(other, ["Patient__c", "Facility__c"]).tolist() == [True, False, True]
+
+
+def test_empty_stream_keeps_columns():
+    left, right = _frames(n_left=5)
+    merged, stats = stream_join(left, iter([]), right_columns=list(right.columns), **ON)
+    assert merged.empty and "Patient__c" in merged.columns and stats.chunks == 0
+    with pytest.raises(ValueError):
+        stream_join(left, iter([]), **ON)
@@ -0,0 +1,83 @@
+import sys
+import os
+import pandas as pd
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from utils.compact import as_text
+from utils.masking import mask_table, mask_sf_patients
+from utils.faker_map import make_faker_map, apply_faker_masking
+from benchmarks.bench_masking import (
+    legacy_apply_masking,
+    legacy_apply_faker_to_sf,
+    legacy_apply_faker_masking,
+    synthetic_fake_map,
+)
+
+
+def _fake_map():
+    fake_map = synthetic_fake_map(5)
+    return fake_map, list(fake_map)
+
+
+def test_mask_table_matches_row_loop():
+    fake_map, keys = _fake_map()
+    df = pd.DataFrame({
+        "id": ["1", "2", "3", "4"],
+        "Patient__c": [keys[0], "unknown", keys[3], keys[0]],
+        "patient_name": ["Ann Real", "Bob Real", "Cy Real", "Ann Real"],
+        "facility_name": ["F1", "F2", "F3", "F1"],
+        "notes": ["a", "b", "c", None],
+    })
+    expected = legacy_apply_masking(df.copy(), fake_map, {"id"})
+    result = mask_table(df.copy(), fake_map, {"id"})
+    # redacted columns come back categorical ("MASKED" stored once)
+    assert isinstance(result["notes"].dtype, pd.CategoricalDtype)
+    pd.testing.assert_frame_equal(result.apply(as_text), expected)
+    # unmatched rows are left alone, the key column itself is masked
+    assert result.loc[1, "patient_name"] == "Bob Real"
+    assert result.loc[0, "Patient__c"] == "MASKED"
+
+
+def test_mask_table_without_key_column_is_noop():
+    fake_map, _ = _fake_map()
+    df = pd.DataFrame({"noteId": ["n1"], "text": ["t"]})
+    pd.testing.assert_frame_equal(mask_table(df.copy(), fake_map, {"noteId"}, sf_id_col="patientIdDisplay"), df)
+
+
+def test_mask_sf_patients_matches_row_loop():
+    fake_map, keys = _fake_map()
+    df = pd.DataFrame({
+        "Id": [keys[1], keys[2], "missing"],
+        "Patient_ID__c": ["R1", "R2", "R3"],
+        "Patient_Record_Number__c": ["111-1111", "222-2222", "333-3333"],
+        "First_Name__c": ["A", "B", "C"],
+        "Last_Name__c": ["X", "Y", "Z"],
+        "DOB__c": ["1980-01-01", "1981-01-01", "1982-01-01"],
+        "Facility__c": ["f", "f", "g"],
+    })
+    expected = legacy_apply_faker_to_sf(df.copy(), fake_map)
+    result = mask_sf_patients(df.copy(), fake_map)
+    # DOB__c is date-shifted per patient instead of replaced with a fake DOB
+    pd.testing.assert_frame_equal(result.drop(columns="DOB__c").apply(as_text), expected.drop(columns="DOB__c"))
+    assert result.loc[2, "DOB__c"] == "1982-01-01"
+    assert (result["DOB__c"][:2] != df["DOB__c"][:2]).all()
+
+
+def test_apply_faker_masking_matches_row_loop():
+    mrns = ["MRN1", "MRN2", "MRN3"]
+    fake_map = make_faker_map(mrns)
+    df = pd.DataFrame({
+        "Id": ["s1", "s2", "s3", "s4"],
+        "Patient_ID__c": ["MRN1", "MRN2", "other", "MRN1"],
+        "Practice_GUID__c": ["g"] * 4,
+        "Patient_Record_Number__c": ["r"] * 4,
+        "First_Name__c": ["f"] * 4,
+        "Last_Name__c": ["l"] * 4,
+        "DOB__c": ["d"] * 4,
+    })
+    expected = legacy_apply_faker_masking(df.copy(), fake_map)
+    result = apply_faker_masking(df.copy(), fake_map)
+    pd.testing.assert_frame_equal(result.apply(as_text), expected)
+    # Patient__c did not exist and is added, NaN for the unmatched row
+    assert result["Patient__c"].isna().tolist() == [False, False, True, False]
@@ -0,0 +1,67 @@
+import sys
+import os
+import json
+import pstats
+import pandas as pd
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from utils.masking import mask_table
+from utils.metrics import RunMetrics
+from utils.streaming import stream_table
+
+
+def _frame(n):
+    return pd.DataFrame({"Patient__c": [f"p{i % 4}" for i in range(n)], "patient_name": ["Real"] * n})
+
+
+def test_stages_record_time_rows_bytes_and_memory():
+    metrics = RunMetrics("test")
+    with metrics.stage("query", "patients") as stage:
+        stage.add(_frame(10))
+
+    @metrics.timed("mask", "patients")
+    def mask(df):
+        return df.assign(patient_name="Fake")
+
+    mask(_frame(5))
+    mask(_frame(7))
+    metrics.record("fetch", "other", wall_s=1.5, rows=3)
+
+    report = {(s["stage"], s["table"]): s for s in metrics.report()["stages"]}
+    assert report[("query", "patients")]["rows"] == 10 and report[("query", "patients")]["bytes"] > 0
+    assert report[("mask", "patients")]["calls"] == 2 and report[("mask", "patients")]["rows"] == 12
+    assert report[("mask", "patients")]["cpu_s"] >= 0 and report[("mask", "patients")]["peak_rss_mb"] > 0
+    assert report[("fetch", "other")]["wall_s"] == 1.5 and report[("fetch", "other")]["cpu_s"] is None
+    assert "query" in str(metrics)
+
+
+def test_json_and_prometheus_reports(tmp_path):
+    metrics = RunMetrics('run "1"')
+    with metrics.stage("write", "assessments") as stage:
+        stage.add(rows=4, nbytes=100)
+    with metrics.stage("auth"):
+        pass
+
+    report = json.loads(open(metrics.write(str(tmp_path / "m.json"))).read())
+    assert report["run"] == 'run "1"' and len(report["stages"]) == 2
+
+    text = open(metrics.write(str(tmp_path / "m.prom"))).read()
+    assert "# TYPE patient_mocker_stage_wall_seconds gauge" in text
+    assert 'patient_mocker_stage_rows{run="run \\"1\\"",stage="write",table="assessments"} 4' in text
+    assert 'patient_mocker_stage_rows{run="run \\"1\\"",stage="auth"} 0' in text
+
+
+def test_stream_table_reports_stages_and_profiles_masking(tmp_path):
+    metrics = RunMetrics("stream", profile_path=str(tmp_path / "mask.prof"))
+    fake_map = {f"p{i}": {"patient_name": f"Fake {i}"} for i in range(4)}
+    chunks = (_frame(10) for _ in range(3))
+    stats = stream_table("assessments", chunks, lambda chunk: mask_table(chunk, fake_map, {"Patient__c"}),
+                         tmp_path / "real.csv", tmp_path / "mock.csv", metrics=metrics)
+
+    stages = {s["stage"]: s for s in metrics.report()["stages"]}
+    assert stats.rows == 30 and stages["fetch"]["rows"] == 30
+    assert stages["mask"]["calls"] == 3 and stages["write"]["calls"] == 6
+    assert metrics.dump_profile() == str(tmp_path / "mask.prof")
+    profiled = {name for _, _, name in pstats.Stats(str(tmp_path / "mask.prof")).stats}
+    assert "mask_table" in profiled
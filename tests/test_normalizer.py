@@ -0,0 +1,44 @@
+import sys
+import os
+import pandas as pd
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from utils.normalizer import AliasResolver, load_aliases, normalize_columns
+
+
+def _write(path, text, mtime):
+    path.write_text(text)
+    os.utime(path, ns=(mtime, mtime))
+
+
+def test_dict_aliases_match_exactly():
+    df = pd.DataFrame(columns=["Medical Record Number", "F Name", "Surnam", "extra"])
+    out = normalize_columns(df, load_aliases())
+    assert list(out.columns)[:2] == ["mrn", "first_name"]
+    assert "Surnam" in out.columns
+
+
+def test_fuzzy_match_is_cached_and_never_steals_exact(tmp_path):
+    path = tmp_path / "aliases.yaml"
+    _write(path, "last_name: [last_name, surname]\nfirst_name: [first_name]\n", 1_000_000_000)
+    resolver = AliasResolver(str(path), check_interval=0)
+
+    assert resolver.resolve("Surnam") == "last_name"
+    assert resolver.resolve("Surnam") == "last_name"
+    assert resolver.cache_info().hits == 1
+    assert resolver.resolve("zip code") is None
+    assert resolver.rename_map(["Surname", "Surnam", "First-Name"]) == {
+        "Surname": "last_name", "First-Name": "first_name",
+    }
+
+
+def test_yaml_change_invalidates_cache(tmp_path):
+    path = tmp_path / "aliases.yaml"
+    _write(path, "mrn: [mrn]\n", 1_000_000_000)
+    resolver = AliasResolver(str(path), fuzzy_cutoff=None, check_interval=0)
+    assert resolver.resolve("chart no") is None
+
+    _write(path, "mrn: [mrn, chart no]\n", 2_000_000_000)
+    assert resolver.resolve("Chart No") == "mrn"
+    assert resolver.cache_info().currsize == 1
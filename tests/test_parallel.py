@@ -0,0 +1,52 @@
+import sys
+import os
+import pandas as pd
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from utils.masking import mask_table
+from utils.parallel import mask_tables
+from benchmarks.bench_masking import synthetic_fake_map, synthetic_assessments
+
+
+def test_parallel_masking_matches_inline():
+    fake_map = synthetic_fake_map(50)
+    tables = {
+        "a": synthetic_assessments(1000, list(fake_map), seed=1),
+        "b": synthetic_assessments(10, list(fake_map), seed=2),
+        "empty": synthetic_assessments(0, list(fake_map)),
+    }
+    kwargs = {t: {"id_cols": {"id", "Patient__c"}} for t in tables}
+
+    def run(workers):
+        out = {}
+        timings = mask_tables(
+            list(tables), lambda t: tables[t].copy(), mask_table, fake_map,
+            lambda t, real, masked: out.__setitem__(t, masked),
+            mask_kwargs=kwargs, workers=workers, chunk_rows=300,
+        )
+        return out, {t.table: t.rows for t in timings}
+
+    inline, inline_rows = run(1)
+    parallel, parallel_rows = run(2)
+    assert inline_rows == parallel_rows == {"a": 1000, "b": 10, "empty": 0}
+    for t in tables:
+        pd.testing.assert_frame_equal(parallel[t], inline[t])
+    assert (inline["a"]["notes"] == "MASKED").all()
+
+
+_PARENT_STATE = []
+
+
+def _mask_reporting_parent_state(df, lookup):
+    return df.assign(parent_state=len(_PARENT_STATE), has_lookup=len(lookup))
+
+
+def test_workers_are_not_forked_from_the_fetching_process():
+    fake_map = synthetic_fake_map(5)
+    df = synthetic_assessments(20, list(fake_map), seed=3)
+    _PARENT_STATE.append("set after import: only a forked child would see it")
+    out = {}
+    mask_tables(["a"], lambda t: df.copy(), _mask_reporting_parent_state, fake_map,
+                lambda t, real, masked: out.__setitem__(t, masked), workers=2)
+    assert (out["a"]["parent_state"] == 0).all() and (out["a"]["has_lookup"] == 5).all()
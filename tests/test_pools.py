@@ -0,0 +1,76 @@
+import sys
+import os
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from utils import pools as pool_module
+from utils.faker_map import apply_faker_masking, make_faker_map
+from utils.pools import get_pools, load_pools, pool_map, pool_path
+from utils.pseudonym import KeyedPseudonymizer
+from utils.vault import PseudonymVault
+
+SIZE = 64
+
+
+def test_pools_are_built_once_and_cached_on_disk(tmp_path):
+    pools = get_pools(size=SIZE, pool_dir=str(tmp_path))
+    path = pool_path(size=SIZE, pool_dir=str(tmp_path))
+    assert os.path.exists(path)
+    assert all(len(values) == SIZE for values in pools.values())
+    pool_module._pools.clear()
+    reloaded = get_pools(size=SIZE, pool_dir=str(tmp_path))
+    assert all((reloaded[name] == load_pools(path)[name]).all() for name in pools)
+
+
+def test_pool_map_is_deterministic_unique_and_complete(tmp_path):
+    pools = get_pools(size=SIZE, pool_dir=str(tmp_path))
+    keys = [f"a0P{i:06d}" for i in range(20_000)] + ["a0P000001"]
+    fakes = pool_map(keys, pools)
+
+    assert len(fakes) == 20_000 and fakes.index[0] == "a0P000000"
+    assert fakes["patient_id"].is_unique and fakes["patient_record_number"].is_unique
+    assert set(KeyedPseudonymizer("s").record("x")) <= set(fakes.columns)
+    assert fakes["first_name"].isin(pools["first_name"]).all()
+    assert (fakes["patient_name"] == fakes["first_name"] + " " + fakes["last_name"]).all()
+    assert fakes["patient_id"].str.fullmatch(r"[A-Z]{3}\d{3}[A-Z]{3}\d{2}").all()
+    assert fakes["practice_guid"].str.fullmatch(r"[0-9a-f]{8}-[0-9a-f]{4}-4[0-9a-f]{3}-[0-9a-f]{4}-[0-9a-f]{12}").all()
+    assert not pd.to_datetime(fakes["dob"], format="%Y-%m-%d").isna().any()
+
+    # a key gets the same fakes in any batch; another seed gives other fakes
+    pd.testing.assert_frame_equal(pool_map(keys[100:50:-1], pools), fakes.loc[keys[100:50:-1]])
+    assert (pool_map(keys[:100], pools, seed=7)["patient_id"] != fakes["patient_id"][:100]).all()
+
+
+def test_make_faker_map_uses_pools_and_vault_stores_them(tmp_path):
+    pools = get_pools(size=SIZE, pool_dir=str(tmp_path))
+    fakes = make_faker_map(["m1", "m2"], pools=pools)
+    assert isinstance(fakes, pd.DataFrame)
+
+    df = pd.DataFrame({"Patient_ID__c": ["m1", "m2", "other"], "Id": ["a", "b", "c"]})
+    masked = apply_faker_masking(df.copy(), fakes)
+    assert masked["Patient_ID__c"].tolist()[:2] == fakes["patient_id"].tolist()
+    assert masked.loc[2, "Id"] == "c"
+
+    with PseudonymVault(str(tmp_path / "vault.sqlite")) as vault:
+        stored = make_faker_map(["m1", "m2"], vault=vault, pools=pools)
+        assert isinstance(stored, dict) and len(vault) == 2
+        assert np.isin([stored["m1"]["first_name"]], pools["first_name"]).all()
+
+
+def test_pooled_ids_do_not_depend_on_batch_order(tmp_path):
+    pools = get_pools(size=SIZE, pool_dir=str(tmp_path))
+    keys = [f"a0P{i:06d}" for i in range(5000)]
+    fakes = pool_map(keys, pools)
+    shuffled = list(np.random.default_rng(0).permutation(keys))
+    superset = [f"a0Q{i:06d}" for i in range(5000)] + shuffled
+    pd.testing.assert_frame_equal(pool_map(shuffled, pools), fakes.loc[shuffled])
+    pd.testing.assert_frame_equal(pool_map(superset, pools).loc[keys], fakes)
+
+    # a space barely larger than the batch forces many collisions
+    h = np.random.default_rng(1).integers(0, 2**63, size=900, dtype=np.uint64)
+    codes = pool_module._unique_codes(h, 1000, salt=1)
+    perm = np.random.default_rng(2).permutation(len(h))
+    assert len(set(codes.tolist())) == len(h)
+    assert (pool_module._unique_codes(h[perm], 1000, salt=1) == codes[perm]).all()
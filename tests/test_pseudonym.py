@@ -0,0 +1,57 @@
+import sys
+import os
+import re
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from utils.pseudonym import KeyedPseudonymizer, FIRST_NAMES
+import pandas as pd
+
+from utils.faker_map import make_faker_map, real_patient_values
+
+
+def test_same_secret_same_fakes_across_instances():
+    a = KeyedPseudonymizer("s3cret").record("a0P000000000001")
+    b = KeyedPseudonymizer("s3cret").record("a0P000000000001")
+    c = KeyedPseudonymizer("other").record("a0P000000000001")
+    assert a == b
+    assert a != c
+    assert a["first_name"] in FIRST_NAMES
+    assert re.fullmatch(r"\d{4}-\d{2}-\d{2}", a["dob"])
+
+
+def test_permute_preserves_format_and_is_collision_free():
+    p = KeyedPseudonymizer("s3cret")
+    values = [f"{i:03d}-{i * 7 % 10000:04d}" for i in range(1000)]
+    fakes = [p.permute(v) for v in values]
+    assert len(set(fakes)) == len(values)
+    assert all(re.fullmatch(r"\d{3}-\d{4}", f) for f in fakes)
+    assert p.permute("abC-12") != "abC-12"
+    assert re.fullmatch(r"[a-z]{2}[A-Z]-\d{2}", p.permute("abC-12"))
+    assert p.permute("---") == "---"
+
+
+def test_permute_is_a_bijection_on_small_domain():
+    p = KeyedPseudonymizer("s3cret")
+    domain = [f"{i:02d}" for i in range(100)]
+    assert sorted(p.permute(v) for v in domain) == domain
+
+
+def test_make_faker_map_with_secret_uses_real_values():
+    p = KeyedPseudonymizer("s3cret")
+    fake_map = p.make_faker_map(["k1", "k2"], record_numbers={"k1": "123-4567"})
+    assert re.fullmatch(r"\d{3}-\d{4}", fake_map["k1"]["patient_record_number"])
+    assert make_faker_map(["k1", "k2"], secret="s3cret") == p.make_faker_map(["k1", "k2"])
+
+
+def test_keyed_fakes_keep_the_real_mrn_format():
+    patients = pd.DataFrame({"Id": ["a0P000000000001AAA", "a0P000000000002AAA"],
+                             "Patient_ID__c": ["MRN-00417", "88213"],
+                             "Patient_Record_Number__c": ["123-4567", None]})
+    fake_map = make_faker_map(patients["Id"], secret="s3cret", **real_patient_values(patients))
+    first, second = fake_map["a0P000000000001AAA"], fake_map["a0P000000000002AAA"]
+    assert re.fullmatch(r"[A-Z]{3}-\d{5}", first["patient_id"]) and first["patient_id"] != "MRN-00417"
+    assert re.fullmatch(r"\d{5}", second["patient_id"])
+    assert re.fullmatch(r"\d{3}-\d{4}", first["patient_record_number"])
+    # no real record number: the Salesforce Id is permuted instead
+    assert len(second["patient_record_number"]) == len("a0P000000000002AAA")
@@ -0,0 +1,102 @@
+import sys
+import os
+import pandas as pd
+import pytest
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from utils.compact import as_text
+from utils.rules import compile_rules, load_plan, mask_with_rules
+from benchmarks.bench_masking import legacy_apply_masking, synthetic_fake_map
+
+ASSESSMENT_ID_COLS = {"id", "scheduled_event_guid", "patient_practice_guid", "Patient__c", "Facility__c",
+                      "provider_guid", "facility_guid"}
+
+
+def test_yaml_plan_matches_legacy_assessment_masking():
+    fake_map = synthetic_fake_map(4)
+    keys = list(fake_map)
+    df = pd.DataFrame({
+        "id": ["1", "2", "3"],
+        "Patient__c": [keys[0], "unknown", keys[2]],
+        "Facility__c": ["f1", "f2", "f3"],
+        "patient_name": ["Ann Real", "Bob Real", "Cy Real"],
+        "notes": ["a", "b", None],
+    })
+    expected = legacy_apply_masking(df.copy(), fake_map, ASSESSMENT_ID_COLS)
+    pd.testing.assert_frame_equal(mask_with_rules(df.copy(), fake_map, "assessments").apply(as_text), expected)
+    assert "assessments" in [name for name, plan in load_plan().items() if plan.source == "mysql"]
+
+
+def test_merged_patients_templates_and_fallbacks():
+    fake_map = {"MRN1": {"patient_id": "P1", "patient_record_number": "111-1111", "first_name": "Ann",
+                         "last_name": "Smith", "dob": "1970-01-01"}}
+    df = pd.DataFrame({"Id": ["sf1"], "Patient_ID__c": ["MRN1"], "provider_name": ["Dr. Real"],
+                       "facility_guid": ["real-guid"]})
+    out = mask_with_rules(df, fake_map, "merged_patients")
+    row = out.iloc[0]
+    assert row["Id"] == "sf1"
+    assert row["Patient_ID__c"] == "P1"
+    assert row["patient_name"] == "Ann Smith"
+    assert row["provider_name"] == "Dr. Smith"
+    assert row["facility_guid"] == "FAC-SMI"
+
+
+RULES = {"tables": {"visits": {
+    "key": "patient",
+    "default": "redact",
+    "columns": {
+        "patient": "preserve",
+        "email": {"strategy": "hash", "length": 12},
+        "visit_date": {"strategy": "date_shift", "max_days": 30},
+        "dob": {"strategy": "generalize", "to": "year"},
+        "zip": {"strategy": "generalize", "to": "zip3"},
+    },
+}}}
+
+
+def test_row_strategies_are_keyed_and_per_patient():
+    df = pd.DataFrame({
+        "patient": ["p1", "p1", "p2", "other"],
+        "email": ["a@x.org", "a@x.org", "b@x.org", "c@x.org"],
+        "visit_date": ["2024-03-01", "2024-03-11", "2024-03-01", "2024-03-01"],
+        "dob": ["1961-07-04", "1961-07-04", None, "1990-01-01"],
+        "zip": ["02139", "02139", "9", "10001"],
+        "notes": ["x", "y", "z", "w"],
+    })
+    fake_map = {"p1": {}, "p2": {}}
+    out = compile_rules(RULES, secret="s1")["visits"].apply(df.copy(), fake_map)
+    other = compile_rules(RULES, secret="s2")["visits"].apply(df.copy(), fake_map)
+
+    assert out.loc[0, "email"] == out.loc[1, "email"] != other.loc[0, "email"]
+    assert len(out.loc[0, "email"]) == 12
+    shifted = pd.to_datetime(out["visit_date"][:2])
+    assert (shifted[1] - shifted[0]).days == 10
+    assert 0 < abs((shifted[0] - pd.Timestamp("2024-03-01")).days) <= 30
+    assert out["dob"].tolist()[:2] == ["1961", "1961"] and pd.isna(out.loc[2, "dob"])
+    assert out["zip"].tolist()[:2] == ["021**", "021**"] and pd.isna(out.loc[2, "zip"])
+    assert out.loc[0, "notes"] == "MASKED"
+    # rows whose key is not in the fake map are untouched
+    assert out.loc[3].tolist() == df.loc[3].tolist()
+
+
+def test_unknown_strategy_is_rejected():
+    with pytest.raises(ValueError, match="strategy"):
+        compile_rules({"tables": {"t": {"key": "k", "columns": {"c": "shuffle"}}}})
+
+
+def test_unkeyed_date_shift_falls_back_to_the_fake_dob():
+    df = pd.DataFrame({"Id": ["sf1", "sf2"], "DOB__c": ["1980-03-04", "1975-11-30"]})
+    fake_map = {"sf1": {"dob": "1961-01-02"}, "sf2": {"dob": "1999-12-31"}}
+    rules = {"tables": {"salesforce_patients": {"key": "Id", "default": "preserve", "columns": {
+        "DOB__c": {"strategy": "date_shift", "max_age": True},
+        "visit": "date_shift",
+        "email": "hash",
+    }}}}
+    plan = compile_rules(rules, secret=None)["salesforce_patients"]
+    out = plan.apply(df.copy(), fake_map)
+    # nothing derived from the real date: the offset would be recomputable from the kept Id
+    assert out["DOB__c"].tolist() == ["1961-01-02", "1999-12-31"]
+    assert plan.apply(df.assign(visit="2024-01-01"), fake_map)["visit"].tolist() == ["MASKED"] * 2
+    with pytest.raises(ValueError, match="MASKING_SECRET"):
+        plan.apply(df.assign(email="a@x.org"), fake_map)
@@ -0,0 +1,53 @@
+import sys
+import os
+import pandas as pd
+import pytest
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from connectors.salesforce import iter_bulk_query_frames, iter_salesforce_frames
+from tests.stubs import BulkApiStub
+
+COLUMNS = ["Id", "Patient_ID__c", "First_Name__c", "Facility__c"]
+RECORDS = [
+    {"Id": f"a0P{i:015d}", "Patient_ID__c": f"{i:07d}", "First_Name__c": f"Name {i}",
+     "Facility__c": None if i % 5 == 0 else f"a0F{i % 3}"}
+    for i in range(23)
+]
+
+
+def test_bulk_pages_stream_in_order():
+    with BulkApiStub(RECORDS, COLUMNS, polls_before_complete=2) as stub:
+        frames = list(iter_bulk_query_frames(
+            stub.url, "token", "SELECT Id FROM Patient__c", page_size=5, max_workers=3, poll_interval=0,
+        ))
+    assert [len(f) for f in frames] == [5, 5, 5, 5, 3]
+    df = pd.concat(frames, ignore_index=True)
+    assert df["Id"].tolist() == [r["Id"] for r in RECORDS]
+    # ids keep their leading zeros, empty cells come back as missing
+    assert df.loc[1, "Patient_ID__c"] == "0000001"
+    assert df["Facility__c"].isna().sum() == 5
+    assert all(h.get("Authorization") == "Bearer token" for _, _, h in stub.requests)
+
+
+def test_failed_job_raises():
+    with BulkApiStub(RECORDS, COLUMNS, final_state="Failed") as stub:
+        with pytest.raises(RuntimeError, match="stub failure"):
+            list(iter_bulk_query_frames(stub.url, "token", "SELECT Id FROM Patient__c", poll_interval=0))
+
+
+def test_bulk_mode_falls_back_to_query_all(monkeypatch):
+    calls = []
+
+    def fake_query_all_iter(self, soql, include_deleted=False, **kwargs):
+        calls.append(soql)
+        for r in RECORDS:
+            yield {"attributes": {"type": "Patient__c"}, **r}
+
+    monkeypatch.setattr("simple_salesforce.Salesforce.query_all_iter", fake_query_all_iter)
+    with BulkApiStub(RECORDS, COLUMNS, reject_query="GROUP BY") as stub:
+        config = {"soql": "SELECT Facility__c FROM Patient__c GROUP BY Facility__c", "mode": "bulk", "page_size": 10}
+        frames = list(iter_salesforce_frames(config, access_token="token", instance_url=stub.url))
+    assert calls == [config["soql"]]
+    assert [len(f) for f in frames] == [10, 10, 3]
+    assert "attributes" not in frames[0].columns
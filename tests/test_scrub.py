@@ -0,0 +1,66 @@
+import sys
+import os
+import pandas as pd
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from utils.dates import shift_column
+from utils.masking import build_lookup, hash_key_for
+from utils.rules import compile_rules
+from utils.scrub import attach_sources, build_scrubber
+
+FAKES = {
+    "sf1": {"first_name": "Zed", "last_name": "Quill", "patient_record_number": "900-0001"},
+    "sf2": {"first_name": "Yara", "last_name": "Pike", "patient_record_number": "900-0002"},
+}
+REAL = pd.DataFrame({
+    "Id": ["sf1", "sf2"],
+    "First_Name__c": ["Ann", "Ann"],
+    "Last_Name__c": ["O'Brien", "Smith"],
+    "Patient_Record_Number__c": ["111-1111", "222-2222"],
+    "DOB__c": ["1980-03-07", "1975-12-25"],
+})
+
+
+def _plan(secret="s3cret"):
+    rules = {"tables": {"dx": {"key": "pid", "default": "preserve", "columns": {"note": "scrub"}}}}
+    return compile_rules(rules, secret)["dx"]
+
+
+def test_scrub_replaces_real_identifiers_with_the_rows_own_fakes():
+    lookup = attach_sources(build_lookup(FAKES), REAL)
+    df = pd.DataFrame({
+        "pid": ["sf1", "sf2", "sf2", "other"],
+        "note": [
+            "ann o'brien (MRN 111-1111) seen for annual visit",
+            "Ann Smith, DOB 12/25/1975, called re 222-2222",
+            "Type 2 diabetes",
+            "Ann Smith",
+        ],
+    })
+    out = _plan().apply(df.copy(), lookup)
+
+    dob = shift_column(pd.Series(["1975-12-25"]), pd.Series(["sf2"]), hash_key_for("s3cret"), max_age=89)[0]
+    us_dob = pd.Timestamp(dob).strftime("%m/%d/%Y")
+    assert out.loc[0, "note"] == "Zed Quill (MRN 900-0001) seen for annual visit"
+    # "Ann" is both patients' first name: each row gets its own patient's fake
+    assert out.loc[1, "note"] == f"Yara Pike, DOB {us_dob}, called re 900-0002"
+    assert out.loc[2, "note"] == "Type 2 diabetes"
+    # rows whose key is not in the fake map are left alone, like every other strategy
+    assert out.loc[3, "note"] == "Ann Smith"
+
+
+def test_scrubber_matches_whole_tokens_and_date_spellings():
+    lookup = attach_sources(build_lookup(FAKES), REAL)
+    scrubber = build_scrubber(lookup, hash_key_for("k"))
+    assert scrubber.has_phi("born 3/7/1980") and scrubber.has_phi("1980-03-07")
+    assert not scrubber.has_phi("Annual 111-11111 smithfield")
+    values = pd.Series(["Smith", None, "smith"])
+    out = scrubber.scrub_column(values, own=[1, -1, -1])
+    assert out[0] == "Pike" and pd.isna(out[1]) and out[2] == "Pike"
+
+
+def test_scrub_without_real_identifiers_redacts():
+    df = pd.DataFrame({"pid": ["sf1"], "note": ["Ann O'Brien"]})
+    out = _plan().apply(df, build_lookup(FAKES))
+    assert out.loc[0, "note"] == "MASKED"
@@ -0,0 +1,126 @@
+import sys
+import os
+import json
+import threading
+import time
+import pandas as pd
+import pytest
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from utils.masking import build_lookup
+from utils.shards import ShardJob, shard_keys, shard_of
+
+
+def test_shard_of_is_stable_and_covers_every_key():
+    keys = [f"a0X{i:06d}" for i in range(2000)]
+    shards = shard_of(keys, 8)
+    assert shards.tolist() == shard_of(keys, 8).tolist()
+    assert set(shards) == set(range(8))
+    assert sorted(k for s in range(8) for k in shard_keys(keys, s, 8)) == sorted(keys)
+    # fixed values: the hash must not depend on the process or the Python version
+    assert shard_of(["a0X000001", "a0X000002"], 1000).tolist() == [379, 478]
+
+
+def test_run_resumes_after_a_failed_shard(tmp_path):
+    job = ShardJob(str(tmp_path), n_shards=4)
+    job.prepare(lambda: None, params={"format": "csv"})
+    calls = []
+
+    def failing(shard):
+        calls.append(shard)
+        if shard == 2:
+            raise RuntimeError("MySQL went away")
+        return {"outputs": [f"out/{shard}.csv"], "rows": {"assessments": 10}}
+
+    with pytest.raises(RuntimeError):
+        job.run(failing)
+    assert job.pending() == [2, 3]
+    assert not os.path.exists(tmp_path / "shards" / "0002.lock")
+
+    # a restart (new process, no n_shards needed) skips the finished shards
+    restarted = ShardJob(str(tmp_path))
+    assert restarted.run(lambda shard: calls.append(shard) or {"rows": {"assessments": 1}}) == [2, 3]
+    assert calls == [0, 1, 2, 2, 3]
+    manifest = json.loads((tmp_path / "manifest.json").read_text())
+    assert manifest["completed"] == 4 and manifest["pending"] == []
+    assert manifest["shards"][0]["outputs"] == ["out/0.csv"]
+    assert "4/4 shards done (22 rows)" in str(restarted)
+
+
+def test_claims_are_exclusive_until_the_lease_lapses(tmp_path):
+    a = ShardJob(str(tmp_path), n_shards=2, lease_s=60, owner="host-a")
+    b = ShardJob(str(tmp_path), n_shards=2, lease_s=60, owner="host-b")
+    assert a.claim(0)
+    assert not b.claim(0)
+    assert b.run(lambda shard: {}) == [1]
+
+    # host-a died: once its heartbeat is older than the lease, host-b takes over
+    old = time.time() - 120
+    os.utime(tmp_path / "shards" / "0000.lock", (old, old))
+    assert b.run(lambda shard: {}) == [0]
+    a.release(0)  # a late release from host-a must not remove anything it no longer owns
+    assert b.pending() == []
+
+
+def test_prepare_builds_once_and_checks_parameters(tmp_path):
+    built = []
+    job = ShardJob(str(tmp_path), n_shards=3)
+    job.prepare(lambda: built.append(1), params={"format": "parquet"})
+    ShardJob(str(tmp_path), n_shards=3).prepare(lambda: built.append(2), params={"format": "parquet"})
+    assert built == [1]
+    with pytest.raises(ValueError):
+        ShardJob(str(tmp_path)).prepare(lambda: None, params={"format": "csv"})
+    with pytest.raises(ValueError):
+        ShardJob(str(tmp_path), n_shards=5)
+
+
+def test_fake_map_round_trips_through_parquet(tmp_path):
+    lookup = build_lookup({"k1": {"first_name": "Ann", "status": "Completed"},
+                           "k2": {"first_name": "Bo", "status": "Completed"}})
+    path = tmp_path / "fake_map.parquet"
+    lookup.to_parquet(path)
+    loaded = build_lookup(pd.read_parquet(path))
+    assert loaded.index.tolist() == ["k1", "k2"]
+    assert loaded.loc["k2", "first_name"] == "Bo"
+
+
+def test_one_host_wins_a_stale_lock(tmp_path):
+    jobs = [ShardJob(str(tmp_path), n_shards=1, lease_s=60, owner=f"host-{i}") for i in range(8)]
+    lock = tmp_path / "shards" / "0000.lock"
+    for _ in range(20):
+        lock.write_text("dead-host")
+        old = time.time() - 120
+        os.utime(lock, (old, old))
+        start = threading.Barrier(len(jobs))
+        won = []
+
+        def compete(job):
+            start.wait()
+            if job.claim(0):
+                won.append(job.owner)
+
+        threads = [threading.Thread(target=compete, args=(job,)) for job in jobs]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        assert len(won) == 1 and lock.read_text() == won[0]
+        assert not [p for p in os.listdir(tmp_path / "shards") if p.endswith(".stale")]
+
+
+def test_prepare_keeps_its_lock_fresh_during_a_long_build(tmp_path):
+    built = []
+
+    def build(n):
+        built.append(n)
+        time.sleep(0.6)
+
+    a = ShardJob(str(tmp_path), n_shards=2, lease_s=0.2, owner="host-a")
+    b = ShardJob(str(tmp_path), n_shards=2, lease_s=0.2, owner="host-b")
+    first = threading.Thread(target=a.prepare, args=(lambda: build("a"),), kwargs={"poll_s": 0.05})
+    first.start()
+    time.sleep(0.1)
+    b.prepare(lambda: build("b"), poll_s=0.05)
+    first.join()
+    assert built == ["a"]
@@ -0,0 +1,78 @@
+import sys
+import os
+import pandas as pd
+import sqlalchemy
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from connectors.sql import fetch_by_ids, compare_id_strategies
+
+
+def _engine(tmp_path):
+    engine = sqlalchemy.create_engine(f"sqlite:///{tmp_path / 'masker.db'}")
+    pd.DataFrame({
+        "id": range(500),
+        "Patient__c": [f"a0P{i % 120:04d}" for i in range(500)],
+        "Facility__c": [f"f{i % 3}" for i in range(500)],
+    }).to_sql("assessments", engine, index=False)
+    return engine
+
+
+def _sorted(df):
+    return df.sort_values("id").reset_index(drop=True)
+
+
+def test_strategies_return_the_same_rows(tmp_path):
+    engine = _engine(tmp_path)
+    ids = [f"a0P{i:04d}" for i in range(0, 200, 2)] + ["a0P0000"]
+    expected = pd.read_sql("SELECT * FROM assessments", engine)
+    expected = _sorted(expected[expected["Patient__c"].isin(ids)])
+
+    batched = fetch_by_ids(engine, "assessments", "Patient__c", ids, batch_size=7, workers=3)
+    temp = fetch_by_ids(engine, "assessments", "Patient__c", ids, strategy="temp_table", batch_size=7)
+    # integers are downcast on read (per batch, so widths can differ from a single read)
+    assert batched["id"].dtype.itemsize < 8 and temp["id"].dtype.itemsize < 8
+    pd.testing.assert_frame_equal(_sorted(batched), expected, check_dtype=False)
+    pd.testing.assert_frame_equal(_sorted(temp), expected, check_dtype=False)
+
+
+def test_extra_expanding_filter_and_empty_ids(tmp_path):
+    engine = _engine(tmp_path)
+    kwargs = dict(select="id, Facility__c", where="Facility__c IN :facilities",
+                  params={"facilities": ["f1"]}, expanding=("facilities",))
+    for strategy in ("batched", "temp_table"):
+        df = fetch_by_ids(engine, "assessments", "Patient__c", ["a0P0001", "a0P0004"], strategy=strategy, **kwargs)
+        assert set(df["Facility__c"]) == {"f1"}
+        assert list(df.columns) == ["id", "Facility__c"]
+    empty = fetch_by_ids(engine, "assessments", "Patient__c", [], **kwargs)
+    assert empty.empty and list(empty.columns) == ["id", "Facility__c"]
+
+
+def test_compare_reports_fastest(tmp_path):
+    engine = _engine(tmp_path)
+    report = compare_id_strategies(engine, "assessments", "Patient__c", [f"a0P{i:04d}" for i in range(50)])
+    assert report["ids"] == 50
+    assert report["fastest"] in ("batched", "temp_table")
+
+
+def test_compare_strategy_fetches_with_the_fastest(tmp_path, capsys):
+    engine = _engine(tmp_path)
+    ids = [f"a0P{i:04d}" for i in range(50)]
+    df = fetch_by_ids(engine, "assessments", "Patient__c", ids, strategy="compare", workers=2)
+    expected = fetch_by_ids(engine, "assessments", "Patient__c", ids)
+    pd.testing.assert_frame_equal(df.sort_values("id").reset_index(drop=True),
+                                  expected.sort_values("id").reset_index(drop=True))
+    assert "ids: batched" in capsys.readouterr().out
+
+
+def test_limit_stops_sending_batches(tmp_path):
+    engine = _engine(tmp_path)
+    statements = []
+    sqlalchemy.event.listen(engine, "before_cursor_execute", lambda *a: statements.append(a[2]))
+    ids = [f"a0P{i:04d}" for i in range(120)]
+    df = fetch_by_ids(engine, "assessments", "Patient__c", ids, batch_size=10, workers=2, limit=25)
+    selects = [s for s in statements if s.startswith("SELECT")]
+    assert len(df) == 25 and set(df["Patient__c"]) <= set(ids)
+    # 10 ids hold ~42 rows, so the first wave of two batches is enough
+    assert len(selects) == 2 and all("LIMIT 25" in s for s in selects)
+    assert len(fetch_by_ids(engine, "assessments", "Patient__c", ids, strategy="temp_table", limit=25)) == 25
@@ -0,0 +1,43 @@
+import sys
+import os
+import sqlite3
+import pandas as pd
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from connectors.sql import iter_query_chunks
+from utils.masking import mask_table
+from utils.streaming import stream_table
+
+
+def test_stream_table_matches_in_memory_masking(tmp_path):
+    conn = sqlite3.connect(":memory:")
+    df = pd.DataFrame({
+        "id": [str(i) for i in range(25)],
+        "Patient__c": [f"p{i % 4}" for i in range(25)],
+        "patient_name": [f"Real {i}" for i in range(25)],
+        "notes": ["text"] * 25,
+    })
+    df.to_sql("assessments", conn, index=False)
+    fake_map = {f"p{i}": {"patient_name": f"Fake {i}"} for i in range(3)}
+
+    chunks = iter_query_chunks("SELECT * FROM assessments ORDER BY rowid", chunksize=10, conn=conn)
+    stats = stream_table(
+        "assessments",
+        chunks,
+        lambda chunk: mask_table(chunk, fake_map, {"id", "Patient__c"}),
+        tmp_path / "real.csv",
+        tmp_path / "mock.csv",
+    )
+
+    assert (stats.rows, stats.chunks) == (25, 3)
+    expected = mask_table(df.copy(), fake_map, {"id", "Patient__c"})
+    pd.testing.assert_frame_equal(pd.read_csv(tmp_path / "mock.csv", dtype=str), expected.astype(str))
+    pd.testing.assert_frame_equal(pd.read_csv(tmp_path / "real.csv", dtype=str), df)
+
+
+def test_streamed_chunks_keep_their_integer_type():
+    conn = sqlite3.connect(":memory:")
+    pd.DataFrame({"id": [1, 2, 300, 70_000]}).to_sql("notes", conn, index=False)
+    chunks = list(iter_query_chunks("SELECT id FROM notes ORDER BY id", chunksize=2, conn=conn))
+    assert [c["id"].dtype for c in chunks] == ["int64", "int64"]
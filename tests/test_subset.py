@@ -0,0 +1,58 @@
+import sys
+import os
+import pandas as pd
+import pytest
+import sqlalchemy
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from utils.subset import fetch_closure, parse_size, read_ids, sample_patients
+
+PATIENTS = pd.DataFrame({
+    "Id": [f"a0P{i:04d}" for i in range(400)],
+    "Facility__c": [f"f{i % 3}" if i < 360 else "f9" for i in range(400)],
+})
+
+
+def test_samples_are_seeded_nested_and_stratified():
+    small, large = sample_patients(PATIENTS, 20, seed=7), sample_patients(PATIENTS, "10%", seed=7)
+    assert len(small) == 20 and len(large) == 40
+    assert set(small["Id"]) <= set(large["Id"])
+    assert list(small["Id"]) == sorted(small["Id"])   # original order kept
+    assert set(sample_patients(PATIENTS, 20, seed=8)["Id"]) != set(small["Id"])
+
+    by_facility = sample_patients(PATIENTS, 40, by="Facility__c")["Facility__c"].value_counts()
+    assert by_facility.to_dict() == {"f0": 12, "f1": 12, "f2": 12, "f9": 4}
+
+    assert list(sample_patients(PATIENTS, ids=["a0P0003", "a0P0001", "zzz"])["Id"]) == ["a0P0001", "a0P0003"]
+    assert parse_size("1%") == 0.01 and parse_size("25") == 25
+    with pytest.raises(ValueError):
+        parse_size("150%")
+
+
+def test_closure_keeps_every_row_of_the_sampled_patients(tmp_path):
+    engine = sqlalchemy.create_engine(f"sqlite:///{tmp_path / 'masker.db'}")
+    assessments = pd.DataFrame({"id": range(2000), "Patient__c": [f"a0P{i % 400:04d}" for i in range(2000)]})
+    assessments.to_sql("assessments", engine, index=False)
+    pd.DataFrame({"noteId": range(300), "patientIdDisplay": [f"a0P{i:04d}" for i in range(300)]}).to_sql(
+        "superbill_report", engine, index=False)
+
+    sample = sample_patients(PATIENTS, 30, seed=1)
+    frames, report = fetch_closure(engine, {"assessments": "Patient__c", "superbill_report": "patientIdDisplay"},
+                                   sample["Id"], population=len(PATIENTS), batch_size=8, workers=2)
+    expected = assessments[assessments["Patient__c"].isin(sample["Id"])]
+    assert len(frames["assessments"]) == len(expected) == 150
+    assert set(frames["assessments"]["id"]) == set(expected["id"])
+    assert set(frames["superbill_report"]["patientIdDisplay"]) <= set(sample["Id"])
+
+    cost = report.tables["assessments"]
+    assert (cost.rows, cost.queries) == (150, 4)
+    table = report.to_dict()["tables"][0]
+    assert table["rows_per_patient"] == 5 and table["full_rows_est"] == 2000
+    assert "30 of 400 patients" in str(report)
+
+
+def test_read_ids_skips_header_comments_and_blanks(tmp_path):
+    path = tmp_path / "ids.txt"
+    path.write_text("Id\n# chosen for the demo\na0P0001\n\n\"a0P0002\"  # quoted\n")
+    assert read_ids(str(path)) == ["a0P0001", "a0P0002"]
@@ -0,0 +1,68 @@
+import sys
+import os
+import time
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from utils.faker_map import make_faker_map
+from utils.vault import PseudonymVault
+
+
+def test_vault_keeps_fakes_and_only_generates_new_keys(tmp_path):
+    path = str(tmp_path / "vault.sqlite")
+    with PseudonymVault(path) as vault:
+        first = make_faker_map(["m1", "m2"], vault=vault)
+
+    generated = []
+
+    def generate(keys, attempt):
+        generated.extend(keys)
+        return make_faker_map(keys, seed=99)
+
+    with PseudonymVault(path) as vault:
+        second = vault.get_or_create(["m2", "m1", "m3"], generate)
+        assert generated == ["m3"]
+        assert second["m1"] == first["m1"] and second["m2"] == first["m2"]
+        frame = vault.lookup_frame(["m1", "m3", "m1", "unknown"])
+        assert sorted(frame.index) == ["m1", "m3"]
+        assert frame.loc["m1", "first_name"] == first["m1"]["first_name"]
+
+
+def test_vault_regenerates_clashing_unique_fields(tmp_path):
+    with PseudonymVault(str(tmp_path / "vault.sqlite")) as vault:
+        vault.store_many({"old": {"patient_id": "ABC1", "patient_record_number": "1"}})
+
+        def generate(keys, attempt):
+            pid = "ABC1" if attempt == 0 else f"NEW{attempt}"
+            return {k: {"patient_id": pid, "patient_record_number": f"r{attempt}"} for k in keys}
+
+        mapping = vault.get_or_create(["new"], generate)
+        assert mapping["new"]["patient_id"] == "NEW1"
+        assert len(vault) == 2
+
+
+def test_compact_and_rotate_old_entries(tmp_path):
+    with PseudonymVault(str(tmp_path / "vault.sqlite")) as vault:
+        vault.store_many({k: {"patient_id": k} for k in ("a", "b", "c")})
+        stale = time.time() - 400 * 86400
+        vault.conn.execute("UPDATE pseudonyms SET last_seen = ? WHERE key IN ('a', 'b')", (stale,))
+        vault.conn.commit()
+
+        archive = str(tmp_path / "archive.sqlite")
+        assert vault.rotate(archive, older_than_days=365) == 2
+        assert len(vault) == 1
+        with PseudonymVault(archive) as old:
+            assert sorted(old.lookup_many(["a", "b"], touch=False)) == ["a", "b"]
+        assert vault.compact(older_than_days=0) == 1
+        assert len(vault) == 0
+
+
+def test_keyed_fakes_are_regenerated_after_a_clash(tmp_path):
+    keyed = make_faker_map(["m1"], secret="s3cret")["m1"]
+    with PseudonymVault(str(tmp_path / "vault.sqlite")) as vault:
+        # an older (e.g. Faker-made) entry already holds m1's keyed MRN
+        vault.store_many({"old": {"patient_id": keyed["patient_id"], "patient_record_number": "1"}})
+        mapping = make_faker_map(["m1"], secret="s3cret", vault=vault)
+        assert mapping["m1"]["patient_id"] != keyed["patient_id"]
+        assert len(mapping["m1"]["patient_id"]) == len(keyed["patient_id"])
+        assert len(vault) == 2
@@ -0,0 +1,77 @@
+import sys
+import os
+import pandas as pd
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from utils.compact import as_text
+from utils.masking import build_lookup
+from utils.pools import get_pools, pool_map
+from utils.rules import mask_with_rules
+from utils.verify import verify_outputs
+from utils.writers import output_path, write_frame
+
+
+def _outputs(tmp_path, fmt="csv", n=40):
+    ids = [f"a0X{i:05d}" for i in range(n)]
+    patients = pd.DataFrame({
+        "Id": ids,
+        "Practice_GUID__c": ["g1"] * n,
+        "Patient_ID__c": [f"P{i}" for i in range(n)],
+        "Patient_Record_Number__c": [f"{i:03d}-0000" for i in range(n)],
+        "First_Name__c": ["Ann"] * n,
+        "Last_Name__c": [f"Last{i}" for i in range(n)],
+        "DOB__c": ["1970-01-01"] * n,
+        "Facility__c": ["f"] * n,
+    })
+    assessments = pd.DataFrame({
+        "id": list(range(3 * n)),
+        "Patient__c": ids * 3,
+        "patient_name": ["Ann Real"] * (3 * n),
+        "patient_record_number": [f"{i % n:03d}-0000" for i in range(3 * n)],
+        "patient_date_of_birth_date_time": ["1970-01-01"] * (3 * n),
+        "Facility__c": ["f"] * (3 * n),
+    })
+    lookup = build_lookup(pool_map(ids, get_pools(size=512, pool_dir=str(tmp_path / "pools"))))
+    frames = {}
+    for table, df in (("salesforce_patients", patients), ("assessments", assessments)):
+        frames[table] = (df, mask_with_rules(df.copy(), lookup, table, secret="verify"))
+    return frames
+
+
+def _write(tmp_path, frames, fmt="csv"):
+    out = tmp_path / "out"
+    out.mkdir(exist_ok=True)
+    for table, (real, mock) in frames.items():
+        write_frame(real, output_path(str(out / f"{table}_real"), fmt), fmt)
+        write_frame(mock, output_path(str(out / f"{table}_mock"), fmt), fmt)
+    return str(out)
+
+
+def test_masked_outputs_verify_clean(tmp_path):
+    for fmt in ("csv", "parquet"):
+        report = verify_outputs(_write(tmp_path, _outputs(tmp_path), fmt), fmt, chunk_rows=7)
+        assert report.ok, str(report)
+        assert report.tables == {"salesforce_patients": 40, "assessments": 120}
+
+
+def test_violations_are_reported_by_check(tmp_path):
+    frames = _outputs(tmp_path)
+    real, mock = frames["assessments"]
+    mock = mock.apply(as_text)
+    mock.loc[5, "patient_name"] = "Someone Else"            # same patient, two fakes
+    mock.loc[6, "patient_record_number"] = "006-0000"        # the row's real MRN
+    mock.loc[7, "Patient__c"] = "a0X99999"                   # masked key no longer matches the patient
+    frames["assessments"] = (real, mock.iloc[:-1])           # and one masked row missing
+    report = verify_outputs(_write(tmp_path, frames), "csv", chunk_rows=16)
+
+    found = {(v.check, v.table, v.column): v for v in report.violations}
+    assert found[("one_to_one", "assessments", "patient_name")].count == 1
+    assert found[("leak", "assessments", "patient_record_number")].rows == [6]
+    # ... which is also a real value found among the masked ones
+    assert found[("leak", "*", "patient_record_number")].count == 1
+    assert found[("foreign_key", "assessments", "Patient__c")].count == 1
+    assert found[("aligned", "assessments", None)].count == 1
+    assert "violation" in str(report) and not report.ok
+    # real values never make it into the report
+    assert "006-0000" not in str(report.to_dict())
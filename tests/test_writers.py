@@ -0,0 +1,73 @@
+import sys
+import os
+import pandas as pd
+import pytest
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from utils.writers import FrameWriter, output_path, parse_format, read_frame
+
+DF = pd.DataFrame({
+    "id": range(12),
+    "Facility__c": ["a0F/1", "a0F2", None] * 4,
+    "notes": [None] * 6 + ["text"] * 6,
+})
+
+
+@pytest.mark.parametrize("fmt", ["csv", "csv.gz", "parquet", "parquet:zstd", "arrow", "arrow:zstd"])
+@pytest.mark.parametrize("partition_col", [None, "Facility__c"])
+def test_chunked_write_round_trips(tmp_path, fmt, partition_col):
+    path = output_path(str(tmp_path / "out"), fmt)
+    with FrameWriter(path, fmt, partition_col) as writer:
+        for i in range(0, len(DF), 5):
+            writer.write(DF.iloc[i:i + 5])
+    assert writer.rows == len(DF)
+
+    back = read_frame(path, fmt).sort_values("id").reset_index(drop=True)[list(DF.columns)]
+    assert back["id"].tolist() == DF["id"].tolist()
+    assert back["Facility__c"].fillna("").tolist() == DF["Facility__c"].fillna("").tolist()
+    assert back["notes"].isna().sum() == 6
+    if partition_col:
+        assert sorted(os.listdir(path)) == ["Facility__c=__HIVE_DEFAULT_PARTITION__", "Facility__c=a0F%2F1", "Facility__c=a0F2"]
+
+
+def test_parquet_chunks_become_row_groups(tmp_path):
+    import pyarrow.parquet as pq
+
+    path = str(tmp_path / "out.parquet")
+    with FrameWriter(path, "parquet") as writer:
+        for i in range(0, len(DF), 5):
+            writer.write(DF.iloc[i:i + 5])
+    assert pq.ParquetFile(path).metadata.num_row_groups == 3
+
+
+def test_parse_format():
+    assert str(parse_format("parquet")) == "parquet:snappy"
+    assert parse_format("csv.gz").suffix == ".csv.gz"
+    with pytest.raises(ValueError):
+        parse_format("xlsx")
+
+
+@pytest.mark.parametrize("fmt", ["parquet", "arrow"])
+def test_later_chunk_wider_than_the_first_chunks_ints(tmp_path, fmt):
+    path = output_path(str(tmp_path / "out"), fmt)
+    with FrameWriter(path, fmt) as writer:
+        writer.write(pd.DataFrame({"id": pd.Series([1, 2], dtype="uint8")}))
+        writer.write(pd.DataFrame({"id": pd.Series([300, 70_000], dtype="int64")}))
+    assert read_frame(path, fmt)["id"].tolist() == [1, 2, 300, 70_000]
+
+
+@pytest.mark.parametrize("fmt", ["csv", "parquet"])
+def test_open_partition_files_are_capped(tmp_path, fmt):
+    path = str(tmp_path / "out")
+    df = pd.DataFrame({"id": range(40), "Facility__c": [f"f{i % 8}" for i in range(40)]})
+    with FrameWriter(path, fmt, "Facility__c", max_open=3) as writer:
+        for i in range(0, len(df), 10):
+            writer.write(df.iloc[i:i + 10])
+            assert len(writer.sinks) <= 3
+    # every chunk holds all 8 values, so each value reopens in a new part per chunk
+    suffix = parse_format(fmt).suffix
+    assert sorted(os.listdir(os.path.join(path, "Facility__c=f0"))) == [f"part-{i}{suffix}" for i in range(4)]
+    back = read_frame(path, fmt)
+    assert sorted(back["id"]) == list(range(40))
+    assert (back["Facility__c"] == "f" + (back["id"] % 8).astype(str)).all()
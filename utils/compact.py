@@ -0,0 +1,107 @@
+"""
+Memory-compact frames.
+
+A masked table repeats a few thousand fake values (facility names,
+appointment types, provider names, "MASKED") across millions of rows. As
+text columns every row holds its own copy; as a categorical it holds a
+small integer code into the distinct values. compact_lookup turns the
+text columns of a fake-map lookup into categoricals once, so
+mask_rows (utils/masking.py) builds masked columns by taking codes.
+downcast_frame shrinks what pd.read_sql returns: integers to the smallest
+type that holds them and object text to Arrow-backed "str". Streamed
+chunks keep their integers as read: a later chunk may not fit the type
+the first one was downcast to.
+
+Categories differ between chunks, so concatenating masked chunks falls
+back to text; the writers (utils/writers.py) store categoricals as plain
+string columns.
+"""
+import numpy as np
+import pandas as pd
+
+def _is_text(values):
+    return isinstance(values.dtype, pd.StringDtype) or values.dtype == object
+
+
+def as_categorical(values, max_ratio=None):
+    """
+    Text `values` as a categorical; with `max_ratio`, only when there are at
+    most that many distinct values per row. Anything else is returned unchanged.
+    """
+    if isinstance(values.dtype, pd.CategoricalDtype) or not _is_text(values) or not len(values):
+        return values
+    codes, uniques = pd.factorize(values)
+    if max_ratio is not None and len(uniques) > max_ratio * len(values):
+        return values
+    return pd.Series(pd.Categorical.from_codes(codes, categories=uniques), index=values.index, name=values.name)
+
+
+def compact_lookup(lookup, max_ratio=None):
+    """
+    Lookup frame with its text columns as categoricals (codes into the
+    distinct fakes). Every key's fakes repeat on each of its rows, so even a
+    column with one value per key is smaller as codes once masked.
+    """
+    return pd.DataFrame({col: as_categorical(lookup[col], max_ratio) for col in lookup.columns},
+                        index=lookup.index, copy=False)
+
+
+def constant_column(value, index):
+    """A column repeating `value`: one category and a code per row (text), else a plain Series."""
+    if not isinstance(value, str):
+        return pd.Series(value, index=index)
+    codes = np.zeros(len(index), dtype=np.int8)
+    return pd.Series(pd.Categorical.from_codes(codes, categories=[value]), index=index)
+
+
+def as_text(values):
+    """Categorical text as plain "str" (for string arithmetic and fallbacks); anything else unchanged."""
+    if isinstance(values.dtype, pd.CategoricalDtype):
+        return values.astype("str")
+    return values
+
+
+def merge_where(old, new, hit):
+    """
+    `new` where `hit`, else `old`, keeping a categorical `new` categorical:
+    the result's categories are the union of both sides'. Returns None when
+    `old` is not text (the caller falls back to Series.where).
+    """
+    if not isinstance(new.dtype, pd.CategoricalDtype):
+        return None
+    if not isinstance(old.dtype, pd.CategoricalDtype):
+        if not _is_text(old):
+            return None
+        old_codes, old_uniques = pd.factorize(old)
+    else:
+        old_codes, old_uniques = old.cat.codes.to_numpy(), old.cat.categories
+    categories = new.cat.categories.append(pd.Index(old_uniques, dtype=object)).unique()
+    codes = np.where(hit, _recode(new.cat.codes.to_numpy(), new.cat.categories, categories),
+                     _recode(old_codes, old_uniques, categories))
+    return pd.Series(pd.Categorical.from_codes(codes, categories=categories), index=old.index, name=old.name)
+
+
+def _recode(codes, uniques, categories):
+    """Codes into `uniques` as codes into `categories` (-1, missing, stays -1)."""
+    mapping = np.append(categories.get_indexer(uniques), -1)
+    return mapping[codes]
+
+
+def downcast_frame(df, integers=True):
+    """
+    Integers downcast to the smallest type that fits (unless `integers` is
+    False), object text to "str". Returns `df`.
+    """
+    for col in df.columns:
+        values = df[col]
+        if integers and pd.api.types.is_integer_dtype(values.dtype) and not isinstance(values.dtype, pd.api.extensions.ExtensionDtype):
+            kind = "unsigned" if len(values) and values.min() >= 0 else "integer"
+            df[col] = pd.to_numeric(values, downcast=kind)
+        elif values.dtype == object and pd.api.types.infer_dtype(values, skipna=True) == "string":
+            df[col] = values.astype("str")
+    return df
+
+
+def frame_mb(df):
+    """In-memory size of `df` in MB, strings included."""
+    return df.memory_usage(deep=True).sum() / 1e6
@@ -0,0 +1,160 @@
+"""
+Cached secrets and OAuth tokens.
+
+Every entry point used to call retrieve_project_secrets and request a new
+Salesforce client-credentials token, which adds seconds per job and gets
+throttled when many sharded jobs start together. CredentialCache keeps
+values with a TTL in this process's memory first and then in a small JSON
+file shared by every process on the machine. Misses are filled under an
+exclusive file lock, re-checking the file after the lock is taken, so N
+jobs starting at once make one request between them.
+
+The file holds secrets: it is created 0600, lives at $CREDENTIAL_CACHE
+(default ~/.cache/patient-mocker/credentials.json) and CREDENTIAL_CACHE=off
+keeps the cache in memory only.
+"""
+import hashlib
+import json
+import os
+import time
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:  # Windows: no cross-process lock, last writer wins
+    fcntl = None
+
+DEFAULT_CACHE_PATH = os.path.join("~", ".cache", "patient-mocker", "credentials.json")
+SECRETS_TTL = int(os.getenv("SECRETS_TTL", 15 * 60))
+# Salesforce client-credentials tokens carry no expiry; sessions default to 2h
+TOKEN_TTL = int(os.getenv("SF_TOKEN_TTL", 30 * 60))
+
+_memory = {}
+
+
+def cache_path():
+    """File layer path from $CREDENTIAL_CACHE, or None when set to "off"."""
+    path = os.getenv("CREDENTIAL_CACHE", DEFAULT_CACHE_PATH)
+    return None if path.lower() in ("off", "0", "") else os.path.expanduser(path)
+
+
+class CredentialCache:
+    """TTL cache of JSON values: process memory, then a locked file shared between processes."""
+
+    def __init__(self, path=None, clock=time.time):
+        self.path = path
+        self.clock = clock
+
+    @contextmanager
+    def _locked(self):
+        if self.path is None:
+            yield
+            return
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        fd = os.open(f"{self.path}.lock", os.O_CREAT | os.O_RDWR, 0o600)
+        try:
+            if fcntl is not None:
+                fcntl.flock(fd, fcntl.LOCK_EX)
+            yield
+        finally:
+            os.close(fd)  # releases the lock
+
+    def _read(self):
+        if self.path is None or not os.path.exists(self.path):
+            return {}
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def _write(self, entries):
+        now = self.clock()
+        entries = {k: e for k, e in entries.items() if e["expires"] > now}
+        tmp = f"{self.path}.tmp"
+        fd = os.open(tmp, os.O_CREAT | os.O_WRONLY | os.O_TRUNC, 0o600)
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            json.dump(entries, f)
+        os.replace(tmp, self.path)
+
+    def _fresh(self, entry):
+        return entry is not None and entry["expires"] > self.clock()
+
+    def get(self, key):
+        """Cached value for `key`, or None when missing or expired."""
+        entry = _memory.get((self.path, key))
+        if not self._fresh(entry):
+            entry = self._read().get(key)
+            if not self._fresh(entry):
+                return None
+            _memory[(self.path, key)] = entry
+        return entry["value"]
+
+    def put(self, key, value, ttl):
+        entry = {"value": value, "expires": self.clock() + ttl}
+        _memory[(self.path, key)] = entry
+        if self.path is not None:
+            with self._locked():
+                entries = self._read()
+                entries[key] = entry
+                self._write(entries)
+
+    def invalidate(self, key, value=None):
+        """Drop `key` (only if it still holds `value`, when given: another process may have refreshed it)."""
+        _memory.pop((self.path, key), None)
+        if self.path is None:
+            return
+        with self._locked():
+            entries = self._read()
+            entry = entries.get(key)
+            if entry is not None and (value is None or entry["value"] == value):
+                del entries[key]
+                self._write(entries)
+
+    def get_or_fetch(self, key, fetch, ttl, refresh=False):
+        """
+        Cached value for `key`, else fetch() stored for `ttl` seconds. The
+        fetch runs under the file lock after re-reading the file, so
+        concurrent processes share one fetch. `refresh` skips the cache.
+        """
+        value = None if refresh else self.get(key)
+        if value is not None:
+            return value
+        with self._locked():
+            entry = None if refresh else self._read().get(key)
+            if self._fresh(entry):
+                _memory[(self.path, key)] = entry
+                return entry["value"]
+            value = fetch()
+            entry = {"value": value, "expires": self.clock() + ttl}
+            _memory[(self.path, key)] = entry
+            if self.path is not None:
+                entries = self._read()
+                entries[key] = entry
+                self._write(entries)
+        return value
+
+
+def default_cache():
+    return CredentialCache(cache_path())
+
+
+def cache_key(kind, *parts):
+    """Cache key that names its kind but not the credentials it was derived from."""
+    digest = hashlib.sha256("\x00".join(str(p) for p in parts).encode("utf-8")).hexdigest()[:16]
+    return f"{kind}:{digest}"
+
+
+def cached_project_secrets(config=None, fetch=None, ttl=SECRETS_TTL, cache=None):
+    """
+    retrieve_project_secrets(config) through the credential cache.
+    `fetch(config)` replaces the Clark secrets call (tests use a stub).
+    """
+    if fetch is None:
+        from clark_secrets import retrieve_project_secrets as fetch
+    if config is None:
+        from clark_secrets import ClarkSecretsConfig
+        config = ClarkSecretsConfig()
+    identity = [getattr(config, name, None) for name in ("project_id", "client_id", "user_name", "email")]
+    key = cache_key("secrets", *identity)
+    return (cache or default_cache()).get_or_fetch(key, lambda: dict(fetch(config)), ttl)
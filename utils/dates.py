@@ -0,0 +1,109 @@
+"""
+Vectorized date shifting.
+
+Every date of a patient moves by the same keyed day offset, so intervals
+between that patient's events (visit spacing, age at visit) are kept while
+the real dates are hidden. Offsets come from a keyed hash of the patient
+key: the same patient gets the same offset on every run and in every table
+keyed by the same id, and nobody without MASKING_SECRET can undo it.
+
+The shift itself is one datetime64 + timedelta64 add over the whole array
+(tens of millions of values per second); keys are hashed once per distinct
+patient. String columns are parsed once with pandas and written back as
+ISO strings with np.datetime_as_string.
+"""
+import numpy as np
+import pandas as pd
+
+from utils.masking import keyed_hash
+
+DEFAULT_SHIFT_DAYS = 365
+# HIPAA Safe Harbor: ages over 89 are reported as 90+
+DEFAULT_MAX_AGE = 89
+
+
+def day_offsets(keys, hash_key, max_days=DEFAULT_SHIFT_DAYS):
+    """
+    int64 day offset per key, in [-max_days, max_days] and never 0.
+    Each distinct key is hashed once.
+    """
+    codes, uniques = pd.factorize(pd.Series(keys), use_na_sentinel=False)
+    h = keyed_hash(uniques, hash_key)
+    offsets = (h % np.uint64(2 * max_days)).astype(np.int64) - max_days
+    offsets = np.where(offsets >= 0, offsets + 1, offsets)
+    return offsets[codes]
+
+
+def shift_datetime64(values, offsets):
+    """datetime64 array shifted by `offsets` days; NaT stays NaT."""
+    return values + np.asarray(offsets, dtype="int64").astype("timedelta64[D]")
+
+
+def max_age_cutoff(reference=None, max_age=DEFAULT_MAX_AGE):
+    """Earliest birth date that is still at most `max_age` years old at `reference` (default today)."""
+    reference = pd.Timestamp(reference) if reference is not None else pd.Timestamp.today().normalize()
+    return (reference - pd.DateOffset(years=max_age + 1) + pd.Timedelta(days=1)).to_datetime64()
+
+
+def clamp_ages(dobs, reference=None, max_age=DEFAULT_MAX_AGE):
+    """
+    Birth dates older than `max_age` moved up to the cutoff, so everyone over
+    `max_age` looks exactly `max_age` (reported as max_age+ by age bands).
+    """
+    cutoff = max_age_cutoff(reference, max_age).astype(dobs.dtype)
+    return np.where(np.isnat(dobs) | (dobs >= cutoff), dobs, cutoff)
+
+
+def _as_datetime64(values):
+    if pd.api.types.is_datetime64_any_dtype(values):
+        return values, True
+    return pd.to_datetime(values, errors="coerce", format="mixed"), False
+
+
+def _to_strings(arr, fmt=None):
+    """ISO strings (date only when every value is midnight); NaT -> NaN."""
+    naive = arr.astype("datetime64[s]")
+    if fmt:
+        out = pd.Series(pd.DatetimeIndex(naive).strftime(fmt), dtype=object)
+    else:
+        valid = naive[~np.isnat(naive)]
+        unit = "D" if (valid == valid.astype("datetime64[D]")).all() else "s"
+        out = pd.Series(np.datetime_as_string(naive, unit=unit), dtype=object)
+        if unit == "s":
+            out = out.str.replace("T", " ", regex=False)
+    return out.where(~np.isnat(naive))
+
+
+def shift_column(values, keys, hash_key, max_days=DEFAULT_SHIFT_DAYS, max_age=None, reference=None, fmt=None):
+    """
+    Shift one date column by each row's patient offset (`keys` gives the
+    patient per row). datetime64 columns stay datetime64; anything else is
+    parsed and returned as strings (`fmt` for strftime, else ISO).
+    `max_age` clamps the shifted values as birth dates.
+    """
+    parsed, was_datetime = _as_datetime64(values)
+    index = values.index if isinstance(values, pd.Series) else None
+    tz = getattr(parsed.dtype, "tz", None)
+    arr = (parsed.dt.tz_localize(None) if tz is not None else pd.Series(parsed)).to_numpy()
+    shifted = shift_datetime64(arr, day_offsets(keys, hash_key, max_days))
+    if max_age is not None:
+        shifted = clamp_ages(shifted, reference, max_age)
+    if was_datetime:
+        out = pd.Series(shifted, index=index)
+        return out.dt.tz_localize(tz) if tz is not None else out
+    out = _to_strings(shifted, fmt)
+    return out.set_axis(index) if index is not None else out
+
+
+def shift_dates(df, key_col, columns, hash_key, max_days=DEFAULT_SHIFT_DAYS, dob_cols=(), max_age=None,
+                reference=None):
+    """
+    Shift every column in `columns` (and `dob_cols`, which are also age
+    clamped when `max_age` is given) by the patient offset of `key_col`.
+    """
+    keys = df[key_col]
+    for col in [*columns, *dob_cols]:
+        if col in df.columns:
+            df[col] = shift_column(df[col], keys, hash_key, max_days,
+                                   max_age=max_age if col in dob_cols else None, reference=reference)
+    return df
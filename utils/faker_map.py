@@ -1,6 +1,50 @@
 from faker import Faker
+from utils.pools import POOL_MIN_KEYS, as_fake_map, get_pools, pool_map
+from utils.pseudonym import KeyedPseudonymizer
+from utils.rules import mask_with_rules
 
-def make_faker_map(keys, seed=42):
+def real_patient_values(patients, key="Id", patient_id_col="Patient_ID__c",
+                        record_number_col="Patient_Record_Number__c"):
+    """
+    {"patient_ids": {key: real MRN}, "record_numbers": {key: real record
+    number}} from a patients frame, for the keyed pseudonyms to permute.
+    Missing columns and values are left out (those keys permute the key).
+    """
+    values = {}
+    for name, col in (("patient_ids", patient_id_col), ("record_numbers", record_number_col)):
+        if key in patients.columns and col in patients.columns:
+            known = patients[[key, col]].dropna()
+            values[name] = dict(zip(known[key], known[col].astype(str)))
+    return values
+
+
+def make_faker_map(keys, seed=42, secret=None, vault=None, pools=None, patient_ids=None, record_numbers=None,
+                   attempt=0):
+    """
+    {real key: fake fields}. Large key sets (POOL_MIN_KEYS and up) or an
+    explicit `pools` get a lookup frame picked from pre-generated Faker
+    pools (utils/pools.py) instead of per-key Faker calls. With `secret`,
+    `patient_ids` / `record_numbers` ({key: real value}) are the real MRNs
+    and record numbers the keyed fakes keep the format of, and `attempt`
+    (a vault retry) tweaks them: the keyed path ignores `seed`.
+    """
+    if vault is not None:
+        # only keys the vault has never seen get new fakes; offsetting the seed
+        # by the vault size keeps a new Faker run from replaying old values
+        return vault.get_or_create(
+            keys,
+            lambda new_keys, attempt: as_fake_map(
+                make_faker_map(new_keys, seed=seed + len(vault) + attempt, secret=secret, pools=pools,
+                               patient_ids=patient_ids, record_numbers=record_numbers, attempt=attempt)),
+        )
+    if secret is not None:
+        # stateless keyed pseudonyms: same fakes on every run, no unique-set
+        return KeyedPseudonymizer(secret).make_faker_map(keys, patient_ids, record_numbers, attempt)
+    keys = list(keys)
+    if pools is None and len(keys) >= POOL_MIN_KEYS:
+        pools = get_pools()
+    if pools is not None:
+        return pool_map(keys, pools, seed=seed)
     from faker import Faker
     fake = Faker()
     Faker.seed(seed)
@@ -29,34 +73,5 @@ def make_faker_map(keys, seed=42):
 
 
 def apply_faker_masking(df, fake_map):
-    for idx, row in df.iterrows():
-        mrn = row["Patient_ID__c"]
-        if mrn in fake_map:
-            fake_info = fake_map[mrn]
-            # Fake IDs - unique but consistent
-            fake_id = fake_info.get("fake_id", None)
-            if not fake_id:
-                # fallback if not in faker map (optional)
-                fake_id = fake_info["patient_id"].replace("-", "")[:15]  # or generate new
-
-            # Assign same fake_id to Id and Patient__c
-            df.at[idx, "Id"] = fake_id
-            df.at[idx, "Patient__c"] = fake_id
-
-            # Fake Practice_GUID (can be UUID-like string)
-            df.at[idx, "Practice_GUID__c"] = fake_info.get("practice_guid", fake_info["patient_id"])
-
-            # Fake other linked fields
-            df.at[idx, "Patient_ID__c"] = fake_info["patient_id"]
-            df.at[idx, "Patient_Record_Number__c"] = fake_info["patient_record_number"]
-            df.at[idx, "First_Name__c"] = fake_info["first_name"]
-            df.at[idx, "Last_Name__c"] = fake_info["last_name"]
-            df.at[idx, "DOB__c"] = fake_info["dob"]
-            df.at[idx, "patient_name"] = f"{fake_info['first_name']} {fake_info['last_name']}"
-
-            df.at[idx, "provider_name"] = fake_info["provider_name"]
-            df.at[idx, "facility_guid"] = fake_info["facility_guid"]
-            df.at[idx, "facility_name"] = fake_info["facility_name"]
-            df.at[idx, "practitioner__c"] = fake_info["practitioner"]
-            df.at[idx, "appointment_type_name"] = fake_info["appointment_type"]
-    return df
\ No newline at end of file
+    # every linked id is replaced too; see faker_patients in config/masking_rules.yaml
+    return mask_with_rules(df, fake_map, "faker_patients")
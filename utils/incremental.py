@@ -0,0 +1,136 @@
+"""
+Incremental (delta) runs: a high-water mark per source says where the last
+run stopped, only rows changed since then are pulled and masked, and they
+are merged into the previously written outputs by primary key.
+"""
+import json
+import os
+from dataclasses import dataclass
+
+import pandas as pd
+
+from connectors.sql import fetch_by_ids
+
+
+class WatermarkStore:
+    """High-water marks per source, kept in a small JSON file."""
+
+    def __init__(self, path):
+        self.path = path
+        self.marks = {}
+        if os.path.exists(path):
+            with open(path, "r", encoding="utf-8") as f:
+                self.marks = json.load(f)
+
+    def get(self, source):
+        return self.marks.get(source)
+
+    def advance(self, source, values):
+        """Move the mark for `source` to the max of `values` (ISO timestamps) if it is later."""
+        values = pd.to_datetime(pd.Series(values), utc=True, errors="coerce").dropna()
+        if values.empty:
+            return
+        new = values.max()
+        old = self.get(source)
+        if old is None or new > pd.Timestamp(old):
+            self.marks[source] = new.isoformat()
+
+    def save(self):
+        tmp = f"{self.path}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(self.marks, f, indent=2, sort_keys=True)
+        os.replace(tmp, self.path)
+
+
+def soql_datetime(mark):
+    """A stored mark as a SOQL datetime literal (e.g. SystemModstamp >= 2024-05-01T00:00:00Z)."""
+    return pd.Timestamp(mark).tz_convert("UTC").strftime("%Y-%m-%dT%H:%M:%SZ")
+
+
+def sql_datetime(mark):
+    """A stored mark as a naive UTC 'YYYY-MM-DD HH:MM:SS' string for MySQL DATETIME columns."""
+    return pd.Timestamp(mark).tz_convert("UTC").strftime("%Y-%m-%d %H:%M:%S")
+
+
+def fetch_delta(engine, table, column, ids, known_ids, updated_at=None, mark=None, **kwargs):
+    """
+    Rows of `table` for `ids` changed since `mark` (by the `updated_at`
+    column), via connectors.sql.fetch_by_ids. Ids not in `known_ids` (the
+    patients of the previous output) are fetched whole: their rows older
+    than the mark were never pulled.
+    """
+    if not mark or not updated_at:
+        return fetch_by_ids(engine, table, column, ids, **kwargs)
+    known_ids = set(known_ids)
+    known = [i for i in ids if i in known_ids]
+    new = [i for i in ids if i not in known_ids]
+    frames = []
+    if known or not new:
+        frames.append(fetch_by_ids(engine, table, column, known, where=f"`{updated_at}` >= :hwm",
+                                   params={"hwm": sql_datetime(mark)}, **kwargs))
+    if new:
+        frames.append(fetch_by_ids(engine, table, column, new, **kwargs))
+    non_empty = [f for f in frames if not f.empty]
+    return pd.concat(non_empty or frames[:1], ignore_index=True)
+
+
+@dataclass
+class MergeCounts:
+    source: str
+    inserted: int = 0
+    updated: int = 0
+    unchanged: int = 0
+
+    def __str__(self):
+        return f"{self.source}: {self.inserted:,} inserted, {self.updated:,} updated, {self.unchanged:,} unchanged"
+
+
+def _as_text(df):
+    """Values as CSV-comparable strings, missing values as ''."""
+    return df.astype(object).where(df.notna(), "").astype(str)
+
+
+def merge_delta(existing, delta, key_cols, source=""):
+    """
+    Upsert `delta` into `existing` by `key_cols`.
+    Returns (merged frame, MergeCounts). A delta row identical to the stored
+    one counts as unchanged; `>=` watermarks re-fetch boundary rows, which
+    makes re-runs idempotent.
+    """
+    key_cols = list(key_cols)
+    counts = MergeCounts(source)
+    delta = delta.drop_duplicates(key_cols, keep="last")
+    if existing is None or existing.empty:
+        counts.inserted = len(delta)
+        return delta.reset_index(drop=True), counts
+
+    existing_keys = pd.MultiIndex.from_frame(_as_text(existing[key_cols]))
+    delta_keys = pd.MultiIndex.from_frame(_as_text(delta[key_cols]))
+    in_existing = delta_keys.isin(existing_keys)
+    counts.inserted = int((~in_existing).sum())
+
+    matched = delta[in_existing]
+    if not matched.empty:
+        cols = [c for c in matched.columns if c in existing.columns]
+        old = _as_text(existing[cols]).set_axis(existing_keys)
+        old = old[~old.index.duplicated(keep="last")]
+        new = _as_text(matched[cols]).set_axis(delta_keys[in_existing])
+        same = (old.loc[new.index].to_numpy() == new.to_numpy()).all(axis=1)
+        counts.updated = int((~same).sum())
+
+    kept = existing[~existing_keys.isin(delta_keys)]
+    counts.unchanged = len(kept) + (len(matched) - counts.updated)
+    merged = pd.concat([kept, delta], ignore_index=True)
+    return merged, counts
+
+
+def upsert_csv(path, delta, key_cols, source=""):
+    """Merge `delta` into the CSV at `path` (created if missing) and rewrite it atomically."""
+    existing = None
+    if os.path.exists(path):
+        existing = pd.read_csv(path, dtype=str, keep_default_na=False)
+    merged, counts = merge_delta(existing, delta, key_cols, source or os.path.basename(path))
+    tmp = f"{path}.tmp"
+    merged.to_csv(tmp, index=False)
+    os.replace(tmp, path)
+    return counts
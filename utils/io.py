@@ -1,5 +1,11 @@
 import pandas as pd
+from utils.writers import write_frame
 
 def export_csv(df, path):
     df.to_csv(path, index=False)
     print(f"[INFO] Exported to {path}")
+
+def export_frame(df, path, fmt="csv", partition_col=None):
+    """Export in any utils.writers format, e.g. "parquet:zstd", optionally partitioned."""
+    write_frame(df, path, fmt, partition_col)
+    print(f"[INFO] Exported {len(df)} rows to {path}")
@@ -0,0 +1,403 @@
+"""
+Job configs for the patient-mocker CLI (cli.py).
+
+A job is a YAML file naming the Salesforce extract, the MySQL tables
+pulled for those patients (with their patient id columns), the output
+and the batch sizes and concurrency (see config/job.yaml). load_job
+validates it against config/masking_rules.yaml, which every table needs
+a plan in, and returns a Job:
+
+    job = load_job("config/job.yaml")
+    counts = count_sources(job, engine, salesforce_count)   # COUNT(*) / SOQL COUNT()
+    print(format_plan(job, counts))
+    print(format_estimate(estimate_run(job, counts, load_history(["bench_history.json"]))))
+
+Only the standard library and PyYAML are imported here, so validating a
+job or printing --help doesn't wait for pandas. The estimate scales the
+rows/sec and peak RSS of benchmarks/bench_pipeline.py runs (and the fetch
+rate of earlier --metrics JSON reports) to the job's planned rows.
+"""
+import json
+import math
+import os
+from dataclasses import dataclass, field
+
+import yaml
+
+DEFAULT_JOB_PATH = os.path.normpath(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "config",
+                                                 "job.yaml"))
+PATIENT_OBJECT = "Patient__c"
+PATIENT_FIELDS = [
+    "Id",
+    "Practice_GUID__c",
+    "Patient_ID__c",
+    "Patient_Record_Number__c",
+    "First_Name__c",
+    "Last_Name__c",
+    "DOB__c",
+    "Facility__c",
+]
+EXTRACT_MODES = ("query", "bulk", "query_all")
+ID_STRATEGIES = ("batched", "temp_table", "compare")
+# the kinds utils.writers.parse_format accepts ("<kind>[:<compression>]", plus csv.gz / csv.bz2)
+OUTPUT_KINDS = ("csv", "csv.gz", "csv.bz2", "parquet", "arrow", "feather", "ipc")
+
+
+class JobError(ValueError):
+    """A job config that can't run; the message names the offending key."""
+
+
+@dataclass
+class TableJob:
+    name: str
+    id_column: str
+    stream: bool = False
+
+
+@dataclass
+class Job:
+    name: str = "salesforcesql"
+    object: str = PATIENT_OBJECT
+    fields: list = field(default_factory=lambda: list(PATIENT_FIELDS))
+    where: str = None
+    extract_mode: str = "query"
+    limit: int = 10
+    tables: dict = field(default_factory=dict)  # name -> TableJob
+    output_dir: str = "mocked_output"
+    format: str = "csv"
+    partition: bool = False
+    chunk_size: int = 50_000
+    row_limit: int = 100
+    workers: int = 1
+    fetch_workers: int = 4
+    id_strategy: str = "batched"
+    subset: dict = None
+    metrics: str = None
+    path: str = None
+
+    @property
+    def stream_tables(self):
+        return [t.name for t in self.tables.values() if t.stream]
+
+    def id_column(self, table):
+        return self.tables[table].id_column
+
+    def soql(self, incremental=False, since=None, full=False):
+        """
+        The Salesforce query. `incremental` adds SystemModstamp and `since`
+        (a SOQL datetime) keeps records modified at or after it; `full`
+        drops the query-mode `limit`, e.g. for a subset's population.
+        """
+        fields = self.fields + (["SystemModstamp"] if incremental and "SystemModstamp" not in self.fields else [])
+        conditions = [f"({self.where})"] if self.where else []
+        if since:
+            # >= re-reads boundary records, so a re-run is harmless
+            conditions.append(f"SystemModstamp >= {since}")
+        soql = f"SELECT {', '.join(fields)} FROM {self.object}"
+        if conditions:
+            soql += " WHERE " + " AND ".join(conditions)
+        if self.extract_mode == "query" and self.limit and not (incremental or full):
+            soql += f" ORDER BY Id LIMIT {self.limit}"
+        return soql
+
+
+# --- loading and validation ------------------------------------------------
+
+def _rules_tables(rules_path=None):
+    if rules_path is None:
+        rules_path = os.path.join(os.path.dirname(DEFAULT_JOB_PATH), "masking_rules.yaml")
+    with open(rules_path, "r", encoding="utf-8") as f:
+        return yaml.safe_load(f)["tables"]
+
+
+def _check(condition, message):
+    if not condition:
+        raise JobError(message)
+
+
+def _positive_int(spec, key, default, allow_none=False):
+    value = spec.get(key, default)
+    if value is None and allow_none:
+        return None
+    _check(isinstance(value, int) and not isinstance(value, bool) and value > 0,
+           f"{key} must be a positive integer{' or null' if allow_none else ''}, got {value!r}")
+    return value
+
+
+def _known_keys(spec, allowed, where):
+    unknown = sorted(set(spec) - set(allowed))
+    _check(not unknown, f"unknown key(s) in {where}: {', '.join(unknown)} (expected {', '.join(allowed)})")
+
+
+def check_format(fmt):
+    """`fmt` if it names an output format utils.writers knows, else JobError."""
+    fmt = str(fmt)
+    _check(fmt.lower().partition(":")[0] in OUTPUT_KINDS,
+           f"output format must be one of {', '.join(OUTPUT_KINDS)} (optionally :<compression>), got {fmt!r}")
+    return fmt
+
+
+def parse_job(spec, rules_tables=None, path=None):
+    """A validated Job from a parsed job config; raises JobError."""
+    _check(isinstance(spec, dict), "a job config is a mapping")
+    _known_keys(spec, ("name", "salesforce", "tables", "output", "chunk_size", "row_limit", "workers",
+                       "fetch_workers", "id_strategy", "subset", "metrics"), "the job")
+    rules_tables = rules_tables if rules_tables is not None else _rules_tables()
+    job = Job(name=str(spec.get("name", Job.name)), path=path)
+
+    sf = spec.get("salesforce") or {}
+    _known_keys(sf, ("object", "fields", "where", "extract_mode", "limit"), "salesforce")
+    job.object = sf.get("object", job.object)
+    job.fields = list(sf.get("fields", job.fields))
+    _check(job.fields and all(isinstance(f, str) for f in job.fields), "salesforce.fields must list field names")
+    _check("Id" in job.fields, "salesforce.fields must include Id (the key every table is pulled by)")
+    job.where = sf.get("where")
+    job.extract_mode = sf.get("extract_mode", job.extract_mode)
+    _check(job.extract_mode in EXTRACT_MODES,
+           f"salesforce.extract_mode must be one of {', '.join(EXTRACT_MODES)}, got {job.extract_mode!r}")
+    job.limit = _positive_int(sf, "limit", job.limit, allow_none=True)
+
+    tables = spec.get("tables")
+    if tables is None:
+        tables = {name: {} for name, t in rules_tables.items() if t.get("source") == "mysql"}
+    if isinstance(tables, list):
+        tables = {name: {} for name in tables}
+    _check(isinstance(tables, dict), "tables must be a list of table names or a mapping")
+    for name, table in tables.items():
+        table = table or {}
+        _known_keys(table, ("id_column", "stream"), f"tables.{name}")
+        _check(name in rules_tables, f"table {name!r} has no masking rules (add it to masking_rules.yaml)")
+        key = rules_tables[name]["key"]
+        id_column = table.get("id_column", key)
+        # rows are masked by the rules' key, so pulling them by another column would leave them unmasked
+        _check(id_column == key, f"tables.{name}.id_column is {id_column!r} but its masking rules are keyed by "
+                                 f"{key!r}; change `key` in masking_rules.yaml to pull by another column")
+        job.tables[name] = TableJob(name, id_column, bool(table.get("stream", False)))
+
+    output = spec.get("output") or {}
+    _known_keys(output, ("dir", "format", "partition"), "output")
+    job.output_dir = output.get("dir", job.output_dir)
+    job.format = check_format(output.get("format", job.format))
+    job.partition = bool(output.get("partition", job.partition))
+
+    job.chunk_size = _positive_int(spec, "chunk_size", job.chunk_size)
+    job.row_limit = _positive_int(spec, "row_limit", job.row_limit, allow_none=True)
+    job.workers = _positive_int(spec, "workers", job.workers)
+    job.fetch_workers = _positive_int(spec, "fetch_workers", job.fetch_workers)
+    job.id_strategy = spec.get("id_strategy", job.id_strategy)
+    _check(job.id_strategy in ID_STRATEGIES,
+           f"id_strategy must be one of {', '.join(ID_STRATEGIES)}, got {job.id_strategy!r}")
+    job.metrics = spec.get("metrics")
+
+    subset = spec.get("subset")
+    if subset is not None:
+        _check(isinstance(subset, dict), "subset must be a mapping with size or ids")
+        _known_keys(subset, ("size", "by", "ids", "seed"), "subset")
+        _check(("size" in subset) != ("ids" in subset), "subset needs exactly one of size or ids")
+        _check(subset.get("by") in (None, *job.fields), "subset.by must be one of salesforce.fields")
+        # only jobs with a subset pay for utils.subset's pandas import
+        from utils.subset import parse_size, read_ids
+
+        ids = subset.get("ids")
+        try:
+            size = parse_size(subset["size"]) if "size" in subset else None
+            ids = read_ids(ids) if isinstance(ids, str) else ids
+        except (OSError, ValueError) as e:
+            raise JobError(f"subset: {e}") from e
+        _check(ids is None or isinstance(ids, list), "subset.ids must be a list of Ids or a file of them")
+        job.subset = {"size": size, "by": subset.get("by"), "ids": ids, "seed": int(subset.get("seed", 0))}
+    return job
+
+
+def load_job(path=None, rules_path=None):
+    """The validated Job in a YAML file (config/job.yaml by default); raises JobError."""
+    path = path or DEFAULT_JOB_PATH
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            spec = yaml.safe_load(f)
+    except (OSError, yaml.YAMLError) as e:
+        raise JobError(f"can't read job config {path}: {e}") from e
+    return parse_job(spec, _rules_tables(rules_path), path=path)
+
+
+# --- plan ----------------------------------------------------------------
+
+def count_sources(job, engine=None, salesforce_count=None):
+    """
+    {source: total rows}: salesforce_count(object, where) for the patients
+    (a SOQL COUNT()) and a COUNT(*) per table on `engine`; sources whose
+    counter is None are left out.
+    """
+    counts = {}
+    if salesforce_count is not None:
+        counts[job.object] = salesforce_count(job.object, job.where)
+    if engine is not None:
+        from connectors.sql import count_rows
+
+        for name in job.tables:
+            counts[name] = count_rows(engine, name)
+    return counts
+
+
+def planned_patients(job, counts):
+    """Patients the job extracts, from the Salesforce count (None when unknown)."""
+    total = counts.get(job.object)
+    if job.subset is not None:
+        if job.subset["ids"] is not None:
+            return len(set(job.subset["ids"]))
+        size = job.subset["size"]
+        if isinstance(size, float):
+            return round(size * total) if total is not None else None
+        return min(size, total) if total is not None else size
+    if job.extract_mode == "query" and job.limit:
+        return min(job.limit, total) if total is not None else job.limit
+    return total
+
+
+def plan_rows(job, counts):
+    """
+    [(source, total rows, planned rows)]: the patients, then each table's
+    share for those patients (total x patients / all patients, capped at
+    row_limit unless the job takes a subset). None where a count is missing.
+    """
+    total = counts.get(job.object)
+    patients = planned_patients(job, counts)
+    rows = [(job.object, total, patients)]
+    row_limit = None if job.subset is not None else job.row_limit
+    for name in job.tables:
+        table_total = counts.get(name)
+        planned = None
+        if table_total is not None and patients is not None and total:
+            planned = math.ceil(table_total * patients / total)
+            if row_limit:
+                planned = min(planned, row_limit)
+        rows.append((name, table_total, planned))
+    return rows
+
+
+def _n(value):
+    return f"{value:,}" if value is not None else "?"
+
+
+def format_plan(job, counts):
+    source = f" ({job.path})" if job.path else ""
+    row_limit = "none (subset)" if job.subset else _n(job.row_limit) if job.row_limit else "none"
+    lines = [f"Job {job.name}{source}: {job.extract_mode} extract, {len(job.tables)} table(s) -> "
+             f"{job.output_dir} as {job.format}{' partitioned' if job.partition else ''}",
+             f"  workers {job.workers}, fetch workers {job.fetch_workers}, chunk size {job.chunk_size:,}, "
+             f"row limit {row_limit}, "
+             f"ids sent {job.id_strategy}",
+             f"  {'source':<34}{'id column':<24}{'read':<11}{'total rows':>14}{'planned rows':>14}"]
+    for name, total, planned in plan_rows(job, counts):
+        table = job.tables.get(name)
+        id_column, read = (table.id_column, "streamed" if table.stream else "in memory") if table else ("Id", "SOQL")
+        lines.append(f"  {name[:33]:<34}{id_column[:23]:<24}{read:<11}{_n(total):>14}{_n(planned):>14}")
+    if job.subset is not None:
+        by = f" by {job.subset['by']}" if job.subset.get("by") else ""
+        size = job.subset["size"]
+        size = f"{size:.2%}" if isinstance(size, float) else f"{len(set(job.subset['ids'])):,} listed" \
+            if size is None else f"{size:,}"
+        lines.append(f"  subset: {size} patients{by}, every related row kept")
+    return "\n".join(lines)
+
+
+# --- dry-run estimate ------------------------------------------------------
+
+def load_history(paths):
+    """
+    Records from benchmarks/bench_pipeline.py history files (a JSON list)
+    and utils.metrics reports (a JSON object with "stages"); missing files
+    are skipped.
+    """
+    records = []
+    for path in paths:
+        if not os.path.exists(path):
+            continue
+        with open(path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+        records += data if isinstance(data, list) else [data]
+    return records
+
+
+def _nearest_bench(records, rows, fmt):
+    bench = [r for r in records if isinstance(r.get("stages"), dict) and not r.get("traced")]
+    same_format = [r for r in bench if r.get("format") == fmt]
+    candidates = same_format or bench
+    if not candidates:
+        return None
+    return min(candidates, key=lambda r: (abs(math.log(max(r["rows"], 1)) - math.log(max(rows, 1))),
+                                          r.get("timestamp", "")))
+
+
+def _fetch_rate(records):
+    rows = seconds = 0
+    for r in records:
+        for stage in r.get("stages") if isinstance(r.get("stages"), list) else ():
+            if stage.get("stage") == "fetch" and stage.get("rows"):
+                rows, seconds = rows + stage["rows"], seconds + stage["wall_s"]
+    return rows / seconds if seconds else None
+
+
+@dataclass
+class Estimate:
+    stages: list = field(default_factory=list)  # (stage, rows, rows/sec or None, seconds or None)
+    peak_rss_mb: float = None
+    basis: str = None
+
+    @property
+    def seconds(self):
+        known = [s for _, _, _, s in self.stages if s is not None]
+        return sum(known) if known else None
+
+
+def estimate_run(job, counts, history):
+    """
+    Runtime and peak memory for the planned rows, scaled from the closest
+    benchmark run (by rows, same format when there is one); fetch time
+    comes from earlier run metrics. None when the history has no runs.
+    """
+    planned = {name: rows for name, _, rows in plan_rows(job, counts)}
+    patients = planned.pop(job.object) or 0
+    table_rows = sum(rows or 0 for rows in planned.values())
+    fmt = job.format.lower().partition(":")[0]
+    bench = _nearest_bench(history, table_rows, fmt)
+    if bench is None:
+        return None
+    rate = {name: s.get("rows_per_sec") for name, s in bench["stages"].items()}
+
+    def stage(name, rows, rows_per_sec):
+        return name, rows, rows_per_sec, rows / rows_per_sec if rows_per_sec else None
+
+    estimate = Estimate(basis=f"bench_pipeline run of {bench['rows']:,} rows ({bench.get('format')}) "
+                              f"at {bench.get('commit') or bench.get('timestamp')}")
+    estimate.stages = [
+        stage("fetch", table_rows, _fetch_rate(history)),
+        stage("fake_map", patients, rate.get("fake_map")),
+        stage("mask", table_rows + patients, rate.get("mask")),
+        stage("write", 2 * (table_rows + patients), rate.get("write")),   # real and masked copies
+    ]
+    if bench.get("peak_rss_mb"):
+        # the benchmark's peak held one chunk and its patients' lookup
+        mb_per_row = bench["peak_rss_mb"] / (bench["chunk_rows"] + bench["patients"])
+        in_memory = sorted((planned[t] or 0 for t in job.tables if not job.tables[t].stream), reverse=True)
+        held = sum(in_memory[:job.workers]) + (job.chunk_size if job.stream_tables else 0)
+        estimate.peak_rss_mb = mb_per_row * (patients + held)
+    return estimate
+
+
+def format_estimate(estimate):
+    if estimate is None:
+        return "No benchmark history to estimate from (run benchmarks/bench_pipeline.py first)"
+    lines = [f"Estimate from {estimate.basis}:",
+             f"  {'stage':<10}{'rows':>14}{'rows/s':>14}{'seconds':>10}"]
+    for name, rows, rows_per_sec, seconds in estimate.stages:
+        rate = f"{rows_per_sec:>14,.0f}" if rows_per_sec else f"{'?':>14}"
+        secs = f"{seconds:>10.1f}" if seconds is not None else f"{'?':>10}"
+        lines.append(f"  {name:<10}{rows:>14,}{rate}{secs}")
+    total = estimate.seconds
+    lines.append(f"  total {total:,.0f}s" if total is not None else "  total unknown")
+    if any(s is None for _, _, _, s in estimate.stages):
+        lines[-1] += " (stages marked ? have no history; pass earlier --metrics reports with --history)"
+    if estimate.peak_rss_mb is not None:
+        lines.append(f"  peak RSS about {estimate.peak_rss_mb:,.0f} MB")
+    return "\n".join(lines)
@@ -0,0 +1,128 @@
+"""
+Streaming inner hash join.
+
+mock_patients joins Salesforce patients to MySQL assessments on
+(Id, Facility__c) = (Patient__c, Facility__c) and keeps only matches.
+Loading the whole assessments side and calling pd.merge materializes every
+row, most of which never match. Here the smaller (left) side's key tuples
+are indexed once (KeyIndex: the first key column's values plus a hash
+index of the full tuples); every chunk of the larger side is filtered
+against it with vectorized isin/hash lookups, so unmatched rows are dropped
+chunk by chunk and never accumulate. Only the surviving rows are merged,
+once, so the result has the rows, columns and order of
+pd.merge(left, right, how="inner").
+"""
+import time
+from dataclasses import dataclass
+
+import numpy as np
+import pandas as pd
+
+def _key_hashes(frame, on):
+    """uint64 hash per row of the key columns `on` (numbers as float64, everything else as text)."""
+    keys = pd.DataFrame({
+        i: frame[col].astype("float64") if pd.api.types.is_numeric_dtype(frame[col]) else frame[col].astype("str")
+        for i, col in enumerate(on)
+    })
+    return pd.util.hash_pandas_object(keys, index=False, categorize=False).to_numpy()
+
+
+class KeyIndex:
+    """
+    The distinct keys of a frame, for membership tests on other frames:
+    the values of the first key column (also what to push down to SQL as an
+    IN list) plus, for composite keys, a hash index of the key tuples.
+    """
+
+    def __init__(self, frame, on):
+        self.on = list(on)
+        self.values = pd.Index(pd.unique(frame[self.on[0]]))
+        self.hashes = pd.Index(np.unique(_key_hashes(frame, self.on))) if len(self.on) > 1 else None
+
+    def __len__(self):
+        return len(self.values) if self.hashes is None else len(self.hashes)
+
+    def contains(self, frame, on=None):
+        """
+        Boolean mask: rows of `frame` whose key (columns `on`) is in the index.
+        The first column is looked up directly, the full tuple by hash on the
+        rows that pass; a hash collision can only let a row through, never
+        drop a match.
+        """
+        on = list(on or self.on)
+        # get_indexer reuses the index's hash table; isin would rebuild one per chunk
+        mask = self.values.get_indexer(frame[on[0]]) >= 0
+        if self.hashes is not None and mask.any():
+            mask[mask] = self.hashes.get_indexer(_key_hashes(frame[mask], on)) >= 0
+        return mask
+
+
+@dataclass
+class JoinStats:
+    left_rows: int = 0
+    left_keys: int = 0
+    left_matched: int = 0
+    right_rows: int = 0
+    right_kept: int = 0
+    rows: int = 0
+    chunks: int = 0
+    right_bytes: int = 0
+    kept_bytes: int = 0
+    seconds: float = 0.0
+
+    @property
+    def match_rate(self):
+        """Share of streamed right-side rows that had a match."""
+        return self.right_kept / self.right_rows if self.right_rows else 0.0
+
+    @property
+    def saved_mb(self):
+        """Memory of the right-side rows dropped before the merge, in MB."""
+        return (self.right_bytes - self.kept_bytes) / 1e6
+
+    def __str__(self):
+        left_rate = self.left_matched / self.left_rows if self.left_rows else 0.0
+        return (
+            f"join: {self.rows:,} rows; right side {self.right_kept:,}/{self.right_rows:,} rows matched "
+            f"({self.match_rate:.1%}) in {self.chunks} chunks, left side {self.left_matched:,}/{self.left_rows:,} "
+            f"({left_rate:.1%}); {self.saved_mb:,.1f} MB of unmatched rows never kept; {self.seconds:.1f}s"
+        )
+
+
+def stream_join(left, right_chunks, left_on, right_on, suffixes=("_x", "_y"), right_columns=None):
+    """
+    Inner join of `left` (the smaller side, held in memory) with a stream of
+    right-side chunks. Each chunk is filtered by a KeyIndex of `left` as it
+    arrives; only the matching rows are kept and merged at the end.
+    `right_columns` gives the right side's columns when the stream may be
+    empty. Returns (merged, JoinStats).
+    """
+    start = time.perf_counter()
+    left_on, right_on = list(left_on), list(right_on)
+    index = KeyIndex(left, left_on)
+    stats = JoinStats(left_rows=len(left), left_keys=len(index))
+
+    kept, empty = [], None
+    for chunk in right_chunks:
+        stats.chunks += 1
+        stats.right_rows += len(chunk)
+        stats.right_bytes += int(chunk.memory_usage(deep=True).sum())
+        matched = chunk[index.contains(chunk, right_on)]
+        if len(matched):
+            kept.append(matched)
+            stats.right_kept += len(matched)
+            stats.kept_bytes += int(matched.memory_usage(deep=True).sum())
+        elif empty is None:
+            empty = matched
+
+    if not kept and empty is None:
+        if right_columns is None:
+            raise ValueError("stream_join got no right-side chunks and no right_columns")
+        empty = pd.DataFrame(columns=list(right_columns))
+    # empty chunks would turn typed columns into object on concat
+    right = pd.concat(kept, ignore_index=True) if len(kept) > 1 else (kept or [empty])[0]
+    merged = pd.merge(left, right, left_on=left_on, right_on=right_on, how="inner", suffixes=suffixes)
+    stats.left_matched = int(KeyIndex(right, right_on).contains(left, left_on).sum()) if len(right) else 0
+    stats.rows = len(merged)
+    stats.seconds = time.perf_counter() - start
+    return merged, stats
@@ -0,0 +1,124 @@
+import base64
+import hashlib
+
+import numpy as np
+import pandas as pd
+
+from utils.compact import as_text, compact_lookup, constant_column, merge_where
+
+
+def build_lookup(fake_map):
+    """
+    Turn a {real_key: {field: fake_value}} map (or a pool_map frame) into a
+    lookup frame: one row per real key, one column per fake field,
+    repetitive fields as categoricals (utils/compact.py). A frame already
+    built here is returned unchanged, so build it once per map.
+    """
+    if isinstance(fake_map, pd.DataFrame):
+        if fake_map.attrs.get("lookup"):
+            return fake_map
+        lookup = compact_lookup(fake_map)
+    else:
+        lookup = compact_lookup(pd.DataFrame.from_records(list(fake_map.values()), index=list(fake_map.keys())))
+    lookup.attrs["lookup"] = True
+    return lookup
+
+
+def lookup_field(lookup, field, default=None):
+    """
+    Column-wise equivalent of fake_info.get(field, default).
+    `default` may be a scalar or a Series aligned with the lookup.
+    """
+    if field not in lookup.columns:
+        if isinstance(default, pd.Series):
+            return default
+        return pd.Series(default, index=lookup.index)
+    values = lookup[field]
+    if default is not None and values.isna().any():
+        values = as_text(values)
+        values = values.where(values.notna(), default)
+    return values
+
+
+def hash_key_for(secret):
+    """16-character SipHash key for pd.util.hash_pandas_object derived from `secret`."""
+    if not secret:
+        return None
+    return base64.b64encode(hashlib.sha256(secret.encode("utf-8")).digest()[:12]).decode("ascii")
+
+
+def keyed_hash(values, hash_key):
+    """
+    uint64 keyed hash per value (values compared as text). Raises without a
+    `hash_key`: pandas' default key is public, so anyone could recompute
+    the hashes (and the date offsets built on them) from the real values.
+    """
+    if not hash_key:
+        raise ValueError("A keyed hash needs MASKING_SECRET (or another secret passed to hash_key_for)")
+    values = pd.Series(values).astype(str)
+    return pd.util.hash_pandas_object(values, index=False, hash_key=hash_key).to_numpy()
+
+
+def mask_rows(df, keys, lookup, columns, rows=None):
+    """
+    Overwrite `columns` on every row of `df` whose key is in `lookup`.
+
+    `keys` holds one real key per row of `df` (read before any column is
+    overwritten). `columns` maps a target column to either a Series aligned
+    with the lookup (one fake value per key) or a scalar written to every
+    matched row. Targets missing from `df` are added and left NaN on rows
+    without a match, the same as assigning them cell by cell with df.at.
+    Categorical lookup columns and text scalars give categorical columns,
+    merged with the unmatched rows' values when only some rows match.
+    `rows` maps existing columns to Series aligned with `df` (values derived
+    from the row itself, e.g. hashes). Rows whose key is not in the lookup
+    are left untouched.
+    """
+    pos = lookup.index.get_indexer(keys)
+    hit = pos >= 0
+    if not hit.any():
+        return df
+    all_hit = hit.all()
+    take = np.where(hit, pos, 0)
+
+    for col, values in columns.items():
+        if isinstance(values, pd.Series):
+            new = values.take(take).set_axis(df.index)
+        else:
+            new = constant_column(values, df.index)
+
+        if col not in df.columns:
+            df[col] = new if all_hit else new.where(hit)
+        elif all_hit:
+            df[col] = new
+        else:
+            merged = merge_where(df[col], new, hit)
+            df[col] = merged if merged is not None else df[col].where(~hit, as_text(new))
+    for col, new in (rows or {}).items():
+        df[col] = new if all_hit else df[col].astype(object).where(~hit, new)
+    return df
+
+
+def mask_table(df, fake_map, id_cols, sf_id_col="Patient__c"):
+    """
+    Vectorized masking of a MySQL table keyed by a Salesforce patient id.
+    Columns in `id_cols` are kept, columns named after a fake field get the
+    patient's fake value and every other column becomes "MASKED".
+    """
+    if sf_id_col not in df.columns:
+        return df
+    lookup = build_lookup(fake_map)
+    keys = df[sf_id_col].copy()
+    columns = {
+        col: lookup[col] if col in lookup.columns else "MASKED"
+        for col in df.columns
+        if col not in id_cols
+    }
+    return mask_rows(df, keys, lookup, columns)
+
+
+def mask_sf_patients(df, fake_map):
+    """Vectorized masking of Patient__c records keyed by Salesforce Id (rules: salesforce_patients)."""
+    from utils.rules import mask_with_rules
+
+    return mask_with_rules(df, fake_map, "salesforce_patients")
@@ -0,0 +1,296 @@
+"""
+Per-stage run metrics.
+
+Wraps the stages of a pipeline run (auth, query, fetch, mask, write) in
+context managers or decorators and records, per stage and table, wall
+time, CPU time, rows, bytes and peak RSS:
+
+    metrics = RunMetrics("mock_salesforcesql")
+    with metrics.stage("query") as stage:
+        df = ...
+        stage.add(df)                      # rows and in-memory bytes
+    mask = metrics.timed("mask", table="assessments")(mask_fn)
+    chunks = metrics.iter_stage("fetch", chunks, table="assessments")
+    metrics.write("run_metrics.json")      # or .prom for Prometheus text
+
+Peak RSS is the high-water mark while the stage ran: on Linux the
+kernel's mark is reset when a top-level stage starts; elsewhere it is the
+process peak so far. CPU time is this process's (all threads), so it can
+exceed wall time and does not include worker processes; stages recorded
+after the fact with record() (e.g. from mask_tables timings) have none.
+
+The masking stage can also be profiled: `profile_path` (METRICS_PROFILE)
+ending in .html uses pyinstrument when it is installed, anything else
+gets a cProfile dump (`python -m pstats <path>`).
+"""
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from functools import wraps
+
+import pandas as pd
+
+from utils.streaming import peak_rss_mb
+
+try:
+    import pyinstrument
+except ImportError:
+    pyinstrument = None
+
+METRICS_PREFIX = "patient_mocker"
+
+
+def _read_hwm_mb():
+    """VmHWM (peak RSS since the last reset) in MB, or None off Linux."""
+    try:
+        with open("/proc/self/status", "r") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return None
+
+
+def _reset_hwm():
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+        return True
+    except OSError:
+        return False
+
+
+def frame_bytes(df):
+    """In-memory size of a DataFrame, strings included."""
+    return int(df.memory_usage(deep=True).sum())
+
+
+@dataclass
+class StageMetrics:
+    stage: str
+    table: str = None
+    calls: int = 0
+    wall_s: float = 0.0
+    cpu_s: float = None
+    rows: int = 0
+    bytes: int = 0
+    peak_rss_mb: float = None
+
+    def add(self, df=None, rows=0, nbytes=0):
+        """Count rows and bytes: a DataFrame's, or given ones."""
+        if df is not None:
+            rows, nbytes = len(df), frame_bytes(df)
+        self.rows += rows
+        self.bytes += nbytes
+        return df
+
+    @property
+    def rows_per_sec(self):
+        return self.rows / self.wall_s if self.wall_s else 0.0
+
+
+@dataclass
+class RunMetrics:
+    run: str
+    profile_path: str = None
+    profile_stage: str = "mask"
+    stages: dict = field(default_factory=dict)
+
+    def __post_init__(self):
+        self.started = time.time()
+        self._start = time.perf_counter()
+        self._cpu_start = time.process_time()
+        self._lock = threading.Lock()
+        self._depth = 0
+        self._profiler = None
+        self._profiling = False
+
+    def get(self, stage, table=None):
+        with self._lock:
+            metrics = self.stages.get((stage, table))
+            if metrics is None:
+                metrics = self.stages[(stage, table)] = StageMetrics(stage, table)
+            return metrics
+
+    @contextmanager
+    def stage(self, name, table=None):
+        """Time the block as stage `name` (per `table`); yields its StageMetrics for add()."""
+        metrics = self.get(name, table)
+        with self._lock:
+            top_level = self._depth == 0
+            self._depth += 1
+        hwm = _reset_hwm() if top_level else False
+        profiling = name == self.profile_stage and self._start_profile()
+        start, cpu_start = time.perf_counter(), time.process_time()
+        try:
+            yield metrics
+        finally:
+            wall, cpu = time.perf_counter() - start, time.process_time() - cpu_start
+            if profiling:
+                self._stop_profile()
+            peak = (_read_hwm_mb() if hwm else None) or peak_rss_mb()
+            with self._lock:
+                self._depth -= 1
+                metrics.calls += 1
+                metrics.wall_s += wall
+                metrics.cpu_s = (metrics.cpu_s or 0.0) + cpu
+                if peak is not None:
+                    metrics.peak_rss_mb = max(metrics.peak_rss_mb or 0.0, peak)
+
+    def timed(self, name, table=None):
+        """Decorator: each call is a `name` stage; a DataFrame result adds its rows and bytes."""
+        def decorator(fn):
+            @wraps(fn)
+            def wrapper(*args, **kwargs):
+                with self.stage(name, table) as metrics:
+                    result = fn(*args, **kwargs)
+                    if isinstance(result, pd.DataFrame):
+                        metrics.add(result)
+                    return result
+            return wrapper
+        return decorator
+
+    def iter_stage(self, name, frames, table=None):
+        """Yield from `frames`, timing each next() (e.g. a chunked read) as stage `name`."""
+        frames = iter(frames)
+        while True:
+            with self.stage(name, table) as metrics:
+                frame = next(frames, None)
+                if frame is not None:
+                    metrics.add(frame)
+            if frame is None:
+                return
+            yield frame
+
+    def record(self, name, table=None, wall_s=0.0, rows=0, nbytes=0):
+        """Add a stage measured elsewhere (another thread or process)."""
+        metrics = self.get(name, table)
+        with self._lock:
+            metrics.calls += 1
+            metrics.wall_s += wall_s
+            metrics.add(rows=rows, nbytes=nbytes)
+
+    def _start_profile(self):
+        # profilers see one thread; stages on pool threads are not profiled
+        if (not self.profile_path or self._profiling
+                or threading.current_thread() is not threading.main_thread()):
+            return False
+        if self._profiler is None:
+            if self.profile_path.endswith(".html") and pyinstrument is not None:
+                self._profiler = pyinstrument.Profiler()
+            else:
+                import cProfile
+                self._profiler = cProfile.Profile()
+        if pyinstrument is not None and isinstance(self._profiler, pyinstrument.Profiler):
+            self._profiler.start()
+        else:
+            self._profiler.enable()
+        self._profiling = True
+        return True
+
+    def _stop_profile(self):
+        self._profiling = False
+        if pyinstrument is not None and isinstance(self._profiler, pyinstrument.Profiler):
+            self._profiler.stop()
+        else:
+            self._profiler.disable()
+
+    def dump_profile(self):
+        """Write the masking-stage profile to profile_path (if anything was profiled)."""
+        if self._profiler is None:
+            return None
+        if pyinstrument is not None and isinstance(self._profiler, pyinstrument.Profiler):
+            with open(self.profile_path, "w", encoding="utf-8") as f:
+                f.write(self._profiler.output_html())
+        else:
+            self._profiler.dump_stats(self.profile_path)
+        return self.profile_path
+
+    def report(self):
+        """The run as a JSON-serialisable dict."""
+        return {
+            "run": self.run,
+            "started": time.strftime("%Y-%m-%dT%H:%M:%S", time.localtime(self.started)),
+            "wall_s": time.perf_counter() - self._start,
+            "cpu_s": time.process_time() - self._cpu_start,
+            "peak_rss_mb": peak_rss_mb(),
+            "stages": [
+                {**vars(m), "rows_per_sec": m.rows_per_sec}
+                for m in sorted(self.stages.values(), key=lambda m: (m.stage, m.table or ""))
+            ],
+        }
+
+    def prometheus(self):
+        """The run in Prometheus text exposition format (gauges labelled by run, stage and table)."""
+        report = self.report()
+        series = [
+            ("stage_wall_seconds", "Wall time per pipeline stage", "wall_s"),
+            ("stage_cpu_seconds", "CPU time of this process per pipeline stage", "cpu_s"),
+            ("stage_rows", "Rows handled per pipeline stage", "rows"),
+            ("stage_bytes", "In-memory bytes handled per pipeline stage", "bytes"),
+            ("stage_peak_rss_megabytes", "Peak resident memory while the stage ran", "peak_rss_mb"),
+            ("stage_calls", "Times the stage ran", "calls"),
+        ]
+        lines = []
+        for name, help_text, key in series:
+            lines += [f"# HELP {METRICS_PREFIX}_{name} {help_text}", f"# TYPE {METRICS_PREFIX}_{name} gauge"]
+            for s in report["stages"]:
+                if s[key] is None:
+                    continue
+                labels = {"run": self.run, "stage": s["stage"]}
+                if s["table"] is not None:
+                    labels["table"] = s["table"]
+                label_text = ",".join(f'{k}="{_escape(v)}"' for k, v in labels.items())
+                lines.append(f"{METRICS_PREFIX}_{name}{{{label_text}}} {s[key]}")
+        for name, key in (("run_wall_seconds", "wall_s"), ("run_cpu_seconds", "cpu_s"),
+                          ("run_peak_rss_megabytes", "peak_rss_mb")):
+            if report[key] is not None:
+                lines += [f"# TYPE {METRICS_PREFIX}_{name} gauge",
+                          f'{METRICS_PREFIX}_{name}{{run="{_escape(self.run)}"}} {report[key]}']
+        return "\n".join(lines) + "\n"
+
+    def write(self, path, fmt=None):
+        """
+        Write the report to `path`: Prometheus text for .prom/.txt (or
+        fmt="prometheus"), JSON otherwise.
+        """
+        fmt = fmt or ("prometheus" if path.endswith((".prom", ".txt")) else "json")
+        text = self.prometheus() if fmt == "prometheus" else json.dumps(self.report(), indent=2)
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        tmp = f"{path}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            f.write(text)
+        os.replace(tmp, path)
+        return path
+
+    def __str__(self):
+        lines = [f"{'stage':<8}{'table':<34}{'wall s':>9}{'cpu s':>9}{'rows':>12}{'MB':>10}{'peak RSS MB':>13}"]
+        for s in self.report()["stages"]:
+            cpu = f"{s['cpu_s']:>9.2f}" if s["cpu_s"] is not None else f"{'-':>9}"
+            rss = f"{s['peak_rss_mb']:>13,.0f}" if s["peak_rss_mb"] is not None else f"{'-':>13}"
+            lines.append(f"{s['stage']:<8}{(s['table'] or '')[:33]:<34}{s['wall_s']:>9.2f}{cpu}"
+                         f"{s['rows']:>12,}{s['bytes'] / 1e6:>10.1f}{rss}")
+        return "\n".join(lines)
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+@contextmanager
+def maybe_stage(metrics, name, table=None):
+    """metrics.stage(name, table), or a no-op yielding None when `metrics` is None."""
+    if metrics is None:
+        yield None
+    else:
+        with metrics.stage(name, table) as stage:
+            yield stage
+
+
+def from_env(run):
+    """RunMetrics for `run`, profiling the mask stage when METRICS_PROFILE is set."""
+    return RunMetrics(run, profile_path=os.getenv("METRICS_PROFILE") or None)
@@ -1,31 +1,147 @@
-import yaml
+import difflib
 import os
+import re
+import threading
+import time
+from functools import lru_cache
+
+import yaml
+
+_NON_ALNUM = re.compile(r'[^a-z0-9]')
+# Minimum difflib ratio for a header with no exact alias to match one
+FUZZY_CUTOFF = 0.85
+RESOLVE_CACHE_SIZE = 4096
+# Seconds between mtime checks of the alias YAML
+MTIME_CHECK_INTERVAL = 1.0
+
+def default_aliases_path():
+    this_dir = os.path.dirname(os.path.abspath(__file__))
+    return os.path.normpath(os.path.join(this_dir, '..', 'config', 'column_aliases.yaml'))
+
+def normalize_name(name):
+    """Lowercase alphanumerics only: 'Date of Birth' -> 'dateofbirth'."""
+    return _NON_ALNUM.sub('', str(name).lower())
+
+class AliasResolver:
+    """
+    Column-name -> standard-name resolution built once from the alias YAML.
+
+    Resolutions (exact and fuzzy) are memoized in an LRU cache, so a header
+    seen before costs a dict lookup and an unseen header pays the difflib
+    search once. The YAML is re-read when its mtime changes (checked at most
+    every `check_interval` seconds), which also clears the cache.
+    `fuzzy_cutoff=None` disables fuzzy matching.
+    """
+
+    def __init__(self, yaml_path=None, aliases=None, fuzzy_cutoff=FUZZY_CUTOFF,
+                 cache_size=RESOLVE_CACHE_SIZE, check_interval=MTIME_CHECK_INTERVAL):
+        self.yaml_path = None if aliases is not None else (yaml_path or default_aliases_path())
+        self.fuzzy_cutoff = fuzzy_cutoff
+        self.check_interval = check_interval
+        self._mtime = None
+        self._checked_at = 0.0
+        self._lock = threading.Lock()
+        self._resolve = lru_cache(maxsize=cache_size)(self._resolve_uncached)
+        if aliases is not None:
+            self._build(aliases)
+        else:
+            self._reload()
+
+    def _build(self, aliases):
+        self.aliases = aliases or {}
+        self.lookup = {}
+        for std_col, names in self.aliases.items():
+            for alias in names:
+                self.lookup[normalize_name(alias)] = std_col
+        self._candidates = list(self.lookup)
+        self._resolve.cache_clear()
+
+    def _reload(self):
+        mtime = os.stat(self.yaml_path).st_mtime_ns
+        with open(self.yaml_path, 'r', encoding='utf-8') as f:
+            self._build(yaml.safe_load(f))
+        self._mtime = mtime
+
+    def refresh(self):
+        """Re-read the YAML if it changed since it was loaded."""
+        if self.yaml_path is None:
+            return
+        now = time.monotonic()
+        if now - self._checked_at < self.check_interval:
+            return
+        with self._lock:
+            self._checked_at = now
+            if os.stat(self.yaml_path).st_mtime_ns != self._mtime:
+                self._reload()
+
+    def _resolve_uncached(self, column):
+        norm = normalize_name(column)
+        std = self.lookup.get(norm)
+        if std or self.fuzzy_cutoff is None or not norm:
+            return std, False
+        close = difflib.get_close_matches(norm, self._candidates, n=1, cutoff=self.fuzzy_cutoff)
+        return (self.lookup[close[0]], True) if close else (None, False)
+
+    def resolve(self, column):
+        """Standard name for `column`, or None."""
+        self.refresh()
+        return self._resolve(column)[0]
+
+    def cache_info(self):
+        return self._resolve.cache_info()
+
+    def rename_map(self, columns):
+        """
+        {column: standard name} for `columns`. Exact alias matches win; a fuzzy
+        match is only used for a standard name no other column claims.
+        """
+        self.refresh()
+        exact, fuzzy = {}, {}
+        for col in columns:
+            std, is_fuzzy = self._resolve(col)
+            if std:
+                (fuzzy if is_fuzzy else exact)[col] = std
+        claimed = set(exact.values()) | {c for c in columns if c in self.aliases}
+        for col, std in fuzzy.items():
+            if std not in claimed:
+                exact[col] = std
+                claimed.add(std)
+        return exact
+
+    def normalize(self, df):
+        df = df.rename(columns=self.rename_map(df.columns))
+        missing = [col for col in self.aliases if col not in df.columns]
+        if missing:
+            print(f"[WARN] Could not find expected columns: {missing}")
+        return df
+
+_resolvers = {}
+_resolvers_lock = threading.Lock()
+
+def get_resolver(yaml_path=None, **kwargs):
+    """Shared AliasResolver per YAML path (kept fresh by its mtime check)."""
+    key = (os.path.abspath(yaml_path or default_aliases_path()), tuple(sorted(kwargs.items())))
+    with _resolvers_lock:
+        resolver = _resolvers.get(key)
+        if resolver is None:
+            resolver = _resolvers[key] = AliasResolver(key[0], **kwargs)
+    return resolver
 
 def load_aliases(yaml_path=None):
-    if not yaml_path:
-        this_dir = os.path.dirname(os.path.abspath(__file__))
-        yaml_path = os.path.normpath(os.path.join(this_dir, '..', 'config', 'column_aliases.yaml'))
-    with open(yaml_path, 'r', encoding='utf-8') as f:
-        return yaml.safe_load(f)
+    resolver = get_resolver(yaml_path)
+    resolver.refresh()
+    return resolver.aliases
+
+def _exact_resolver(col_aliases):
+    # dict aliases keep the original exact-match behaviour
+    key = tuple((std, tuple(names)) for std, names in col_aliases.items())
+    with _resolvers_lock:
+        resolver = _resolvers.get(key)
+        if resolver is None:
+            resolver = _resolvers[key] = AliasResolver(aliases=col_aliases, fuzzy_cutoff=None)
+    return resolver
 
 def normalize_columns(df, col_aliases):
-    import re
-    col_lookup = {}
-    for std_col, aliases in col_aliases.items():
-        for alias in aliases:
-            norm_alias = re.sub(r'[^a-z0-9]', '', alias.lower())
-            col_lookup[norm_alias] = std_col
-
-    normalized_cols = {}
-    for col in df.columns:
-        norm_col = re.sub(r'[^a-z0-9]', '', col.lower())
-        std = col_lookup.get(norm_col)
-        if std:
-            normalized_cols[col] = std
-
-    df = df.rename(columns=normalized_cols)
-    wanted = list(col_aliases.keys())
-    missing = [col for col in wanted if col not in df.columns]
-    if missing:
-        print(f"[WARN] Could not find expected columns: {missing}")
-    return df
+    """Rename `df` columns to standard names; `col_aliases` is an alias dict or an AliasResolver."""
+    resolver = col_aliases if isinstance(col_aliases, AliasResolver) else _exact_resolver(col_aliases)
+    return resolver.normalize(df)
@@ -0,0 +1,147 @@
+"""
+Concurrent multi-table masking: tables are fetched on a thread pool (I/O
+bound) and masked on a process pool (CPU bound), so one table's query
+overlaps another's masking.
+
+The fake map is sent to each worker process once, through the pool
+initializer, and turned into a lookup frame there. Every table is masked
+against the same map, which keeps fakes consistent across tables.
+
+Workers are started by a fork server (spawned where there is none), not
+forked from this process: the fetch threads may hold the connection
+pool's or the driver's locks at that moment, and a forked child would
+inherit them held, along with the pooled sockets. Workers therefore
+start empty and build everything they need in _init_mask_worker.
+"""
+import multiprocessing
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, ThreadPoolExecutor, wait
+from dataclasses import dataclass
+
+import pandas as pd
+
+from utils.masking import build_lookup
+
+# Frames larger than this are split so several processes share one table
+MASK_CHUNK_ROWS = 250_000
+MP_START_METHOD = "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+
+_worker_lookup = None
+
+
+@dataclass
+class TableTiming:
+    table: str
+    rows: int = 0
+    fetch_s: float = 0.0
+    mask_s: float = 0.0
+    write_s: float = 0.0
+
+
+def _init_mask_worker(fake_map):
+    """
+    A fresh worker's state. multiprocessing gives it the parent's sys.path
+    and re-imports the main module; the lookup frame is built here.
+    """
+    global _worker_lookup
+    _worker_lookup = build_lookup(fake_map)
+
+
+def _mask_in_worker(mask_fn, df, kwargs):
+    start = time.perf_counter()
+    masked = mask_fn(df, _worker_lookup, **kwargs)
+    return masked, time.perf_counter() - start
+
+
+def _timed_fetch(fetch, table):
+    start = time.perf_counter()
+    df = fetch(table)
+    return df, time.perf_counter() - start
+
+
+def _split(df, chunk_rows):
+    if len(df) <= chunk_rows:
+        return [df]
+    return [df.iloc[i:i + chunk_rows] for i in range(0, len(df), chunk_rows)]
+
+
+def mask_tables(tables, fetch, mask_fn, fake_map, write, mask_kwargs=None, workers=1,
+                chunk_rows=MASK_CHUNK_ROWS):
+    """
+    Fetch, mask and write every table in `tables`.
+
+      fetch(table) -> DataFrame           runs on a thread pool
+      mask_fn(df, lookup, **kwargs) -> df  runs in worker processes; must be
+                                          a module-level (picklable) function
+      write(table, real_df, masked_df)    runs in the calling thread
+
+    `mask_kwargs` maps a table to extra keyword arguments for mask_fn.
+    With workers <= 1 everything runs inline, one table after another.
+    Returns a TableTiming per table, in completion order.
+    """
+    mask_kwargs = mask_kwargs or {}
+    timings = []
+
+    if workers <= 1:
+        lookup = build_lookup(fake_map)
+        for table in tables:
+            df, fetch_s = _timed_fetch(fetch, table)
+            timing = TableTiming(table, len(df), fetch_s)
+            timings.append(timing)
+            if df.empty:
+                write(table, df, df)
+                continue
+            start = time.perf_counter()
+            masked = mask_fn(df.copy(), lookup, **mask_kwargs.get(table, {}))
+            timing.mask_s = time.perf_counter() - start
+            start = time.perf_counter()
+            write(table, df, masked)
+            timing.write_s = time.perf_counter() - start
+        return timings
+
+    with ThreadPoolExecutor(max_workers=workers) as io_pool, \
+            ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context(MP_START_METHOD),
+                                initializer=_init_mask_worker, initargs=(fake_map,)) as cpu_pool:
+        pending = {io_pool.submit(_timed_fetch, fetch, table): ("fetch", table) for table in tables}
+        state = {}  # table -> [real_df, timing, chunk results, chunks left]
+
+        while pending:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                kind, item = pending.pop(future)
+                if kind == "fetch":
+                    table = item
+                    df, fetch_s = future.result()
+                    timing = TableTiming(table, len(df), fetch_s)
+                    timings.append(timing)
+                    if df.empty:
+                        write(table, df, df)
+                        continue
+                    chunks = _split(df, chunk_rows)
+                    state[table] = [df, timing, [None] * len(chunks), len(chunks)]
+                    for i, chunk in enumerate(chunks):
+                        f = cpu_pool.submit(_mask_in_worker, mask_fn, chunk, mask_kwargs.get(table, {}))
+                        pending[f] = ("mask", (table, i))
+                    continue
+
+                table, i = item
+                masked, mask_s = future.result()
+                entry = state[table]
+                entry[1].mask_s += mask_s
+                entry[2][i] = masked
+                entry[3] -= 1
+                if entry[3] == 0:
+                    df, timing, parts, _ = state.pop(table)
+                    masked_df = parts[0] if len(parts) == 1 else pd.concat(parts)
+                    start = time.perf_counter()
+                    write(table, df, masked_df)
+                    timing.write_s = time.perf_counter() - start
+    return timings
+
+
+def format_timings(timings):
+    """Per-table timing report as a printable table."""
+    lines = [f"{'table':<34}{'rows':>12}{'fetch s':>10}{'mask s':>10}{'write s':>10}"]
+    for t in timings:
+        lines.append(f"{t.table:<34}{t.rows:>12,}{t.fetch_s:>10.2f}{t.mask_s:>10.2f}{t.write_s:>10.2f}")
+    return "\n".join(lines)
@@ -0,0 +1,245 @@
+"""
+Pre-generated Faker value pools.
+
+Calling Faker's providers once per key dominates make_faker_map beyond a
+few hundred thousand patients. Instead, pools of first/last names,
+companies, phone numbers, addresses, catch phrases and words are generated
+once per (seed, size), cached as a compressed .npz file, and every fake
+field is picked from them with a vectorized index derived from a hash of
+the key. A million keys becomes a few array takes and string joins.
+
+Unique fields (patient_id, patient_record_number) are built from hash bits
+and de-duplicated in vectorized rounds, so they stay unique within a map.
+Columns are assembled as Arrow string arrays, the storage behind pandas'
+"str" dtype, so the lookup frame wraps them without converting.
+"""
+import os
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+
+from utils.masking import hash_key_for, keyed_hash
+
+POOL_SEED = 42
+POOL_SIZE = 1 << 14
+# make_faker_map switches from per-key Faker calls to pools at this many keys
+POOL_MIN_KEYS = 50_000
+DEFAULT_POOL_DIR = "faker_pools"
+
+
+
+def _ascii(chars):
+    return np.frombuffer(chars.encode("ascii"), dtype=np.uint8)
+
+
+_UPPER = _ascii("ABCDEFGHIJKLMNOPQRSTUVWXYZ")
+_DIGITS = _ascii("0123456789")
+_HEX = _ascii("0123456789abcdef")
+_DASH = _ascii("-")
+GENDERS = pa.array(["M", "F", "Other"])
+STATUSES = pa.array(["Scheduled", "Completed", "Cancelled", "No Show"])
+APPOINTMENT_TYPES = pa.array(["General Checkup", "Consultation", "Follow-up", "Urgent Care"])
+# ISO birth dates for adults (ages of about 18 to 90, like Faker's date_of_birth)
+DOB_STRINGS = pa.array(np.datetime_as_string(np.arange("1935-01-01", "2008-01-01", dtype="datetime64[D]")))
+
+# pool name -> Faker call producing one value
+POOL_GENERATORS = {
+    "first_name": lambda fake: fake.first_name(),
+    "last_name": lambda fake: fake.last_name(),
+    "company": lambda fake: fake.company(),
+    "phone": lambda fake: fake.phone_number(),
+    "address": lambda fake: fake.address().replace("\n", ", "),
+    "catch_phrase": lambda fake: fake.catch_phrase(),
+    "word": lambda fake: fake.word().capitalize(),
+}
+
+_pools = {}
+
+
+def build_pools(seed=POOL_SEED, size=POOL_SIZE, locale="en_US"):
+    """{pool name: fixed-width unicode array of `size` Faker values}."""
+    from faker import Faker
+
+    fake = Faker(locale)
+    fake.seed_instance(seed)
+    return {name: np.array([gen(fake) for _ in range(size)]) for name, gen in POOL_GENERATORS.items()}
+
+
+def pool_path(seed=POOL_SEED, size=POOL_SIZE, locale="en_US", pool_dir=None):
+    pool_dir = pool_dir or os.getenv("FAKER_POOL_DIR", DEFAULT_POOL_DIR)
+    return os.path.join(pool_dir, f"faker_pools_{locale}_{seed}_{size}.npz")
+
+
+def save_pools(pools, path):
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    tmp = f"{path}.tmp.npz"
+    np.savez_compressed(tmp, **pools)
+    os.replace(tmp, path)
+
+
+def load_pools(path):
+    with np.load(path) as data:
+        return {name: data[name] for name in data.files}
+
+
+def get_pools(seed=POOL_SEED, size=POOL_SIZE, locale="en_US", pool_dir=None):
+    """
+    Pools for (seed, size, locale): from this process's cache, else the .npz
+    under $FAKER_POOL_DIR, else built and saved there. The file pins the
+    values, so a Faker upgrade does not change fakes already handed out.
+    """
+    path = pool_path(seed, size, locale, pool_dir)
+    pools = _pools.get(path)
+    if pools is None:
+        if os.path.exists(path):
+            pools = load_pools(path)
+        else:
+            print(f"[INFO] Building Faker pools ({size:,} values each) -> {path}")
+            pools = build_pools(seed, size, locale)
+            save_pools(pools, path)
+        _pools[path] = pools
+    return pools
+
+
+def _mix(h, salt):
+    """splitmix64 finalizer of h ^ salt: an independent 64-bit stream per salt."""
+    with np.errstate(over="ignore"):
+        z = h ^ np.uint64((salt * 0x9E3779B97F4A7C15) & 0xFFFFFFFFFFFFFFFF)
+        z = (z ^ (z >> np.uint64(30))) * np.uint64(0xBF58476D1CE4E5B9)
+        z = (z ^ (z >> np.uint64(27))) * np.uint64(0x94D049BB133111EB)
+        return z ^ (z >> np.uint64(31))
+
+
+def _render(codes, alphabets):
+    """
+    Arrow string array with one fixed-width ASCII string per integer code,
+    the i-th character drawn from alphabets[i] by successive divisions
+    (mixed radix). The characters are written into one byte buffer that
+    Arrow uses as is.
+    """
+    width = len(alphabets)
+    data = np.empty((len(codes), width), dtype=np.uint8)
+    for i in range(width - 1, -1, -1):
+        base = np.uint64(len(alphabets[i]))
+        data[:, i] = alphabets[i][(codes % base).astype(np.intp)]
+        codes = codes // base
+    offsets = np.arange(0, (len(codes) + 1) * width, width, dtype=np.int32)
+    return pa.Array.from_buffers(pa.string(), len(codes), [None, pa.py_buffer(offsets), pa.py_buffer(data)])
+
+
+def _space(alphabets):
+    return int(np.prod([len(a) for a in alphabets], dtype=object))
+
+
+def _unique_codes(h, space, salt, max_rounds=64):
+    """
+    Codes in [0, space) from hashes, re-drawn for duplicates until all are
+    unique. Of the keys sharing a code the one with the smallest hash keeps
+    it, so a key's code does not depend on the order of the batch.
+    """
+    if space < len(h):
+        raise ValueError(f"Cannot draw {len(h):,} unique values from {space:,}")
+    order = np.argsort(h, kind="stable")
+    h = h[order]
+    codes = _mix(h, salt) % np.uint64(space)
+    for round_ in range(1, max_rounds + 1):
+        dup = pd.Series(codes).duplicated(keep="first").to_numpy()
+        if not dup.any():
+            out = np.empty_like(codes)
+            out[order] = codes
+            return out
+        codes[dup] = _mix(h[dup], salt + 1000 * round_) % np.uint64(space)
+    raise RuntimeError("Could not draw unique pooled ids")
+
+
+class _Streams:
+    """Independent uint64 hash streams per field for one array of key hashes."""
+
+    def __init__(self, h, start=0):
+        self.h = h
+        self.n = start
+
+    def next(self):
+        self.n += 1
+        return _mix(self.h, self.n)
+
+    def pick(self, pool):
+        """One value of the Arrow array `pool` per key."""
+        return pool.take((self.next() % np.uint64(len(pool))).astype(np.int64))
+
+
+def _join(*parts, sep=""):
+    return pc.binary_join_element_wise(*parts, sep)
+
+
+PATIENT_ID_LAYOUT = [_UPPER] * 3 + [_DIGITS] * 3 + [_UPPER] * 3 + [_DIGITS] * 2
+RECORD_NUMBER_LAYOUT = [_DIGITS] * 3 + [_DASH] + [_DIGITS] * 4
+# 8-4-4-4-12 hex digits with the version nibble fixed to 4; 15 digits from
+# the first stream and 16 from the second
+GUID_LAYOUT = ([_HEX] * 8 + [_DASH] + [_HEX] * 4 + [_DASH] + [_ascii("4")] + [_HEX] * 3 + [_DASH]
+               + [_HEX] * 4 + [_DASH] + [_HEX] * 12)
+FACILITY_LAYOUT = [_ascii("F"), _ascii("A"), _ascii("C"), _DASH] + [_UPPER] * 3
+
+
+def pool_map(keys, pools, seed=POOL_SEED, secret=None):
+    """
+    Lookup frame (index = key, one column per fake field, the same fields as
+    KeyedPseudonymizer.record) with every value picked from `pools` by a
+    hash of the key. `seed` (or `secret`) salts the hash.
+
+    Columns are built as Arrow arrays (takes from the pools, element-wise
+    joins, ids rendered straight into string buffers) and wrapped as
+    pandas "str" columns without another copy.
+    """
+    keys = pd.Index(pd.unique(pd.Series(list(keys), dtype=object)))
+    h = keyed_hash(keys.to_series(), hash_key_for(secret if secret else f"pools:{seed}"))
+    pools = {name: pa.array(values) for name, values in pools.items()}
+    s = _Streams(h, start=2)
+
+    patient_id = _render(_unique_codes(h, _space(PATIENT_ID_LAYOUT), 1), PATIENT_ID_LAYOUT)
+    record_number = _render(_unique_codes(h, _space(RECORD_NUMBER_LAYOUT), 2), RECORD_NUMBER_LAYOUT)
+    first = s.pick(pools["first_name"])
+    last = s.pick(pools["last_name"])
+    provider = _join(s.pick(pools["first_name"]), s.pick(pools["last_name"]), sep=" ")
+    practitioner_first = s.pick(pools["first_name"])
+    practitioner = _join(practitioner_first, s.pick(pools["last_name"]), sep=" ")
+    dob = s.pick(DOB_STRINGS)
+    appointment_type = s.pick(APPOINTMENT_TYPES)
+    practice_guid = _join(_render(s.next(), GUID_LAYOUT[:19]), _render(s.next(), GUID_LAYOUT[19:]))
+
+    columns = {
+        "fake_id": patient_id,
+        "practice_guid": practice_guid,
+        "patient_id": patient_id,
+        "patient_record_number": record_number,
+        "first_name": first,
+        "last_name": last,
+        "dob": dob,
+        "patient_name": _join(first, last, sep=" "),
+        "patient_date_of_birth_date_time": dob,
+        "status": s.pick(STATUSES),
+        "appointment_type": appointment_type,
+        "appointment_type_name": appointment_type,
+        "provider_name": _join("Dr.", provider, sep=" "),
+        "facility_guid": _render(s.next(), FACILITY_LAYOUT),
+        "facility_name": _join(s.pick(pools["company"]), "Medical Center", sep=" "),
+        "practitioner": _join("Practitioner", practitioner_first, sep=" "),
+        "Practitioner__c": practitioner,
+        "patient_home_phone": s.pick(pools["phone"]),
+        "gender": s.pick(GENDERS),
+        "address": s.pick(pools["address"]),
+        "diagnosis": s.pick(pools["catch_phrase"]),
+        "drug_name": s.pick(pools["word"]),
+        "generic_name": s.pick(pools["word"]),
+    }
+    return pd.DataFrame({name: pd.array(values, dtype="str") for name, values in columns.items()},
+                        index=keys, copy=False)
+
+
+def as_fake_map(fakes):
+    """{key: {field: value}} for a lookup frame (a dict passes through)."""
+    if isinstance(fakes, pd.DataFrame):
+        return fakes.to_dict("index")
+    return fakes
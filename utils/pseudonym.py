@@ -0,0 +1,206 @@
+"""
+Stateless keyed pseudonyms.
+
+Every fake value is derived from HMAC-SHA256(secret, field + real key), so any
+process holding the secret computes the same fakes for a patient without a
+precomputed map, in constant memory, on every run and machine. Names, words
+and address parts are picked from fixed tables (Faker's en_US lists), dates
+from a fixed day range.
+
+Fields that must never collide (patient_id, patient_record_number) are not
+drawn from a table: they are a keyed format-preserving permutation of the
+real value, i.e. digits stay digits, letters stay letters, separators stay
+put, and two different real values can never get the same fake.
+"""
+import hashlib
+import hmac
+import os
+import uuid
+from datetime import date, timedelta
+
+from faker.providers.address.en_US import Provider as _Address
+from faker.providers.company.en_US import Provider as _Company
+from faker.providers.lorem.en_US import Provider as _Lorem
+from faker.providers.person.en_US import Provider as _Person
+
+FIRST_NAMES = tuple(_Person.first_names)
+LAST_NAMES = tuple(_Person.last_names)
+COMPANY_SUFFIXES = tuple(_Company.company_suffixes)
+CATCH_PHRASE_WORDS = tuple(tuple(words) for words in _Company.catch_phrase_words)
+WORDS = tuple(_Lorem.word_list)
+STREET_SUFFIXES = tuple(_Address.street_suffixes)
+CITY_PREFIXES = tuple(_Address.city_prefixes)
+CITY_SUFFIXES = tuple(_Address.city_suffixes)
+STATES = tuple(_Address.states_abbr)
+GENDERS = ("M", "F", "Other")
+STATUSES = ("Scheduled", "Completed", "Cancelled", "No Show")
+APPOINTMENT_TYPES = ("General Checkup", "Consultation", "Follow-up", "Urgent Care")
+
+# Ages 18-90 relative to a fixed anchor, so dates don't drift between runs
+DOB_START = date(1935, 1, 1)
+DOB_END = date(2007, 12, 31)
+
+_DIGITS = "0123456789"
+_UPPER = "ABCDEFGHIJKLMNOPQRSTUVWXYZ"
+_LOWER = "abcdefghijklmnopqrstuvwxyz"
+_FEISTEL_ROUNDS = 6
+
+
+def _alphabet(ch):
+    if ch in _DIGITS:
+        return _DIGITS
+    if ch in _UPPER:
+        return _UPPER
+    if ch in _LOWER:
+        return _LOWER
+    return None
+
+
+class KeyedPseudonymizer:
+    def __init__(self, secret, dob_start=DOB_START, dob_end=DOB_END):
+        if secret is None or secret == "":
+            raise ValueError("KeyedPseudonymizer needs a non-empty secret")
+        if not isinstance(secret, bytes):
+            secret = str(secret).encode("utf-8")
+        self._mac = hmac.new(secret, digestmod=hashlib.sha256)
+        self._dob_start = dob_start
+        self._dob_days = (dob_end - dob_start).days + 1
+
+    def digest(self, field, key):
+        """HMAC-SHA256 of `key`, domain-separated by `field`, as bytes."""
+        mac = self._mac.copy()
+        mac.update(f"{field}\x00{key}".encode("utf-8"))
+        return mac.digest()
+
+    def number(self, field, key):
+        """Keyed 64-bit integer for (field, key)."""
+        return int.from_bytes(self.digest(field, key)[:8], "big")
+
+    def choose(self, field, key, table):
+        return table[self.number(field, key) % len(table)]
+
+    def digits(self, field, key, n):
+        return str(int.from_bytes(self.digest(field, key), "big") % (10 ** n)).zfill(n)
+
+    def date(self, field, key, fmt="%Y-%m-%d"):
+        offset = self.number(field, key) % self._dob_days
+        return (self._dob_start + timedelta(days=offset)).strftime(fmt)
+
+    def permute(self, value, tweak=""):
+        """
+        Keyed format-preserving permutation of `value`.
+        A bijection on all strings with the same digit/letter layout, so
+        distinct inputs always give distinct outputs.
+        """
+        value = str(value)
+        alphabets = [_alphabet(ch) for ch in value]
+        slots = [(i, a) for i, a in enumerate(alphabets) if a]
+        if not slots:
+            return value
+
+        n = 0
+        size = 1
+        for i, a in slots:
+            n = n * len(a) + a.index(value[i])
+            size *= len(a)
+
+        layout = "".join("9" if a is _DIGITS else "A" if a is _UPPER else "a" if a is _LOWER else ch
+                         for ch, a in zip(value, alphabets))
+        n = self._permute_int(n, size, f"{tweak}:{layout}")
+
+        out = list(value)
+        for i, a in reversed(slots):
+            n, r = divmod(n, len(a))
+            out[i] = a[r]
+        return "".join(out)
+
+    def _permute_int(self, n, size, tweak):
+        """Balanced Feistel network on [0, 4**k) with cycle walking into [0, size)."""
+        if size <= 1:
+            return n
+        half_bits = max(1, ((size - 1).bit_length() + 1) // 2)
+        mask = (1 << half_bits) - 1
+        while True:
+            left, right = n >> half_bits, n & mask
+            for rnd in range(_FEISTEL_ROUNDS):
+                f = self.number(f"fpe:{tweak}:{rnd}", right) & mask
+                left, right = right, left ^ f
+            n = (left << half_bits) | right
+            if n < size:
+                return n
+
+    def record(self, key, patient_id=None, patient_record_number=None, attempt=0):
+        """
+        All fake fields for one real key. Has the fields of both
+        utils.faker_map.make_faker_map and mock_salesforcesql.make_faker_map.
+        `patient_id`/`patient_record_number` are the real values to permute;
+        when omitted the key itself is permuted. A non-zero `attempt` tweaks
+        both permutations, for regenerating values that clash in a vault.
+        """
+        tweak = f":{attempt}" if attempt else ""
+        fake_patient_id = self.permute(key if patient_id is None else patient_id, "patient_id" + tweak)
+        record_number = self.permute(
+            key if patient_record_number is None else patient_record_number, "patient_record_number" + tweak
+        )
+        first = self.choose("first_name", key, FIRST_NAMES)
+        last = self.choose("last_name", key, LAST_NAMES)
+        facility_name = (
+            f"{self.choose('company', key, LAST_NAMES)} "
+            f"{self.choose('company_suffix', key, COMPANY_SUFFIXES)} Medical Center"
+        )
+        provider_name = f"{self.choose('provider_first', key, FIRST_NAMES)} {self.choose('provider_last', key, LAST_NAMES)}"
+        practitioner = f"{self.choose('practitioner_first', key, FIRST_NAMES)} {self.choose('practitioner_last', key, LAST_NAMES)}"
+        dob = self.date("dob", key)
+        phone = self.digits("phone", key, 10)
+        city = f"{self.choose('city_prefix', key, CITY_PREFIXES)} {self.choose('city', key, LAST_NAMES)}{self.choose('city_suffix', key, CITY_SUFFIXES)}"
+        address = (
+            f"{int(self.digits('street_number', key, 4)) + 1} {self.choose('street', key, LAST_NAMES)} "
+            f"{self.choose('street_suffix', key, STREET_SUFFIXES)}, {city}, "
+            f"{self.choose('state', key, STATES)} {self.digits('zip', key, 5)}"
+        )
+        appointment_type = self.choose("appointment_type", key, APPOINTMENT_TYPES)
+        return {
+            "fake_id": fake_patient_id,
+            "practice_guid": str(uuid.UUID(bytes=self.digest("practice_guid", key)[:16], version=4)),
+            "patient_id": fake_patient_id,
+            "patient_record_number": record_number,
+            "first_name": first,
+            "last_name": last,
+            "dob": dob,
+            "patient_name": f"{first} {last}",
+            "patient_date_of_birth_date_time": dob,
+            "status": self.choose("status", key, STATUSES),
+            "appointment_type": appointment_type,
+            "appointment_type_name": appointment_type,
+            "provider_name": "Dr. " + provider_name,
+            "facility_guid": "FAC-" + "".join(self.choose(f"facility_guid_{i}", key, _UPPER) for i in range(3)),
+            "facility_name": facility_name,
+            "practitioner": "Practitioner " + practitioner.split()[0],
+            "Practitioner__c": practitioner,
+            "patient_home_phone": f"({phone[:3]}) {phone[3:6]}-{phone[6:]}",
+            "gender": self.choose("gender", key, GENDERS),
+            "address": address,
+            "diagnosis": " ".join(
+                self.choose(f"diagnosis_{i}", key, words) for i, words in enumerate(CATCH_PHRASE_WORDS)
+            ).capitalize(),
+            "drug_name": self.choose("drug_name", key, WORDS).capitalize(),
+            "generic_name": self.choose("generic_name", key, WORDS).capitalize(),
+        }
+
+    def make_faker_map(self, keys, patient_ids=None, record_numbers=None, attempt=0):
+        """
+        Drop-in for make_faker_map. `patient_ids`/`record_numbers` optionally
+        map each key to its real Patient_ID__c / Patient_Record_Number__c;
+        `attempt` is passed on to record().
+        """
+        patient_ids = patient_ids or {}
+        record_numbers = record_numbers or {}
+        return {
+            k: self.record(k, patient_ids.get(k), record_numbers.get(k), attempt)
+            for k in keys
+        }
+
+
+def get_pseudonymizer(secret=None):
+    """Pseudonymizer keyed by `secret`, or by the MASKING_SECRET env variable."""
+    return KeyedPseudonymizer(secret if secret is not None else os.getenv("MASKING_SECRET"))
@@ -0,0 +1,320 @@
+"""
+Declarative masking rules.
+
+config/masking_rules.yaml maps every table and column to a strategy
+(preserve, pseudonymize, hash, date_shift, redact, generalize, scrub). load_plan
+compiles it once into a TablePlan per table: each rule becomes a vectorized
+operation, and the steps for a given set of columns are resolved once and
+reused for every chunk with those columns. Masking a frame is then a single
+mask_rows pass, and a new table only needs an entry in the YAML.
+"""
+import os
+import string
+from dataclasses import dataclass, field
+from functools import lru_cache
+
+import numpy as np
+import pandas as pd
+import yaml
+
+from utils.dates import DEFAULT_MAX_AGE, DEFAULT_SHIFT_DAYS, shift_column
+from utils.compact import as_text
+from utils.masking import build_lookup, hash_key_for, keyed_hash, mask_rows
+from utils.scrub import DEFAULT_MIN_LENGTH, scrubber_for, source_fields
+
+REDACTED = "MASKED"
+DEFAULT_HASH_LENGTH = 16
+
+_warned_no_sources = False
+_warned_unkeyed = False
+
+
+def default_rules_path():
+    this_dir = os.path.dirname(os.path.abspath(__file__))
+    return os.path.normpath(os.path.join(this_dir, '..', 'config', 'masking_rules.yaml'))
+
+
+# --- pseudonymize value specs -------------------------------------------
+
+def _template_fields(template):
+    return [name for _, name, _, _ in string.Formatter().parse(template) if name]
+
+
+def _render(template, lookup):
+    """Fill a "{field} text" template column-wise from the lookup."""
+    out = None
+    for literal, name, _, _ in string.Formatter().parse(template):
+        parts = [literal] if literal else []
+        if name:
+            parts.append(as_text(lookup[name]) if name in lookup.columns
+                         else pd.Series(np.nan, index=lookup.index, dtype=object))
+        for part in parts:
+            out = part if out is None else out + part
+    return out if isinstance(out, pd.Series) else pd.Series(out or "", index=lookup.index)
+
+
+def _compile_value(spec):
+    """
+    A pseudonymize spec -> fn(lookup) returning one value per lookup key.
+    Specs are a literal, a "{template}", or a mapping with field/template
+    plus remove/max_length/upper/fallback.
+    """
+    if not isinstance(spec, dict):
+        spec = {"template": spec} if isinstance(spec, str) and _template_fields(spec) else {"literal": spec}
+    fallback = _compile_value(spec["fallback"]) if "fallback" in spec else None
+    remove, max_length, upper = spec.get("remove"), spec.get("max_length"), spec.get("upper", False)
+
+    def value(lookup):
+        if "literal" in spec:
+            return pd.Series(spec["literal"], index=lookup.index)
+        if "field" in spec:
+            name = spec["field"]
+            out = lookup[name] if name in lookup.columns else pd.Series(np.nan, index=lookup.index, dtype=object)
+        else:
+            out = _render(spec["template"], lookup)
+        if remove or upper or max_length:
+            out = as_text(out)
+        if remove:
+            out = out.str.replace(remove, "", regex=False)
+        if upper:
+            out = out.str.upper()
+        if max_length:
+            out = out.str[:max_length]
+        if fallback is not None:
+            missing = out.isna() | (out == "")
+            if missing.any():
+                out = as_text(out).where(~missing, as_text(fallback(lookup)))
+        return out
+
+    return value
+
+
+# --- strategies ----------------------------------------------------------
+# Each compiler takes the rule's options and returns op(ctx) -> (kind, value):
+#   ("lookup", Series aligned with the lookup), ("row", Series aligned with
+#   the frame) or ("scalar", value); None leaves the column alone.
+
+@dataclass
+class _Context:
+    df: pd.DataFrame
+    column: str
+    lookup: pd.DataFrame
+    keys: pd.Series
+    hash_key: str
+
+
+def _preserve(options):
+    return None
+
+
+def _pseudonymize(options):
+    value = _compile_value(options)
+    return lambda ctx: ("lookup", value(ctx.lookup))
+
+
+def _redact(options):
+    constant = options.get("value", REDACTED)
+    return lambda ctx: ("scalar", constant)
+
+
+def _hash(options):
+    length = options.get("length", DEFAULT_HASH_LENGTH)
+
+    def op(ctx):
+        if not ctx.hash_key:
+            raise ValueError(f"Column {ctx.column!r} is hashed, which needs MASKING_SECRET")
+        values = ctx.df[ctx.column]
+        present = values.notna().to_numpy()
+        out = pd.Series(np.nan, index=values.index, dtype=object)
+        if present.any():
+            hashed = np.char.mod("%016x", keyed_hash(values[present], ctx.hash_key))
+            out[present] = hashed.astype(object)
+            if length < 16:
+                out[present] = out[present].str[:length]
+        return "row", out
+
+    return op
+
+
+def _date_shift(options):
+    max_days = options.get("max_days", DEFAULT_SHIFT_DAYS)
+    fmt = options.get("format")
+    max_age = options.get("max_age")
+    if max_age is True:
+        max_age = DEFAULT_MAX_AGE
+    # without a secret the offset could be recomputed from the kept key, so
+    # birth dates get the fake map's dob and other dates are redacted
+    unkeyed = options.get("unkeyed", "dob" if max_age else None)
+    fallback = _compile_value({"field": unkeyed}) if unkeyed else None
+
+    def op(ctx):
+        global _warned_unkeyed
+        if not ctx.hash_key:
+            if not _warned_unkeyed:
+                print("[WARN] MASKING_SECRET is not set: date_shift columns get fake or redacted dates")
+                _warned_unkeyed = True
+            return ("lookup", fallback(ctx.lookup)) if fallback else ("scalar", REDACTED)
+        shifted = shift_column(ctx.df[ctx.column], ctx.keys, ctx.hash_key, max_days, max_age=max_age, fmt=fmt)
+        return "row", shifted
+
+    return op
+
+
+def _generalize(options):
+    to = options.get("to", "year")
+    if to not in ("year", "month", "decade", "zip3"):
+        raise ValueError(f"Unknown generalize target {to!r}")
+
+    def op(ctx):
+        values = ctx.df[ctx.column]
+        if to == "zip3":
+            digits = values.astype(str).str.extract(r"^(\d{3})", expand=False)
+            return "row", (digits + "**").astype(object)
+        dates = pd.to_datetime(values, errors="coerce", format="mixed")
+        if to == "year":
+            out = dates.dt.strftime("%Y")
+        elif to == "month":
+            out = dates.dt.strftime("%Y-%m")
+        else:
+            out = (dates.dt.year // 10 * 10).astype("Int64").astype(str) + "s"
+            out = out.where(dates.notna())
+        return "row", out.astype(object)
+
+    return op
+
+
+def _scrub(options):
+    fields = options.get("fields")
+    min_length = options.get("min_length", DEFAULT_MIN_LENGTH)
+
+    def op(ctx):
+        global _warned_no_sources
+        if not source_fields(ctx.lookup):
+            # nothing to look for: redact rather than pass real identifiers through
+            if not _warned_no_sources:
+                print("[WARN] scrub needs real identifiers (utils.scrub.attach_sources); redacting instead")
+                _warned_no_sources = True
+            return "scalar", REDACTED
+        scrubber = scrubber_for(ctx.lookup, ctx.hash_key, fields, min_length)
+        return "row", scrubber.scrub_column(ctx.df[ctx.column], ctx.lookup.index.get_indexer(ctx.keys))
+
+    return op
+
+
+STRATEGIES = {
+    "preserve": _preserve,
+    "pseudonymize": _pseudonymize,
+    "hash": _hash,
+    "date_shift": _date_shift,
+    "redact": _redact,
+    "generalize": _generalize,
+    "scrub": _scrub,
+}
+
+
+def compile_rule(rule):
+    """A rule (strategy name or mapping with `strategy`) -> (name, op or None)."""
+    options = {"strategy": rule} if isinstance(rule, str) else dict(rule)
+    name = options.pop("strategy")
+    if name not in STRATEGIES:
+        raise ValueError(f"Unknown masking strategy {name!r}; expected one of {sorted(STRATEGIES)}")
+    return name, STRATEGIES[name](options)
+
+
+# --- plans ---------------------------------------------------------------
+
+@dataclass
+class TablePlan:
+    name: str
+    key: str
+    columns: dict = field(default_factory=dict)  # column -> (strategy, op)
+    default: tuple = None
+    match_fake_fields: bool = False
+    source: str = None
+    primary_key: list = None
+    updated_at: str = None
+    partition_by: str = None
+    hash_key: str = None
+
+    def __post_init__(self):
+        self._steps = {}
+
+    def steps_for(self, columns, fake_fields):
+        """[(column, op)] for a frame with `columns`, resolved once per column set."""
+        cache_key = (tuple(columns), tuple(fake_fields) if self.match_fake_fields else ())
+        steps = self._steps.get(cache_key)
+        if steps is None:
+            steps = []
+            fake_fields = set(fake_fields)
+            for col in columns:
+                if col in self.columns:
+                    op = self.columns[col][1]
+                elif self.match_fake_fields and col in fake_fields:
+                    op = STRATEGIES["pseudonymize"]({"field": col})
+                else:
+                    op = self.default[1]
+                if op is not None:
+                    steps.append((col, op))
+            # listed columns missing from the frame are added when they come from the fake map
+            for col, (strategy, op) in self.columns.items():
+                if col not in columns and strategy in ("pseudonymize", "redact"):
+                    steps.append((col, op))
+            self._steps[cache_key] = steps
+        return steps
+
+    def apply(self, df, fake_map):
+        """Mask `df` in one pass; rows whose key is not in `fake_map` are left untouched."""
+        if self.key not in df.columns:
+            return df
+        lookup = build_lookup(fake_map)
+        keys = df[self.key].copy()
+        values, rows = {}, {}
+        for col, op in self.steps_for(list(df.columns), list(lookup.columns)):
+            kind, value = op(_Context(df, col, lookup, keys, self.hash_key))
+            if kind == "row":
+                rows[col] = value
+            else:
+                values[col] = value
+        return mask_rows(df, keys, lookup, values, rows=rows)
+
+
+def compile_table(name, spec, hash_key=None):
+    return TablePlan(
+        name=name,
+        key=spec["key"],
+        columns={col: compile_rule(rule) for col, rule in (spec.get("columns") or {}).items()},
+        default=compile_rule(spec.get("default", "redact")),
+        match_fake_fields=spec.get("match_fake_fields", False),
+        source=spec.get("source"),
+        primary_key=spec.get("primary_key"),
+        updated_at=spec.get("updated_at"),
+        partition_by=spec.get("partition_by"),
+        hash_key=hash_key,
+    )
+
+
+def compile_rules(rules, secret=None):
+    """{table: TablePlan} for a parsed rules document."""
+    hash_key = hash_key_for(secret)
+    return {name: compile_table(name, spec, hash_key) for name, spec in rules["tables"].items()}
+
+
+@lru_cache(maxsize=None)
+def _load_plan(path, mtime, secret):
+    with open(path, "r", encoding="utf-8") as f:
+        return compile_rules(yaml.safe_load(f), secret)
+
+
+def load_plan(path=None, secret=None):
+    """
+    Compiled plans from the rules YAML, cached per file version and secret.
+    `secret` defaults to $MASKING_SECRET.
+    """
+    path = os.path.abspath(path or default_rules_path())
+    secret = secret if secret is not None else os.getenv("MASKING_SECRET")
+    return _load_plan(path, os.stat(path).st_mtime_ns, secret)
+
+
+def mask_with_rules(df, fake_map, table, secret=None, rules_path=None):
+    """Mask `df` with the plan for `table`. Module level, so it can run in worker processes."""
+    return load_plan(rules_path, secret)[table].apply(df, fake_map)
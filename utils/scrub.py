@@ -0,0 +1,194 @@
+"""
+Free-text PHI scrubbing.
+
+Redacting a free-text column destroys the clinical text in it; keeping it
+leaks whatever identifiers were typed into it. The `scrub` strategy
+(utils/rules.py) keeps the text and replaces the real identifiers of every
+patient in the fake map (first and last names, patient ids, MRNs, birth
+dates, phone numbers) with that patient's pseudonyms.
+
+The real values come from the source records the fake map was built for,
+attached to the lookup as "source:<field>" columns:
+
+    lookup = attach_sources(build_lookup(fake_map), sf_patients)
+
+and are compiled once per lookup into a PhiScrubber: a dict from every
+real value (lowercased, plus the other spellings of dates and phone
+numbers) to its replacement, and one compiled regex that cuts text into
+candidate tokens. Each token costs one hash lookup whatever the number of
+patients, and each distinct text is scanned once. Only texts with a hit
+are rewritten, row by row, so a name shared by several patients becomes
+the fake of the row's own patient when it is theirs.
+"""
+import re
+import weakref
+
+import numpy as np
+import pandas as pd
+
+from utils.compact import as_text
+from utils.dates import DEFAULT_MAX_AGE, DEFAULT_SHIFT_DAYS, shift_column
+
+SOURCE_PREFIX = "source:"
+# fake-map field -> Salesforce Patient__c column holding the real value
+SOURCE_FIELDS = {
+    "first_name": "First_Name__c",
+    "last_name": "Last_Name__c",
+    "patient_id": "Patient_ID__c",
+    "patient_record_number": "Patient_Record_Number__c",
+    "dob": "DOB__c",
+}
+DEFAULT_MIN_LENGTH = 2
+# words, and runs of them joined by - or / (dates, MRNs, hyphenated names)
+TOKEN = r"\w+(?:[-/]\w+)*"
+
+_scrubbers = {}
+
+
+def attach_sources(lookup, records, key="Id", fields=None):
+    """
+    `lookup` with the real identifiers of each key from `records` (a frame
+    with a `key` column) as "source:<field>" columns, for the scrub
+    strategy. `fields` maps fake fields to columns of `records` (default
+    SOURCE_FIELDS; add e.g. {"patient_home_phone": <phone column>} where
+    real phone numbers are available); columns missing from `records` are
+    skipped. Call it again to add fields from other records.
+    """
+    fields = SOURCE_FIELDS if fields is None else fields
+    records = records.drop_duplicates(key).set_index(key)
+    lookup = lookup.copy()
+    for field, column in fields.items():
+        if column in records.columns:
+            lookup[f"{SOURCE_PREFIX}{field}"] = as_text(records[column]).reindex(lookup.index)
+    return lookup
+
+
+def source_fields(lookup):
+    return [c[len(SOURCE_PREFIX):] for c in lookup.columns if c.startswith(SOURCE_PREFIX)]
+
+
+def _date_variants(real, fake):
+    """ISO, MM/DD/YYYY and M/D/YYYY spellings of real dates and of their replacements."""
+    def spellings(values):
+        dates = pd.to_datetime(values, errors="coerce", format="mixed").to_numpy().astype("datetime64[D]")
+        iso = pd.Series(np.datetime_as_string(dates), index=values.index).where(~np.isnat(dates))
+        us = iso.str[5:7] + "/" + iso.str[8:10] + "/" + iso.str[:4]
+        return iso, us, us.str.replace(r"(^|/)0", r"\1", regex=True)
+
+    return list(zip(spellings(real), spellings(fake)))
+
+
+def _phone_variants(real, fake):
+    """Phones as stored and as bare digits."""
+    digits = lambda s: s.str.replace(r"\D", "", regex=True)
+    return [(real, fake), (digits(real), digits(fake))]
+
+
+class PhiScrubber:
+    """
+    Replaces real identifiers in text. `pairs` is a list of (field, real,
+    fake): arrays aligned with the lookup's keys, so position i is one
+    patient. Earlier pairs win when a value belongs to several fields.
+    """
+
+    def __init__(self, pairs, min_length=DEFAULT_MIN_LENGTH):
+        self.fields = []
+        for field, real, fake in pairs:
+            real = pd.Series(real).astype("str").str.lower()
+            fake = pd.Series(fake).astype("str")
+            usable = (real.str.len() >= min_length).fillna(False).to_numpy(dtype=bool) & fake.notna().to_numpy()
+            self.fields.append((field, np.where(usable, real.to_numpy(dtype=object), None),
+                                fake.to_numpy(dtype=object)))
+        # later updates win: fill backwards so the first field and patient with a value keep it
+        self.index = {}
+        for fi in reversed(range(len(self.fields))):
+            real = self.fields[fi][1]
+            positions = np.flatnonzero(real != None)[::-1]  # noqa: E711 (elementwise)
+            self.index.update(zip(real[positions], ((fi, pos) for pos in positions)))
+        # values spanning several tokens (O'Brien, Mary Ann, (555) 123-4567) are matched whole, longest first
+        token = re.compile(TOKEN)
+        phrases = sorted((v for v in self.index if not token.fullmatch(v)), key=len, reverse=True)
+        alternatives = [rf"(?<!\w){re.escape(p)}(?!\w)" for p in phrases]
+        self.pattern = re.compile("|".join(alternatives + [TOKEN]), re.IGNORECASE)
+
+    def __len__(self):
+        return len(self.index)
+
+    def replacement(self, match, own=-1):
+        """The fake for `match` (any case): the row's own patient's if it is theirs, else the first owner's."""
+        if own >= 0:
+            for field, real, fake in self.fields:
+                if real[own] == match:
+                    return fake[own]
+        fi, pos = self.index[match]
+        return self.fields[fi][2][pos]
+
+    def has_phi(self, text):
+        return not self.index.keys().isdisjoint(self.pattern.findall(text.lower()))
+
+    def scrub(self, text, own=-1):
+        """`text` with every known identifier replaced; `own` is the row's patient position in the lookup."""
+        def sub(m):
+            value = m.group(0).lower()
+            return self.replacement(value, own) if value in self.index else m.group(0)
+
+        return self.pattern.sub(sub, text)
+
+    def scrub_column(self, values, own):
+        """
+        Scrub a text column; `own` gives each row's patient position (-1
+        for none). Each distinct text is checked once; only rows whose text
+        has a hit are rewritten.
+        """
+        text = as_text(values)
+        codes, uniques = pd.factorize(text)
+        if not len(uniques):
+            return text
+        dirty = np.array([self.has_phi(u) for u in uniques], dtype=bool)
+        rows = np.flatnonzero((codes >= 0) & dirty[np.where(codes >= 0, codes, 0)])
+        out = text.astype(object)
+        if len(rows):
+            raw = uniques.to_numpy(dtype=object)
+            out.iloc[rows] = [self.scrub(raw[codes[i]], own[i]) for i in rows]
+        return out
+
+
+def build_scrubber(lookup, hash_key=None, fields=None, min_length=DEFAULT_MIN_LENGTH):
+    """
+    PhiScrubber for the "source:" columns of `lookup`. Birth dates get the
+    same keyed shift (and age cap) as date_shift columns (the fake dob
+    without a `hash_key`); other fields get the lookup's fake for that field.
+    """
+    pairs = []
+    for field in fields or source_fields(lookup):
+        column = f"{SOURCE_PREFIX}{field}"
+        if column not in lookup.columns:
+            continue
+        real = as_text(lookup[column])
+        if field == "dob" and hash_key is None:
+            # an unkeyed shift could be undone: use the fake dob, as date_shift does
+            if "dob" in lookup.columns:
+                pairs += [(field, r, f) for r, f in _date_variants(real, as_text(lookup["dob"]))]
+            continue
+        if field == "dob":
+            fake = shift_column(real, pd.Series(lookup.index), hash_key, DEFAULT_SHIFT_DAYS,
+                                max_age=DEFAULT_MAX_AGE).set_axis(lookup.index)
+            pairs += [(field, r, f) for r, f in _date_variants(real, fake)]
+        elif field not in lookup.columns:
+            continue
+        elif "phone" in field:
+            pairs += [(field, r, f) for r, f in _phone_variants(real, as_text(lookup[field]))]
+        else:
+            pairs.append((field, real, as_text(lookup[field])))
+    return PhiScrubber(pairs, min_length)
+
+
+def scrubber_for(lookup, hash_key=None, fields=None, min_length=DEFAULT_MIN_LENGTH):
+    """build_scrubber, once per lookup object (every chunk masked against it reuses the scrubber)."""
+    cache_key = (id(lookup), hash_key, tuple(fields or ()), min_length)
+    cached = _scrubbers.get(cache_key)
+    if cached is not None and cached[0]() is lookup:
+        return cached[1]
+    scrubber = build_scrubber(lookup, hash_key, fields, min_length)
+    _scrubbers[cache_key] = (weakref.ref(lookup, lambda _: _scrubbers.pop(cache_key, None)), scrubber)
+    return scrubber
@@ -0,0 +1,290 @@
+"""
+Sharded, resumable masking jobs.
+
+The patient ID set is split into `n_shards` shards by a stable hash of
+the Id, and every shard is masked on its own: its Salesforce rows, its
+MySQL rows, its own output files. A job directory on a filesystem shared
+by every host keeps the state:
+
+    job.json              shard count and parameters; written once by prepare()
+    <inputs>              whatever prepare's build step saved (the Salesforce
+                          rows and the fake map), so a restart skips the query
+    shards/0003.lock      claim on shard 3 by a running host (mtime = heartbeat)
+    shards/0003.json      shard 3 finished: output files and row counts
+    manifest.json         every finished shard, rebuilt after each completion
+
+A restarted or additional host claims only shards without a .json, so a
+failed run resumes where it stopped and several hosts drain one job:
+
+    job = ShardJob("/shared/jobs/2024-06-01", n_shards=16)
+    job.prepare(lambda: save_inputs(job.path("patients.csv")), params={"format": "csv"})
+    job.run(lambda shard: mask_shard(shard))   # -> {"outputs": [...], "rows": {...}}
+
+Claims are lock files created with O_EXCL, kept fresh by a heartbeat
+thread while a shard (or prepare's build) runs. A host that dies leaves
+its lock behind; once its heartbeat is older than `lease_s` another host
+takes it over by renaming the stale lock away, which only one host can do.
+
+    python -m utils.shards status --job-dir /shared/jobs/2024-06-01
+"""
+import argparse
+import hashlib
+import json
+import os
+import socket
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+
+import numpy as np
+
+DEFAULT_LEASE_S = 15 * 60
+JOB_FILE = "job.json"
+MANIFEST_FILE = "manifest.json"
+
+
+def shard_of(keys, n_shards):
+    """Shard number per key: blake2b of the key text, so every host and Python version agrees."""
+    return np.fromiter(
+        (int.from_bytes(hashlib.blake2b(str(k).encode("utf-8"), digest_size=8).digest(), "big") % n_shards
+         for k in keys),
+        dtype=np.int64,
+    )
+
+
+def shard_keys(keys, shard, n_shards):
+    """The keys (in their order) that fall in `shard`."""
+    keys = list(keys)
+    return [k for k, s in zip(keys, shard_of(keys, n_shards)) if s == shard]
+
+
+def _write_json(path, data):
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(data, f, indent=2, sort_keys=True)
+    os.replace(tmp, path)
+
+
+def _read_json(path):
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return None
+
+
+class ShardJob:
+    def __init__(self, job_dir, n_shards=None, lease_s=DEFAULT_LEASE_S, owner=None):
+        self.job_dir = job_dir
+        self.lease_s = lease_s
+        self.owner = owner or f"{socket.gethostname()}:{os.getpid()}"
+        os.makedirs(os.path.join(job_dir, "shards"), exist_ok=True)
+        job = _read_json(self.path(JOB_FILE))
+        if job is not None and n_shards is not None and job["n_shards"] != n_shards:
+            raise ValueError(f"{job_dir} was started with {job['n_shards']} shards, not {n_shards}")
+        self.n_shards = job["n_shards"] if job is not None else n_shards
+        if self.n_shards is None:
+            raise ValueError(f"{job_dir} has no {JOB_FILE}; give n_shards to start a job")
+
+    def path(self, *parts):
+        return os.path.join(self.job_dir, *parts)
+
+    def _shard_path(self, shard, ext):
+        return self.path("shards", f"{shard:04d}.{ext}")
+
+    # ---- job setup -------------------------------------------------------------------
+
+    def prepare(self, build, params=None, poll_s=2.0):
+        """
+        Run build() once for the whole job (on whichever host gets there
+        first) and record the job in job.json. Hosts arriving later, and
+        restarts, skip build() and wait for job.json. `params` must match the
+        ones the job was started with.
+        """
+        params = params or {}
+        while True:
+            job = _read_json(self.path(JOB_FILE))
+            if job is not None:
+                if job.get("params", {}) != params:
+                    raise ValueError(f"{self.job_dir} was started with {job.get('params')}, not {params}")
+                return job
+            lock_path = self.path("prepare.lock")
+            if self._acquire(lock_path):
+                try:
+                    with self._heartbeat(lock_path):
+                        build()
+                    job = {"n_shards": self.n_shards, "params": params, "owner": self.owner,
+                           "created": time.strftime("%Y-%m-%dT%H:%M:%S")}
+                    _write_json(self.path(JOB_FILE), job)
+                    return job
+                finally:
+                    self._release(lock_path)
+            time.sleep(poll_s)
+
+    # ---- claims --------------------------------------------------------------------------
+
+    def _acquire(self, lock_path):
+        """Create `lock_path` exclusively; a lock whose heartbeat is older than lease_s is taken over."""
+        try:
+            fd = os.open(lock_path, os.O_CREAT | os.O_EXCL | os.O_WRONLY, 0o644)
+        except FileExistsError:
+            if not self._stale(lock_path):
+                return False
+            # rename is atomic: of several hosts seeing the same stale lock only one moves it
+            taken = f"{lock_path}.{uuid.uuid4().hex}.stale"
+            try:
+                os.rename(lock_path, taken)
+            except FileNotFoundError:
+                return False  # released or taken over meanwhile
+            if not self._stale(taken):
+                # the lock was replaced by a live one after our check: put it back
+                try:
+                    os.link(taken, lock_path)
+                except FileExistsError:
+                    pass
+                os.remove(taken)
+                return False
+            print(f"[WARN] Taking over {lock_path}: no heartbeat for {self.lease_s}s")
+            os.remove(taken)
+            return self._acquire(lock_path)
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            f.write(self.owner)
+        return True
+
+    def _stale(self, lock_path):
+        try:
+            return time.time() - os.path.getmtime(lock_path) > self.lease_s
+        except FileNotFoundError:
+            return False  # released meanwhile; try again next round
+
+    def _release(self, lock_path):
+        try:
+            with open(lock_path, "r", encoding="utf-8") as f:
+                if f.read() != self.owner:
+                    return  # taken over after our lease lapsed
+            os.remove(lock_path)
+        except FileNotFoundError:
+            pass
+
+    def claim(self, shard):
+        """Claim `shard` for this host. False if it is finished or another live host holds it."""
+        if self.is_done(shard) or not self._acquire(self._shard_path(shard, "lock")):
+            return False
+        if self.is_done(shard):  # finished between the check and the claim
+            self._release(self._shard_path(shard, "lock"))
+            return False
+        return True
+
+    def heartbeat(self, shard):
+        self._touch(self._shard_path(shard, "lock"))
+
+    @staticmethod
+    def _touch(lock_path):
+        try:
+            os.utime(lock_path)
+        except FileNotFoundError:
+            pass
+
+    @contextmanager
+    def _heartbeat(self, lock_path):
+        """Keep `lock_path` fresh from a background thread while the block runs."""
+        stop = threading.Event()
+        beat = threading.Thread(target=self._beat, args=(lock_path, stop), daemon=True)
+        beat.start()
+        try:
+            yield
+        finally:
+            stop.set()
+            beat.join()
+
+    def release(self, shard):
+        self._release(self._shard_path(shard, "lock"))
+
+    # ---- results -------------------------------------------------------------------------
+
+    def is_done(self, shard):
+        return os.path.exists(self._shard_path(shard, "json"))
+
+    def completed(self):
+        """{shard: record} for every finished shard."""
+        records = {}
+        for shard in range(self.n_shards):
+            record = _read_json(self._shard_path(shard, "json"))
+            if record is not None:
+                records[shard] = record
+        return records
+
+    def pending(self):
+        return [shard for shard in range(self.n_shards) if not self.is_done(shard)]
+
+    def complete(self, shard, outputs=(), rows=None, seconds=None):
+        """Record `shard` as finished (its output files and rows per table) and release it."""
+        record = {"shard": shard, "outputs": list(outputs), "rows": rows or {}, "seconds": seconds,
+                  "owner": self.owner, "finished": time.strftime("%Y-%m-%dT%H:%M:%S")}
+        _write_json(self._shard_path(shard, "json"), record)
+        self.release(shard)
+        self.write_manifest()
+        return record
+
+    def manifest(self):
+        completed = self.completed()
+        return {"n_shards": self.n_shards, "completed": len(completed),
+                "pending": [s for s in range(self.n_shards) if s not in completed],
+                "shards": [completed[s] for s in sorted(completed)]}
+
+    def write_manifest(self):
+        manifest = self.manifest()
+        _write_json(self.path(MANIFEST_FILE), manifest)
+        return manifest
+
+    # ---- runner --------------------------------------------------------------------------
+
+    def run(self, mask_shard, shards=None):
+        """
+        Claim and run every unfinished shard (or those in `shards`) this host
+        can get: mask_shard(shard) -> {"outputs": [...], "rows": {...}}. A
+        background thread keeps the claim's heartbeat fresh. A failing shard
+        is released for a later run and the error re-raised. Returns the
+        shards run here.
+        """
+        ran = []
+        for shard in (range(self.n_shards) if shards is None else shards):
+            if not self.claim(shard):
+                continue
+            start = time.perf_counter()
+            try:
+                with self._heartbeat(self._shard_path(shard, "lock")):
+                    result = mask_shard(shard) or {}
+            except BaseException:
+                self.release(shard)
+                raise
+            self.complete(shard, result.get("outputs", ()), result.get("rows"), time.perf_counter() - start)
+            print(f"[INFO] Shard {shard + 1}/{self.n_shards} done")
+            ran.append(shard)
+        return ran
+
+    def _beat(self, lock_path, stop):
+        while not stop.wait(self.lease_s / 4):
+            self._touch(lock_path)
+
+    def __str__(self):
+        completed = self.completed()
+        running = [s for s in range(self.n_shards)
+                   if s not in completed and os.path.exists(self._shard_path(s, "lock"))]
+        rows = sum(sum(r.get("rows", {}).values()) for r in completed.values())
+        return (f"{self.job_dir}: {len(completed)}/{self.n_shards} shards done ({rows:,} rows), "
+                f"{len(running)} running, {self.n_shards - len(completed) - len(running)} waiting")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("command", choices=["status", "manifest"])
+    parser.add_argument("--job-dir", required=True)
+    args = parser.parse_args()
+
+    job = ShardJob(args.job_dir)
+    if args.command == "status":
+        print(f"[INFO] {job}")
+    else:
+        print(json.dumps(job.write_manifest(), indent=2))
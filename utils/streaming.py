@@ -0,0 +1,77 @@
+import sys
+import time
+from contextlib import nullcontext
+from dataclasses import dataclass
+
+from utils.writers import FrameWriter
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+
+def peak_rss_mb():
+    """Peak resident set size of this process in MB (None if unavailable)."""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is bytes on macOS, kilobytes on Linux
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+
+@dataclass
+class StreamStats:
+    table: str
+    rows: int = 0
+    chunks: int = 0
+    seconds: float = 0.0
+    peak_rss_mb: float = None
+
+    @property
+    def rows_per_sec(self):
+        return self.rows / self.seconds if self.seconds else 0.0
+
+    def __str__(self):
+        rss = f"{self.peak_rss_mb:,.0f} MB" if self.peak_rss_mb is not None else "n/a"
+        return (
+            f"{self.table}: {self.rows:,} rows in {self.chunks} chunks, "
+            f"{self.seconds:.1f}s ({self.rows_per_sec:,.0f} rows/sec), peak RSS {rss}"
+        )
+
+
+def stream_table(table, chunks, mask_fn, real_path, mock_path, fmt="csv", partition_col=None, metrics=None):
+    """
+    Mask a table chunk by chunk: each chunk from `chunks` is written to
+    `real_path`, masked in place with `mask_fn(chunk)` and written to
+    `mock_path`, then dropped. Memory stays at one chunk whatever the
+    table size; with Parquet/Arrow output every chunk is its own row group.
+    A utils.metrics.RunMetrics in `metrics` gets the fetch (with rows and
+    bytes), mask and write time of every chunk. Returns a StreamStats.
+    """
+    stats = StreamStats(table)
+    start = time.perf_counter()
+    real = FrameWriter(real_path, fmt, partition_col)
+    mock = FrameWriter(mock_path, fmt, partition_col)
+    if metrics is not None:
+        chunks = metrics.iter_stage("fetch", chunks, table)
+    try:
+        for chunk in chunks:
+            with _stage(metrics, "write", table):
+                real.write(chunk)
+            with _stage(metrics, "mask", table):
+                masked = mask_fn(chunk)
+            with _stage(metrics, "write", table):
+                mock.write(masked)
+            stats.rows += len(chunk)
+            stats.chunks += 1
+    finally:
+        real.close()
+        mock.close()
+    stats.seconds = time.perf_counter() - start
+    stats.peak_rss_mb = peak_rss_mb()
+    return stats
+
+
+def _stage(metrics, name, table):
+    return metrics.stage(name, table) if metrics is not None else nullcontext()
@@ -0,0 +1,214 @@
+"""
+Subset-with-closure extraction.
+
+Instead of truncating every table at LIMIT n rows (which keeps patients
+with half their assessments), pick N patients and pull *all* of their
+rows from every related table:
+
+    sample = sample_patients(sf_patients, "1%", by="Facility__c")
+    frames, report = fetch_closure(engine, {"assessments": "Patient__c", ...}, sample["Id"])
+    print(report)       # rows, queries and seconds per table, and the full-run estimate
+
+Patients are picked random (size as a count or "1%"), stratified (the
+same share of every `by` group) or from an explicit ID list. The random
+order is a keyed hash of the Id, so a seed always picks the same
+patients and a bigger sample contains every patient of a smaller one.
+Related rows are read with the batched keyed queries of connectors/sql.py.
+"""
+import hashlib
+import json
+import os
+import time
+from dataclasses import dataclass, field
+
+import numpy as np
+import pandas as pd
+
+from connectors.sql import IN_BATCH_SIZE, fetch_by_ids
+from utils.metrics import frame_bytes
+
+
+def parse_size(value):
+    """A sample size: an int count, or a fraction from "0.01" / "1%"."""
+    if isinstance(value, str):
+        text = value.strip()
+        if text.endswith("%"):
+            value = float(text[:-1]) / 100
+        else:
+            value = float(text) if any(c in text for c in ".eE") else int(text)
+    if value <= 0 or (isinstance(value, float) and value > 1):
+        raise ValueError(f"Sample size must be a positive count or a fraction up to 1, got {value!r}")
+    return value
+
+
+def read_ids(path):
+    """IDs from a file, one per line; blank lines, # comments and an "Id" header are skipped."""
+    with open(path, "r", encoding="utf-8") as f:
+        ids = [line.split("#", 1)[0].strip().strip('"') for line in f]
+    ids = [i for i in ids if i]
+    return ids[1:] if ids[:1] == ["Id"] else ids
+
+
+def subset_from_env(environ=os.environ):
+    """
+    sample_patients() arguments from SUBSET_PATIENTS (count or "1%"),
+    SUBSET_BY, SUBSET_IDS (an ID file) and SUBSET_SEED; None when unset.
+    """
+    size, ids_path = environ.get("SUBSET_PATIENTS"), environ.get("SUBSET_IDS")
+    if not size and not ids_path:
+        return None
+    return {
+        "size": parse_size(size) if size else None,
+        "by": environ.get("SUBSET_BY") or None,
+        "ids": read_ids(ids_path) if ids_path else None,
+        "seed": int(environ.get("SUBSET_SEED") or 0),
+    }
+
+
+def _rank(keys, seed):
+    """A seeded pseudo-random order key per id."""
+    hash_key = hashlib.blake2b(str(seed).encode("utf-8"), digest_size=8).hexdigest()
+    return pd.util.hash_array(keys.astype("str").fillna("").to_numpy(dtype=object), hash_key=hash_key)
+
+
+def _quotas(sizes, n):
+    """Split `n` over the strata in proportion to their `sizes` (largest remainder)."""
+    exact = sizes * n / sizes.sum()
+    quotas = np.floor(exact).astype(int)
+    remainder = exact - quotas
+    order = remainder.sort_values(ascending=False, kind="stable").index
+    quotas.loc[order[:n - int(quotas.sum())]] += 1
+    return quotas
+
+
+def sample_patients(patients, size=None, by=None, ids=None, seed=0, key="Id"):
+    """
+    The rows of `patients` to extract, in their original order: those whose
+    `key` is in `ids`, or `size` patients (a count or fraction) picked at
+    random, in proportion per `by` column value when given.
+    """
+    if ids is not None:
+        wanted = pd.Index(list(dict.fromkeys(ids)))
+        picked = patients[key].isin(wanted)
+        missing = len(wanted) - int(patients.loc[picked, key].nunique())
+        if missing:
+            print(f"[WARN] {missing:,} of {len(wanted):,} requested IDs are not among the patients")
+        return patients[picked].reset_index(drop=True)
+    if by is not None and by not in patients.columns:
+        raise ValueError(f"Cannot stratify by {by!r}: not a patient column")
+    size = parse_size(size)
+    total = len(patients)
+    n = min(total, round(size * total) if isinstance(size, float) else size)
+    rank = pd.Series(_rank(patients[key], seed), index=patients.index)
+    if by is None:
+        picked = rank.nsmallest(n).index
+    else:
+        groups = patients[by].astype("str").fillna("")
+        quotas = _quotas(groups.value_counts(sort=False), n)
+        # position of each row within its group, in rank order
+        position = rank.groupby(groups).rank(method="first") - 1
+        picked = patients.index[(position < groups.map(quotas)).to_numpy()]
+    return patients.loc[patients.index.isin(picked)].reset_index(drop=True)
+
+
+def id_queries(n_ids, strategy="batched", batch_size=IN_BATCH_SIZE):
+    """Queries one keyed fetch sends for `n_ids` ids (the temp-table strategy's inserts are not counted)."""
+    if strategy == "temp_table":
+        return 1
+    batched = max(1, -(-n_ids // batch_size))
+    return batched + 1 if strategy == "compare" else batched
+
+
+@dataclass
+class TableCost:
+    table: str
+    key: str
+    rows: int = 0
+    bytes: int = 0
+    queries: int = 0
+    seconds: float = 0.0
+
+
+@dataclass
+class SubsetReport:
+    patients: int
+    population: int
+    tables: dict = field(default_factory=dict)  # table -> TableCost
+
+    def add(self, table, key, rows=0, nbytes=0, queries=0, seconds=0.0):
+        cost = self.tables.setdefault(table, TableCost(table, key))
+        cost.rows += rows
+        cost.bytes += nbytes
+        cost.queries += queries
+        cost.seconds += seconds
+        return cost
+
+    @property
+    def scale(self):
+        """Full-population multiple of this sample."""
+        return self.population / self.patients if self.patients else 0.0
+
+    def to_dict(self):
+        return {
+            "patients": self.patients,
+            "population": self.population,
+            "tables": [
+                {**vars(c), "rows_per_patient": c.rows / self.patients if self.patients else 0.0,
+                 "full_rows_est": round(c.rows * self.scale), "full_seconds_est": c.seconds * self.scale}
+                for c in self.tables.values()
+            ],
+        }
+
+    def __str__(self):
+        share = f" ({self.patients / self.population:.2%})" if self.population else ""
+        lines = [f"Subset: {self.patients:,} of {self.population:,} patients{share}",
+                 f"{'table':<34}{'rows':>12}{'rows/pt':>9}{'queries':>9}{'s':>9}{'MB':>9}"
+                 f"{'full rows est':>15}{'full s est':>12}"]
+        for c in self.to_dict()["tables"]:
+            lines.append(f"{c['table'][:33]:<34}{c['rows']:>12,}{c['rows_per_patient']:>9.1f}{c['queries']:>9,}"
+                         f"{c['seconds']:>9.2f}{c['bytes'] / 1e6:>9.1f}{c['full_rows_est']:>15,}"
+                         f"{c['full_seconds_est']:>12.0f}")
+        return "\n".join(lines)
+
+    def write(self, path):
+        """Save the report as JSON (atomically)."""
+        tmp = f"{path}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(self.to_dict(), f, indent=2)
+        os.replace(tmp, path)
+        return path
+
+
+def report_from_metrics(metrics, keys, ids, population, strategies=None, batch_size=IN_BATCH_SIZE):
+    """
+    A SubsetReport for the `fetch` stages a utils.metrics.RunMetrics
+    recorded for the `keys` tables; `strategies` ({table: strategy},
+    default batched) is how each table's ids were sent.
+    """
+    n_ids = len(set(ids))
+    report = SubsetReport(n_ids, population)
+    for table, key in keys.items():
+        stage = metrics.stages.get(("fetch", table))
+        if stage is not None:
+            queries = id_queries(n_ids, (strategies or {}).get(table, "batched"), batch_size)
+            report.add(table, key, stage.rows, stage.bytes, queries, stage.wall_s)
+    return report
+
+
+def fetch_closure(engine, keys, ids, population=None, strategy="batched", batch_size=IN_BATCH_SIZE, **kwargs):
+    """
+    Every row of each table in `keys` ({table: patient id column}) that
+    belongs to one of `ids`, with no row limit, as ({table: DataFrame},
+    SubsetReport). `population` is the patient count the report scales
+    its full-run estimates to.
+    """
+    ids = list(dict.fromkeys(ids))
+    report = SubsetReport(len(ids), population or len(ids))
+    frames = {}
+    for table, key in keys.items():
+        start = time.perf_counter()
+        df = fetch_by_ids(engine, table, key, ids, strategy=strategy, batch_size=batch_size, **kwargs)
+        report.add(table, key, len(df), frame_bytes(df), id_queries(len(ids), strategy, batch_size),
+                   time.perf_counter() - start)
+        frames[table] = df
+    return frames, report
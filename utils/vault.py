@@ -0,0 +1,210 @@
+"""
+Persistent key -> pseudonym vault.
+
+A SQLite file remembering every fake ever handed out, so a patient masked
+yesterday gets the same fakes tomorrow regardless of seed handling or Faker
+version, and unchanged patients are never regenerated. make_faker_map
+consults it first and only generates fakes for keys it has not seen.
+
+    python -m utils.vault stats   --vault pseudonym_vault.sqlite
+    python -m utils.vault compact --vault pseudonym_vault.sqlite --older-than 365
+    python -m utils.vault rotate  --vault pseudonym_vault.sqlite --older-than 365 --archive vault_2025.sqlite
+"""
+import argparse
+import json
+import os
+import sqlite3
+import time
+
+import pandas as pd
+
+DEFAULT_VAULT_PATH = "pseudonym_vault.sqlite"
+# Fields that must stay unique across the whole vault, not just one run
+UNIQUE_FIELDS = ("patient_id", "patient_record_number")
+MAX_COLLISION_RETRIES = 10
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS pseudonyms (
+    namespace TEXT NOT NULL,
+    key TEXT NOT NULL,
+    patient_id TEXT,
+    patient_record_number TEXT,
+    fields TEXT NOT NULL,
+    created_at REAL NOT NULL,
+    last_seen REAL NOT NULL,
+    PRIMARY KEY (namespace, key)
+);
+CREATE UNIQUE INDEX IF NOT EXISTS ux_pseudonyms_patient_id
+    ON pseudonyms (namespace, patient_id);
+CREATE UNIQUE INDEX IF NOT EXISTS ux_pseudonyms_record_number
+    ON pseudonyms (namespace, patient_record_number);
+CREATE INDEX IF NOT EXISTS ix_pseudonyms_last_seen ON pseudonyms (last_seen);
+"""
+
+
+class PseudonymVault:
+    def __init__(self, path=None, namespace="default"):
+        self.path = path or os.getenv("PSEUDONYM_VAULT", DEFAULT_VAULT_PATH)
+        self.namespace = namespace
+        self.conn = sqlite3.connect(self.path)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.executescript(_SCHEMA)
+
+    def close(self):
+        self.conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def __len__(self):
+        return self.conn.execute(
+            "SELECT COUNT(*) FROM pseudonyms WHERE namespace = ?", (self.namespace,)
+        ).fetchone()[0]
+
+    def _load_keys(self, keys):
+        """Fill the connection's temp key table with `keys` (as text)."""
+        self.conn.execute("CREATE TEMP TABLE IF NOT EXISTS lookup_keys (key TEXT PRIMARY KEY)")
+        self.conn.execute("DELETE FROM lookup_keys")
+        self.conn.executemany(
+            "INSERT OR IGNORE INTO lookup_keys (key) VALUES (?)", ((str(k),) for k in keys)
+        )
+
+    def lookup_many(self, keys, touch=True):
+        """
+        {key: fields} for every key in `keys` already in the vault, in one
+        join. `touch` updates last_seen so compaction keeps active entries.
+        """
+        keys = list(keys)
+        by_text = {str(k): k for k in keys}
+        with self.conn:
+            self._load_keys(by_text)
+            rows = self.conn.execute(
+                "SELECT p.key, p.fields FROM pseudonyms p JOIN lookup_keys k ON k.key = p.key "
+                "WHERE p.namespace = ?",
+                (self.namespace,),
+            ).fetchall()
+            if touch and rows:
+                self.conn.execute(
+                    "UPDATE pseudonyms SET last_seen = ? WHERE namespace = ? "
+                    "AND key IN (SELECT key FROM lookup_keys)",
+                    (time.time(), self.namespace),
+                )
+        return {by_text[k]: json.loads(fields) for k, fields in rows}
+
+    def lookup_frame(self, keys, touch=True):
+        """Vault entries for `keys` as a lookup frame (index = key, one column per field)."""
+        found = self.lookup_many(pd.unique(pd.Series(keys)), touch=touch)
+        return pd.DataFrame.from_records(list(found.values()), index=list(found.keys()))
+
+    def _taken(self, field, values):
+        """The subset of `values` already used for `field` in this namespace."""
+        taken = set()
+        values = list(values)
+        for i in range(0, len(values), 900):
+            batch = values[i:i + 900]
+            placeholders = ",".join("?" * len(batch))
+            taken.update(v for (v,) in self.conn.execute(
+                f"SELECT {field} FROM pseudonyms WHERE namespace = ? AND {field} IN ({placeholders})",
+                (self.namespace, *batch),
+            ))
+        return taken
+
+    def store_many(self, mapping):
+        now = time.time()
+        with self.conn:
+            self.conn.executemany(
+                "INSERT INTO pseudonyms (namespace, key, patient_id, patient_record_number, "
+                "fields, created_at, last_seen) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (
+                    (self.namespace, str(k), f.get("patient_id"), f.get("patient_record_number"),
+                     json.dumps(f), now, now)
+                    for k, f in mapping.items()
+                ),
+            )
+
+    def get_or_create(self, keys, generate):
+        """
+        Fakes for every key: vault entries where they exist, otherwise
+        generate(new_keys, attempt) -> {key: fields}. Generated entries whose
+        unique fields clash with values already in the vault are regenerated
+        with the next `attempt` before being stored.
+        """
+        keys = list(pd.unique(pd.Series(list(keys), dtype=object)))
+        mapping = self.lookup_many(keys)
+        pending = [k for k in keys if k not in mapping]
+        for attempt in range(MAX_COLLISION_RETRIES):
+            if not pending:
+                break
+            created = generate(pending, attempt)
+            clashes = set()
+            for field in UNIQUE_FIELDS:
+                taken = self._taken(field, {f[field] for f in created.values() if f.get(field) is not None})
+                clashes.update(k for k, f in created.items() if f.get(field) in taken)
+            fresh = {k: f for k, f in created.items() if k not in clashes}
+            self.store_many(fresh)
+            mapping.update(fresh)
+            pending = [k for k in pending if k in clashes]
+        if pending:
+            raise RuntimeError(f"Could not generate unique pseudonyms for {len(pending)} keys")
+        return mapping
+
+    def compact(self, older_than_days):
+        """Delete entries not looked up for `older_than_days` and reclaim the space."""
+        cutoff = time.time() - older_than_days * 86400
+        with self.conn:
+            deleted = self.conn.execute(
+                "DELETE FROM pseudonyms WHERE namespace = ? AND last_seen < ?", (self.namespace, cutoff)
+            ).rowcount
+        self.conn.execute("VACUUM")
+        return deleted
+
+    def rotate(self, archive_path, older_than_days):
+        """Move entries not looked up for `older_than_days` into `archive_path`."""
+        cutoff = time.time() - older_than_days * 86400
+        PseudonymVault(archive_path, self.namespace).close()  # creates the schema
+        self.conn.execute("ATTACH DATABASE ? AS archive", (archive_path,))
+        try:
+            with self.conn:
+                moved = self.conn.execute(
+                    "INSERT OR REPLACE INTO archive.pseudonyms SELECT * FROM main.pseudonyms "
+                    "WHERE namespace = ? AND last_seen < ?",
+                    (self.namespace, cutoff),
+                ).rowcount
+                self.conn.execute(
+                    "DELETE FROM main.pseudonyms WHERE namespace = ? AND last_seen < ?",
+                    (self.namespace, cutoff),
+                )
+        finally:
+            self.conn.execute("DETACH DATABASE archive")
+        self.conn.execute("VACUUM")
+        return moved
+
+
+def open_vault(namespace):
+    """The vault at $PSEUDONYM_VAULT, or None when the variable is not set."""
+    path = os.getenv("PSEUDONYM_VAULT")
+    return PseudonymVault(path, namespace) if path else None
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("command", choices=["stats", "compact", "rotate"])
+    parser.add_argument("--vault", default=os.getenv("PSEUDONYM_VAULT", DEFAULT_VAULT_PATH))
+    parser.add_argument("--namespace", default="default")
+    parser.add_argument("--older-than", type=int, default=365, help="days since an entry was last looked up")
+    parser.add_argument("--archive", help="archive vault for rotate")
+    args = parser.parse_args()
+
+    with PseudonymVault(args.vault, args.namespace) as vault:
+        if args.command == "stats":
+            print(f"[INFO] {args.vault} [{args.namespace}]: {len(vault):,} entries")
+        elif args.command == "compact":
+            print(f"[INFO] Removed {vault.compact(args.older_than):,} entries")
+        else:
+            if not args.archive:
+                parser.error("rotate needs --archive")
+            print(f"[INFO] Moved {vault.rotate(args.archive, args.older_than):,} entries to {args.archive}")
@@ -0,0 +1,339 @@
+"""
+Referential-integrity verification of masked outputs.
+
+Streams every table's real and masked outputs side by side (row i of
+<table>_mock is row i of <table>_real masked) and checks:
+
+    aligned      both files have the same rows (row count, primary keys)
+    one_to_one   per patient, every column masked per patient (pseudonymized
+                 or redacted) has one value in every row and every table;
+                 the patient key and unique fields (patient ids, MRNs) map
+                 back to one patient
+    leak         no identifier (unique fields, hashes, shifted dates, first
+                 plus last name) equals the real value of its row, and no
+                 masked unique field equals a real one anywhere
+    foreign_key  every child row's patient is in salesforce_patients and its
+                 masked key is the one that patient's row got
+
+Values are reduced to 64-bit hashes as they stream past and only distinct
+(patient, value) pairs are kept, so memory grows with the number of
+patients, not rows; the checks at the end are hash joins and group-bys.
+Real values never appear in the report, only row numbers.
+
+    python -m utils.verify --output-dir mocked_output [--format parquet] [--report verify_report.json]
+    python -m utils.verify --output-dir "mocked_output/shard_job/output/*"
+"""
+import argparse
+import glob
+import json
+import os
+import time
+from dataclasses import asdict, dataclass, field
+
+import numpy as np
+import pandas as pd
+import yaml
+
+from utils.dates import DEFAULT_MAX_AGE, max_age_cutoff
+from utils.rules import default_rules_path
+from utils.vault import UNIQUE_FIELDS
+from utils.writers import iter_frames, output_path, parse_format
+
+PARENT_TABLE = "salesforce_patients"
+CHUNK_ROWS = 250_000
+MAX_EXAMPLES = 5
+# distinct pairs buffered per accumulator before they are de-duplicated again
+COMPACT_ROWS = 2_000_000
+KEYED_STRATEGIES = ("pseudonymize", "redact")
+ROW_STRATEGIES = ("hash", "date_shift")
+NAME_FIELDS = ("first_name", "last_name")
+
+
+@dataclass
+class Violation:
+    check: str
+    table: str
+    column: str = None
+    count: int = 0
+    rows: list = field(default_factory=list)  # example row numbers in the table's outputs
+    detail: str = ""
+
+    def __str__(self):
+        where = f"{self.table}.{self.column}" if self.column else self.table
+        rows = f" (e.g. rows {', '.join(map(str, self.rows))})" if self.rows else ""
+        return f"{self.check:<12}{where}: {self.count:,} {self.detail}{rows}"
+
+
+@dataclass
+class VerifyReport:
+    tables: dict = field(default_factory=dict)  # table -> rows checked
+    violations: list = field(default_factory=list)
+    seconds: float = 0.0
+
+    @property
+    def ok(self):
+        return not self.violations
+
+    def add(self, check, table, column=None, count=0, rows=(), detail=""):
+        if count:
+            self.violations.append(Violation(check, table, column, int(count), [int(r) for r in rows][:MAX_EXAMPLES],
+                                             detail))
+
+    def to_dict(self):
+        return {"ok": self.ok, "tables": self.tables, "seconds": self.seconds,
+                "violations": [asdict(v) for v in self.violations]}
+
+    def write(self, path):
+        tmp = f"{path}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(self.to_dict(), f, indent=2)
+        os.replace(tmp, path)
+        return path
+
+    def __str__(self):
+        rows = sum(self.tables.values())
+        head = f"{len(self.tables)} tables, {rows:,} rows in {self.seconds:.1f}s: "
+        if self.ok:
+            return head + "no violations"
+        return head + f"{len(self.violations)} violation(s)\n" + "\n".join(f"  {v}" for v in self.violations)
+
+
+def _hash(values):
+    """uint64 per value, compared as text; missing values hash like ""."""
+    return pd.util.hash_array(values.astype("str").fillna("").to_numpy(dtype=object))
+
+
+def _present(values):
+    return (values.notna() & (values.astype("str") != "")).to_numpy()
+
+
+class _Pairs:
+    """Distinct (a, b) uint64 pairs, de-duplicated as they accumulate."""
+
+    def __init__(self):
+        self.parts, self.buffered = [], 0
+
+    def add(self, a, b):
+        if not len(a):
+            return
+        part = pd.DataFrame({"a": a, "b": b}).drop_duplicates()
+        self.parts.append(part)
+        self.buffered += len(part)
+        if self.buffered > COMPACT_ROWS:
+            self.parts = [self.frame()]
+            self.buffered = len(self.parts[0])
+
+    def frame(self):
+        if not self.parts:
+            return pd.DataFrame({"a": np.array([], dtype=np.uint64), "b": np.array([], dtype=np.uint64)})
+        return pd.concat(self.parts, ignore_index=True).drop_duplicates()
+
+
+def column_roles(spec, columns):
+    """
+    {column: (strategy, identity)} for the columns of a table under its
+    rules `spec`. `identity` names what a per-patient column holds (a fake
+    field, a template or the column itself), so the same fake is compared
+    across tables.
+    """
+    listed = spec.get("columns") or {}
+    default = spec.get("default", "redact")
+    roles = {}
+    for col in columns:
+        rule = listed.get(col)
+        if rule is None:
+            # unlisted: a fake field (match_fake_fields) or the default; both are per patient
+            strategy = "pseudonymize" if spec.get("match_fake_fields") else default
+            strategy = strategy if isinstance(strategy, str) else strategy["strategy"]
+            roles[col] = (strategy, col)
+            continue
+        options = {"strategy": rule} if isinstance(rule, str) else rule
+        identity = options.get("field") or options.get("template") or col
+        roles[col] = (options["strategy"], identity)
+    return roles
+
+
+def _age_cap(spec, col):
+    """The clamp date of an age-capped date_shift column, else None."""
+    rule = (spec.get("columns") or {}).get(col)
+    max_age = rule.get("max_age") if isinstance(rule, dict) and rule.get("strategy") == "date_shift" else None
+    if not max_age:
+        return None
+    return pd.Timestamp(max_age_cutoff(max_age=DEFAULT_MAX_AGE if max_age is True else max_age))
+
+
+def _paired(real_frames, mock_frames, counts):
+    """(real, mock) chunks of equal length; rows left over on either side go into `counts`."""
+    real_frames, mock_frames = iter(real_frames), iter(mock_frames)
+    real = mock = None
+    while True:
+        if real is None or not len(real):
+            real = next(real_frames, None)
+        if mock is None or not len(mock):
+            mock = next(mock_frames, None)
+        if real is None or mock is None:
+            counts["real"] += (len(real) if real is not None else 0) + sum(len(f) for f in real_frames)
+            counts["mock"] += (len(mock) if mock is not None else 0) + sum(len(f) for f in mock_frames)
+            return
+        n = min(len(real), len(mock))
+        yield real.iloc[:n].reset_index(drop=True), mock.iloc[:n].reset_index(drop=True)
+        real, mock = real.iloc[n:], mock.iloc[n:]
+
+
+class Verifier:
+    """Feed it each table's outputs with add_table(), then finish() for the report."""
+
+    def __init__(self, rules=None, parent=PARENT_TABLE):
+        if rules is None:
+            with open(default_rules_path(), "r", encoding="utf-8") as f:
+                rules = yaml.safe_load(f)
+        self.specs = rules["tables"]
+        self.parent = parent
+        self.report = VerifyReport()
+        self.keyed = {}  # identity -> _Pairs(patient, masked value)
+        self.identity_tables = {}  # identity -> tables it was seen in
+        self.keys = {}  # table -> _Pairs(real key, masked key)
+        self.real_unique, self.masked_unique = {}, {}  # identity -> _Pairs(value, 0)
+        self.row_counts = {}  # (check, table, column) -> [count, example rows]
+        self._start = time.perf_counter()
+
+    def _count(self, check, table, column, hits, offset):
+        hits = np.flatnonzero(hits)
+        if not len(hits):
+            return
+        entry = self.row_counts.setdefault((check, table, column), [0, []])
+        entry[0] += len(hits)
+        entry[1].extend((hits[:MAX_EXAMPLES - len(entry[1])] + offset).tolist())
+
+    def add_table(self, table, real_frames, mock_frames):
+        """Stream one table's (real, mock) chunks; a table may be added several times (e.g. per shard)."""
+        spec = self.specs[table]
+        counts = {"real": 0, "mock": 0}
+        offset = self.report.tables.get(table, 0)
+        for real, mock in _paired(real_frames, mock_frames, counts):
+            roles = column_roles(spec, [c for c in real.columns if c in mock.columns])
+            self._check_chunk(table, spec, roles, real, mock, offset)
+            offset += len(real)
+        self.report.tables[table] = offset
+        if counts["real"] or counts["mock"]:
+            self.report.add("aligned", table, count=counts["real"] + counts["mock"],
+                            detail=f"rows without a counterpart ({counts['real']:,} real, {counts['mock']:,} masked)")
+
+    def _check_chunk(self, table, spec, roles, real, mock, offset):
+        key = spec["key"]
+        for col in spec.get("primary_key") or []:
+            if col in roles and roles[col][0] == "preserve":
+                self._count("aligned", table, col, _hash(real[col]) != _hash(mock[col]), offset)
+        if key not in real.columns:
+            return
+        has_key = _present(real[key])
+        patient = _hash(real[key])[has_key]
+        self.keys.setdefault(table, _Pairs()).add(patient, _hash(mock[key])[has_key])
+
+        names = {}
+        for col, (strategy, identity) in roles.items():
+            if strategy == "preserve" or col == key:
+                continue
+            present = _present(real[col])
+            masked = _hash(mock[col])
+            same = present & (_hash(real[col]) == masked)
+            cap = _age_cap(spec, col) if same.any() else None
+            if cap is not None:
+                # birth dates over the age cap all become the cap date: generalized, not leaked
+                same &= (pd.to_datetime(mock[col], errors="coerce", format="mixed") != cap).to_numpy()
+            if strategy in KEYED_STRATEGIES:
+                self.keyed.setdefault(identity, _Pairs()).add(patient, masked[has_key])
+                self.identity_tables.setdefault(identity, set()).add(table)
+            if identity in UNIQUE_FIELDS or strategy in ROW_STRATEGIES:
+                self._count("leak", table, col, same, offset)
+            if identity in UNIQUE_FIELDS:
+                self.real_unique.setdefault(identity, _Pairs()).add(_hash(real[col])[present], 0)
+                self.masked_unique.setdefault(identity, _Pairs()).add(masked[_present(mock[col])], 0)
+            if identity in NAME_FIELDS:
+                names[identity] = same
+        if len(names) == len(NAME_FIELDS):
+            # either name alone can match by chance; both together is the real patient's name
+            self._count("leak", table, "+".join(NAME_FIELDS), np.logical_and.reduce(list(names.values())), offset)
+
+    def finish(self):
+        report = self.report
+        for (check, table, column), (count, rows) in self.row_counts.items():
+            detail = "rows differ between real and masked" if check == "aligned" else "rows equal to the real value"
+            report.add(check, table, column, count, rows, detail)
+
+        for identity, pairs in self.keyed.items():
+            per_patient = pairs.frame().groupby("a")["b"].nunique()
+            tables = ", ".join(sorted(self.identity_tables[identity]))
+            report.add("one_to_one", tables, identity, (per_patient > 1).sum(),
+                       detail="patients with more than one masked value")
+            if identity in UNIQUE_FIELDS:
+                per_value = pairs.frame().groupby("b")["a"].nunique()
+                report.add("one_to_one", tables, identity, (per_value > 1).sum(),
+                           detail="masked values shared by several patients")
+        for table, pairs in self.keys.items():
+            frame = pairs.frame()
+            report.add("one_to_one", table, self.specs[table]["key"], (frame.groupby("b")["a"].nunique() > 1).sum(),
+                       detail="masked keys shared by several patients")
+
+        for identity, masked in self.masked_unique.items():
+            real = self.real_unique.get(identity)
+            if real is not None:
+                hits = pd.Index(masked.frame()["a"]).isin(pd.Index(real.frame()["a"]))
+                report.add("leak", "*", identity, hits.sum(), detail="masked values equal to some real value")
+
+        parent = self.keys.get(self.parent)
+        if parent is not None:
+            parent = parent.frame().drop_duplicates("a").rename(columns={"b": "parent"})
+            for table, pairs in self.keys.items():
+                if table == self.parent:
+                    continue
+                joined = pairs.frame().merge(parent, on="a", how="left", indicator=True)
+                orphan = joined["_merge"] == "left_only"
+                report.add("foreign_key", table, self.specs[table]["key"], orphan.sum(),
+                           detail=f"patients missing from {self.parent}")
+                report.add("foreign_key", table, self.specs[table]["key"],
+                           (~orphan & (joined["b"] != joined["parent"])).sum(),
+                           detail=f"patients whose masked key differs from {self.parent}")
+        report.seconds = time.perf_counter() - self._start
+        return report
+
+
+def verify_outputs(output_dirs, fmt="csv", tables=None, rules=None, chunk_rows=CHUNK_ROWS):
+    """
+    Verify the <table>_real / <table>_mock outputs in each of `output_dirs`
+    (e.g. every shard of a job). Returns a VerifyReport.
+    """
+    verifier = Verifier(rules)
+    fmt = parse_format(fmt)
+    if isinstance(output_dirs, str):
+        output_dirs = [output_dirs]
+    tables = tables or list(verifier.specs)
+    # the parent first, so children can be checked against it
+    tables = sorted(tables, key=lambda t: t != verifier.parent)
+    for output_dir in output_dirs:
+        for table in tables:
+            real_path, mock_path = (output_path(os.path.join(output_dir, f"{table}_{kind}"), fmt)
+                                    for kind in ("real", "mock"))
+            if not (os.path.exists(real_path) and os.path.exists(mock_path)):
+                continue
+            read_kwargs = {"dtype": str, "keep_default_na": False} if fmt.kind == "csv" else {}
+            verifier.add_table(table, iter_frames(real_path, fmt, chunk_rows, **read_kwargs),
+                               iter_frames(mock_path, fmt, chunk_rows, **read_kwargs))
+    return verifier.finish()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--output-dir", action="append", default=None,
+                        help="directory with <table>_real / <table>_mock outputs (repeatable, globs allowed)")
+    parser.add_argument("--format", default=os.getenv("OUTPUT_FORMAT", "csv"))
+    parser.add_argument("--table", action="append", help="only these tables (default: every table in the rules)")
+    parser.add_argument("--report", help="write the report here as JSON")
+    args = parser.parse_args()
+
+    dirs = sorted(d for pattern in (args.output_dir or ["mocked_output"]) for d in glob.glob(pattern))
+    result = verify_outputs(dirs, args.format, args.table)
+    print(f"[INFO] {result}")
+    if args.report:
+        print(f"[INFO] Report written to {result.write(args.report)}")
+    raise SystemExit(0 if result.ok else 1)
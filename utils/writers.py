@@ -0,0 +1,269 @@
+"""
+Pluggable output writers: CSV (optionally gzip/bz2 compressed), Parquet
+(snappy/zstd/...) and Arrow IPC, optionally hive-partitioned by a column
+(e.g. Facility__c or a practice GUID).
+
+A format is given as "<kind>[:<compression>]", e.g. "csv", "csv.gz",
+"parquet", "parquet:zstd", "arrow", "arrow:lz4". FrameWriter accepts frames
+chunk by chunk, so streamed tables become one Parquet row group / Arrow
+record batch per chunk instead of being collected first.
+
+pyarrow is only imported for the Parquet and Arrow formats.
+"""
+import bz2
+import gzip
+import os
+from collections import OrderedDict
+from dataclasses import dataclass
+from urllib.parse import quote, unquote
+
+import pandas as pd
+
+DEFAULT_COMPRESSION = {"csv": None, "parquet": "snappy", "arrow": None}
+CSV_OPENERS = {"gzip": gzip.open, "bz2": bz2.open}
+CSV_SUFFIXES = {None: ".csv", "gzip": ".csv.gz", "bz2": ".csv.bz2"}
+# Directory name for rows whose partition value is missing (what Hive and
+# pyarrow use, so partitioned datasets read back with nulls)
+NULL_PARTITION = "__HIVE_DEFAULT_PARTITION__"
+# Partition files a FrameWriter keeps open; the least recently written one is
+# closed beyond that (each holds a descriptor and, for Parquet, a row group buffer)
+MAX_OPEN_SINKS = 64
+
+
+@dataclass(frozen=True)
+class OutputFormat:
+    kind: str
+    compression: str = None
+
+    @property
+    def suffix(self):
+        if self.kind == "csv":
+            return CSV_SUFFIXES[self.compression]
+        return f".{self.kind}"
+
+    def __str__(self):
+        return f"{self.kind}:{self.compression}" if self.compression else self.kind
+
+
+def parse_format(spec):
+    """OutputFormat for a spec like "parquet:zstd" or "csv.gz" (an OutputFormat passes through)."""
+    if isinstance(spec, OutputFormat):
+        return spec
+    spec = (spec or "csv").lower()
+    aliases = {"csv.gz": "csv:gzip", "csv.bz2": "csv:bz2", "feather": "arrow", "ipc": "arrow"}
+    kind, _, compression = aliases.get(spec, spec).partition(":")
+    if kind not in DEFAULT_COMPRESSION:
+        raise ValueError(f"Unknown output format {spec!r}; expected one of {sorted(DEFAULT_COMPRESSION)}")
+    compression = compression or DEFAULT_COMPRESSION[kind]
+    if kind == "csv" and compression not in CSV_OPENERS and compression is not None:
+        raise ValueError(f"CSV compression must be one of {sorted(CSV_OPENERS)}, got {compression!r}")
+    return OutputFormat(kind, compression)
+
+
+def output_path(base, fmt):
+    """`base` (a path without extension) with the format's suffix."""
+    return base + parse_format(fmt).suffix
+
+
+class _CsvSink:
+    def __init__(self, path, fmt):
+        opener = CSV_OPENERS.get(fmt.compression, open)
+        self.handle = opener(path, "wt", newline="", encoding="utf-8")
+        self.header = True
+
+    def write(self, df):
+        df.to_csv(self.handle, header=self.header, index=False)
+        self.header = False
+
+    def close(self):
+        self.handle.close()
+
+
+class _ArrowSink:
+    def __init__(self, path, fmt, schema):
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        self.pa = pa
+        self.schema = schema
+        if fmt.kind == "parquet":
+            self.writer = pq.ParquetWriter(path, schema, compression=fmt.compression)
+        else:
+            options = pa.ipc.IpcWriteOptions(compression=fmt.compression)
+            self.writer = pa.ipc.new_file(path, schema, options=options)
+
+    def write(self, df):
+        table = self.pa.Table.from_pandas(df, schema=self.schema, preserve_index=False)
+        self.writer.write_table(table)
+
+    def close(self):
+        self.writer.close()
+
+
+def _arrow_schema(df):
+    import pyarrow as pa
+
+    schema = pa.Schema.from_pandas(df, preserve_index=False)
+    for i, field in enumerate(schema):
+        # an all-missing first chunk would pin a column to the null type
+        if pa.types.is_null(field.type):
+            schema = schema.set(i, field.with_type(pa.string()))
+        # categoricals are stored as their values: every chunk has its own categories
+        elif pa.types.is_dictionary(field.type):
+            schema = schema.set(i, field.with_type(field.type.value_type))
+        # integers downcast to fit the first chunk may not fit a later one
+        elif pa.types.is_integer(field.type) and field.type != pa.uint64():
+            schema = schema.set(i, field.with_type(pa.int64()))
+    return schema.remove_metadata()
+
+
+def _partition_dir(col, value):
+    name = NULL_PARTITION if pd.isna(value) else quote(str(value), safe="")
+    return f"{col}={name}"
+
+
+class FrameWriter:
+    """
+    Writes frames to `path` in `fmt`, one call per chunk.
+
+    Without `partition_col`, `path` is a single file. With it, `path` is a
+    directory with a `<col>=<value>/part-0<suffix>` file per value; the
+    column itself lives in the directory name, as in any hive-partitioned
+    dataset. At most `max_open` partition files are open at once: a value
+    written again after its file was closed continues in part-1, part-2...
+    Use as a context manager (or call close()).
+    """
+
+    def __init__(self, path, fmt="csv", partition_col=None, max_open=MAX_OPEN_SINKS):
+        self.path = str(path)
+        self.fmt = parse_format(fmt)
+        self.partition_col = partition_col
+        self.max_open = max_open
+        self.schema = None
+        self.sinks = OrderedDict()  # folder (or path) -> open sink, least recently written first
+        self.parts = {}  # folder -> part files opened so far
+        self.rows = 0
+
+    def _sink(self, path):
+        if self.fmt.kind == "csv":
+            return _CsvSink(path, self.fmt)
+        return _ArrowSink(path, self.fmt, self.schema)
+
+    def _sink_for(self, value):
+        if self.partition_col is None:
+            folder = target = self.path
+        else:
+            folder = os.path.join(self.path, _partition_dir(self.partition_col, value))
+        sink = self.sinks.get(folder)
+        if sink is not None:
+            self.sinks.move_to_end(folder)
+            return sink
+        if len(self.sinks) >= self.max_open:
+            self.sinks.popitem(last=False)[1].close()
+        if self.partition_col is not None:
+            os.makedirs(folder, exist_ok=True)
+            part = self.parts.get(folder, 0)
+            self.parts[folder] = part + 1
+            target = os.path.join(folder, f"part-{part}{self.fmt.suffix}")
+        sink = self.sinks[folder] = self._sink(target)
+        return sink
+
+    def write(self, df):
+        if self.partition_col is None:
+            parts = [(None, df)]
+        else:
+            parts = df.groupby(self.partition_col, dropna=False, sort=False)
+            parts = [(key[0] if isinstance(key, tuple) else key, part.drop(columns=self.partition_col))
+                     for key, part in parts]
+        if self.schema is None and self.fmt.kind != "csv":
+            self.schema = _arrow_schema(parts[0][1] if parts else df)
+        for value, part in parts:
+            self._sink_for(value).write(part)
+        self.rows += len(df)
+
+    def close(self):
+        for sink in self.sinks.values():
+            sink.close()
+        self.sinks = OrderedDict()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def write_frame(df, path, fmt="csv", partition_col=None):
+    """Write a whole frame with FrameWriter."""
+    with FrameWriter(path, fmt, partition_col) as writer:
+        writer.write(df)
+
+
+def _partition_files(path):
+    for root, _, files in sorted(os.walk(path)):
+        for name in sorted(files):
+            values = {}
+            for part in os.path.relpath(root, path).split(os.sep):
+                col, sep, value = part.partition("=")
+                if sep:
+                    values[col] = None if value == NULL_PARTITION else unquote(value)
+            yield os.path.join(root, name), values
+
+
+def _hive_partitioning(path):
+    """String-typed hive partitioning for the `<col>=` directories under `path`."""
+    import pyarrow as pa
+    import pyarrow.dataset as ds
+
+    cols = []
+    level = path
+    while True:
+        dirs = [d for d in sorted(os.listdir(level)) if "=" in d and os.path.isdir(os.path.join(level, d))]
+        if not dirs:
+            break
+        cols.append(dirs[0].partition("=")[0])
+        level = os.path.join(level, dirs[0])
+    schema = pa.schema([(c, pa.string()) for c in cols])
+    return ds.HivePartitioning(schema, null_fallback=NULL_PARTITION)
+
+
+def read_frame(path, fmt="csv", **read_kwargs):
+    """Read back a file or partitioned directory written by FrameWriter."""
+    fmt = parse_format(fmt)
+    path = str(path)
+    if fmt.kind != "csv":
+        import pyarrow.dataset as ds
+
+        partitioning = _hive_partitioning(path) if os.path.isdir(path) else None
+        dataset_format = "parquet" if fmt.kind == "parquet" else "ipc"
+        return ds.dataset(path, format=dataset_format, partitioning=partitioning).to_table().to_pandas()
+    compression = fmt.compression
+    if not os.path.isdir(path):
+        return pd.read_csv(path, compression=compression, **read_kwargs)
+    frames = []
+    for file, values in _partition_files(path):
+        frames.append(pd.read_csv(file, compression=compression, **read_kwargs).assign(**values))
+    return pd.concat(frames, ignore_index=True) if frames else pd.DataFrame()
+
+
+def iter_frames(path, fmt="csv", chunk_rows=100_000, **read_kwargs):
+    """
+    Read back a file or partitioned directory written by FrameWriter in
+    chunks of at most `chunk_rows` rows, in the order read_frame returns them.
+    """
+    fmt = parse_format(fmt)
+    path = str(path)
+    if fmt.kind != "csv":
+        import pyarrow.dataset as ds
+
+        partitioning = _hive_partitioning(path) if os.path.isdir(path) else None
+        dataset_format = "parquet" if fmt.kind == "parquet" else "ipc"
+        dataset = ds.dataset(path, format=dataset_format, partitioning=partitioning)
+        for batch in dataset.to_batches(batch_size=chunk_rows):
+            if batch.num_rows:
+                yield batch.to_pandas()
+        return
+    files = _partition_files(path) if os.path.isdir(path) else [(path, {})]
+    for file, values in files:
+        for chunk in pd.read_csv(file, compression=fmt.compression, chunksize=chunk_rows, **read_kwargs):
+            yield chunk.assign(**values)